@@ -0,0 +1,268 @@
+"""
+Headless HTTP API over the chat pipeline, for IDE plugins and internal tools.
+
+    POST /v1/chat       {"mode", "input", "language", "messages", "model", "speech", "voice", "force_refresh",
+                         "stream"}
+                        streams server-sent events: "queued" {"position"}, "delta" {"text"},
+                        "snippet" {...} as each code block closes, then "done" with the whole
+                        result; with "stream": false the result is returned as one JSON object
+    POST /v1/snippets   {"text"} -> {"snippets": [{"id", "filename", "language", "code", "content_hash"}]}
+    POST /v1/speech     {"text", "voice", "rate", "pitch"} -> {"audio": "/v1/audio/<file>"}
+    GET  /v1/audio/<file>  the synthesized MP3
+    GET  /v1/models     models the configured backends serve
+    GET  /v1/health     backend stats and queue depths
+
+Requests are streamed by the same jobs, schedulers and caches as the
+Streamlit app; the event loop only waits on them, so one process holds
+hundreds of open streams. Clients can send X-Session-Id to be scheduled
+fairly as one session (the client address is used otherwise).
+
+    python api.py --port 8080
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+import threading
+
+# Every open stream holds a job worker thread and an upstream connection while it runs
+os.environ.setdefault("CHATAPP_JOB_WORKERS", "512")
+os.environ.setdefault("CHATAPP_HTTP_POOL_SIZE", "512")
+
+from aiohttp import web  # noqa: E402
+
+import metrics  # noqa: E402
+import pipeline  # noqa: E402
+from audio_cache import get_audio_cache  # noqa: E402
+from code_blocks import LANGUAGE_ALIASES, FenceParser  # noqa: E402
+from jobs import ERROR  # noqa: E402
+from providers import get_router  # noqa: E402
+from scheduler import get_chat_scheduler, get_tts_scheduler  # noqa: E402
+from snippet_store import SnippetStore  # noqa: E402
+from vqd import ConversationToken  # noqa: E402
+
+_AUDIO_NAME = re.compile(r"^[0-9a-f]{64}\.mp3$")
+# How often a queued stream re-sends its position
+_POLL_SECONDS = 0.5
+
+
+def _audio_url(path):
+    return f"/v1/audio/{os.path.basename(path)}" if path else None
+
+
+def _session(request):
+    return request.headers.get("X-Session-Id") or request.remote or "anonymous"
+
+
+async def _json_body(request):
+    try:
+        body = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise web.HTTPBadRequest(text="Expected a JSON body")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text="Expected a JSON object")
+    return body
+
+
+def _result(job):
+    return {
+        "status": job.status,
+        "error": job.error,
+        "text": job.text,
+        "backend": job.backend,
+        "model": job.model,
+        "cached": job.cached,
+        "snippets": pipeline.describe_snippets(job.code_blocks),
+        "audio": _audio_url(job.audio),
+    }
+
+
+def _event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+
+
+def start_chat(body, session):
+    """
+    Validate a /v1/chat body and start its job
+
+    Returns:
+        jobs.ChatJob: The running job
+    """
+    mode = body.get("mode", "chat")
+    if mode not in pipeline.MODES:
+        raise web.HTTPBadRequest(text=f"Unknown mode {mode!r}; expected one of {', '.join(pipeline.MODES)}")
+    user_input = body.get("input")
+    if not isinstance(user_input, str) or not user_input.strip():
+        raise web.HTTPBadRequest(text="\"input\" must be a non-empty string")
+    model = body.get("model")
+    if model is not None and model not in get_router().models():
+        raise web.HTTPBadRequest(text=f"Unknown model {model!r}")
+    history = [
+        {"id": f"history-{index}", "role": message["role"], "content": message["content"]}
+        for index, message in enumerate(body.get("messages") or ())
+        if isinstance(message, dict) and message.get("role") in ("user", "assistant")
+        and isinstance(message.get("content"), str)
+    ]
+
+    speech = None
+    if body.get("speech"):
+        from tts import DEFAULT_VOICE, StreamingSpeech
+        speech = StreamingSpeech(voice=body.get("voice") or DEFAULT_VOICE, session=session)
+    # The language of the code, if the client says (it lets equivalent code share cached answers)
+    language = body.get("language")
+    language = LANGUAGE_ALIASES.get(language.strip().lower()) if isinstance(language, str) else None
+    # Every request is its own upstream conversation
+    return pipeline.submit_turn(mode, user_input, history, ConversationToken(), speech,
+                                force_refresh=bool(body.get("force_refresh")), model=model, session=session,
+                                language=language)
+
+
+async def chat(request):
+    body = await _json_body(request)
+    job = start_chat(body, _session(request))
+
+    loop = asyncio.get_running_loop()
+    changed = asyncio.Event()
+    # Deltas arrive far faster than one wakeup per delta is worth; while a
+    # wakeup is pending, later changes ride along with it
+    pending = threading.Event()
+
+    def wake():
+        pending.clear()
+        changed.set()
+
+    def on_change():
+        if not pending.is_set():
+            pending.set()
+            loop.call_soon_threadsafe(wake)
+
+    job.watch(on_change)
+    try:
+        if body.get("stream", True) is False:
+            while not job.done:
+                await changed.wait()
+                changed.clear()
+            return web.json_response(_result(job), status=500 if job.status == ERROR else 200)
+        return await _stream_job(request, job, changed)
+    finally:
+        job.unwatch(on_change)
+        if not job.done:
+            # The client went away
+            job.cancel()
+
+
+async def _stream_job(request, job, changed):
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    await response.prepare(request)
+    offset = 0
+    # Snippets are parsed here rather than read from the job, so each is sent exactly once
+    parser = FenceParser()
+    store = SnippetStore()
+    position = None
+    while True:
+        done = job.done
+        text = job.text
+        if len(text) > offset:
+            delta = text[offset:]
+            offset = len(text)
+            await response.write(_event("delta", {"text": delta}))
+            for snippet in pipeline.describe_snippets(parser.feed(delta), store):
+                await response.write(_event("snippet", snippet))
+        elif not done:
+            current = job.queue_position()
+            if current and current != position:
+                await response.write(_event("queued", {"position": current}))
+            position = current
+        if done:
+            break
+        if request.transport is None or request.transport.is_closing():
+            # The client went away; the caller cancels the job
+            return response
+        try:
+            await asyncio.wait_for(changed.wait(), _POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        changed.clear()
+
+    result = _result(job)
+    del result["text"], result["snippets"]
+    result["chars"] = offset
+    await response.write(_event("done", result))
+    await response.write_eof()
+    return response
+
+
+async def snippets(request):
+    body = await _json_body(request)
+    text = body.get("text")
+    if not isinstance(text, str):
+        raise web.HTTPBadRequest(text="\"text\" must be a string")
+    return web.json_response({"snippets": pipeline.describe_snippets(FenceParser().feed(text))})
+
+
+async def speech(request):
+    from tts import DEFAULT_PITCH, DEFAULT_RATE, DEFAULT_VOICE, text_to_speech
+
+    body = await _json_body(request)
+    text = body.get("text")
+    if not isinstance(text, str) or not text.strip():
+        raise web.HTTPBadRequest(text="\"text\" must be a non-empty string")
+    session = _session(request)
+    # text_to_speech waits on the TTS loop; keep that wait off the event loop
+    path = await asyncio.get_running_loop().run_in_executor(
+        None, lambda: text_to_speech(text, body.get("voice") or DEFAULT_VOICE, body.get("rate") or DEFAULT_RATE,
+                                     body.get("pitch") or DEFAULT_PITCH, session=session))
+    if not path:
+        raise web.HTTPUnprocessableEntity(text="Nothing to speak, or synthesis failed")
+    return web.json_response({"audio": _audio_url(path)})
+
+
+async def audio(request):
+    name = request.match_info["name"]
+    if not _AUDIO_NAME.match(name):
+        raise web.HTTPNotFound()
+    path = os.path.join(get_audio_cache().directory, name)
+    if not os.path.exists(path):
+        raise web.HTTPNotFound()
+    return web.FileResponse(path, headers={"Content-Type": "audio/mpeg"})
+
+
+async def models(request):
+    return web.json_response({"models": get_router().models()})
+
+
+async def health(request):
+    queues = {}
+    for scheduler in (get_chat_scheduler(), get_tts_scheduler()):
+        waiting, in_flight = scheduler.depth()
+        queues[scheduler.name] = {"waiting": waiting, "in_flight": in_flight, "capacity": scheduler.capacity}
+    return web.json_response({"status": "ok", "backends": get_router().snapshot(), "queues": queues})
+
+
+def create_app():
+    app = web.Application(client_max_size=4 * 1024 * 1024)
+    app.router.add_post("/v1/chat", chat)
+    app.router.add_post("/v1/snippets", snippets)
+    app.router.add_post("/v1/speech", speech)
+    app.router.add_get("/v1/audio/{name}", audio)
+    app.router.add_get("/v1/models", models)
+    app.router.add_get("/v1/health", health)
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args(argv)
+
+    # Metrics endpoint/file, if configured (CHATAPP_METRICS_PORT / CHATAPP_METRICS_FILE)
+    metrics.start_exporter()
+    web.run_app(create_app(), host=args.host, port=args.port, print=lambda message: print(message, flush=True))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+import functools
+import json
+import os
+import re
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+_CSS_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+
+
+@functools.lru_cache(maxsize=None)
+def load_css(name="style.css"):
+    """
+    Read a stylesheet from static/ once per process
+
+    Returns:
+        str: The CSS with comments and runs of whitespace removed
+    """
+    with open(os.path.join(STATIC_DIR, name), encoding="utf-8") as f:
+        return " ".join(_CSS_COMMENT.sub("", f.read()).split())
+
+
+@functools.lru_cache(maxsize=None)
+def style_injector(css, element_id="chatapp-style"):
+    """
+    HTML for a zero-height component that puts ``css`` into the page's
+    <head>. Unlike a <style> element sent with st.markdown, which every
+    rerun has to send again or Streamlit removes it, the stylesheet stays
+    in the page once added, so a session only needs this on its first run.
+
+    Returns:
+        str: A <script> block
+    """
+    # "</" would end the script early
+    css_literal = json.dumps(css).replace("</", "<\\/")
+    return f"""<script>
+const page = window.parent.document;
+let style = page.getElementById("{element_id}");
+if (!style) {{
+    style = page.createElement("style");
+    style.id = "{element_id}";
+    page.head.appendChild(style);
+}}
+style.textContent = {css_literal};
+</script>"""
+
+
+@functools.lru_cache(maxsize=None)
+def audio_chainer():
+    """
+    HTML for a script that plays a spoken answer's segments back to back.
+    Each segment is its own player in the answer's container; when one
+    ends, the next one in the same container starts, and if the next one
+    hasn't arrived yet it starts as soon as it is added. Like the
+    stylesheet, the listeners stay in the page once added.
+
+    Returns:
+        str: A <script> block
+    """
+    return """<script>
+const page = window.parent.document;
+if (!page.chatappAudioChain) {
+    page.chatappAudioChain = true;
+    const group = (audio) => audio.closest('[data-testid="stVerticalBlock"]');
+    page.addEventListener("ended", (event) => {
+        const audio = event.target;
+        if (audio.tagName !== "AUDIO" || !group(audio)) return;
+        const players = Array.from(group(audio).querySelectorAll("audio"));
+        const next = players[players.indexOf(audio) + 1];
+        if (next) {
+            next.play();
+        } else {
+            group(audio).dataset.chatappWaiting = "1";
+        }
+    }, true);
+    new MutationObserver((mutations) => {
+        for (const mutation of mutations) {
+            for (const node of mutation.addedNodes) {
+                const audio = node.tagName === "AUDIO" ? node : node.querySelector && node.querySelector("audio");
+                const block = audio && group(audio);
+                if (block && block.dataset.chatappWaiting) {
+                    delete block.dataset.chatappWaiting;
+                    audio.play();
+                }
+            }
+        }
+    }).observe(page.body, {childList: true, subtree: true});
+}
+</script>"""
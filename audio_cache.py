@@ -0,0 +1,160 @@
+import collections
+import hashlib
+import os
+import tempfile
+import threading
+import uuid
+
+CACHE_DIR = os.environ.get("TTS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "chatapp-tts-cache"))
+CACHE_MAX_BYTES = int(os.environ.get("TTS_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+_PARTIAL_SUFFIX = ".part"
+
+
+class AudioCache:
+    """
+    Content-addressed on-disk cache of synthesized MP3 files.
+
+    Entries are keyed by a hash of everything that affects the audio (see
+    make_key) and evicted least-recently-used first once the directory grows
+    past ``max_bytes``. Files are written under a temporary name and renamed
+    into place, so a reader never sees a half-written file; leftovers from an
+    interrupted write are removed when the cache is opened.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = collections.OrderedDict()  # key -> size, oldest first
+        self._size = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def make_key(*parts):
+        """Hash the parts (cleaned text, voice, rate, pitch, ...) into a cache key"""
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(str(part).encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.mp3")
+
+    def get(self, key):
+        """
+        Look up a cached file
+
+        Returns:
+            str: Path to the cached MP3, or None on a miss
+        """
+        with self._lock:
+            if key in self._entries and os.path.exists(self.path(key)):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                hit = True
+            else:
+                self._drop(key)
+                self.misses += 1
+                hit = False
+        if not hit:
+            return None
+        path = self.path(key)
+        try:
+            os.utime(path)  # Keeps the LRU order across restarts
+        except OSError:
+            pass
+        return path
+
+    def reserve(self, key):
+        """Return a unique temporary path to write a new entry to"""
+        return os.path.join(self.directory, f"{key}.{uuid.uuid4().hex}{_PARTIAL_SUFFIX}")
+
+    def commit(self, key, partial_path):
+        """
+        Atomically move a fully written file into the cache
+
+        Returns:
+            str: Path of the cache entry, or None if the file was empty
+        """
+        if not os.path.exists(partial_path) or os.path.getsize(partial_path) == 0:
+            self.discard(partial_path)
+            return None
+        path = self.path(key)
+        size = os.path.getsize(partial_path)
+        os.replace(partial_path, path)
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = size
+            self._size += size
+            self._evict()
+        return path
+
+    def discard(self, partial_path):
+        try:
+            os.remove(partial_path)
+        except OSError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _load(self):
+        """Index existing entries by modification time and remove orphans"""
+        found = []
+        for name in os.listdir(self.directory):
+            full_path = os.path.join(self.directory, name)
+            if name.endswith(_PARTIAL_SUFFIX):
+                self.discard(full_path)
+            elif name.endswith(".mp3"):
+                stat = os.stat(full_path)
+                if stat.st_size == 0:
+                    self.discard(full_path)
+                else:
+                    found.append((stat.st_mtime, name[:-len(".mp3")], stat.st_size))
+        with self._lock:
+            for _, key, size in sorted(found):
+                self._entries[key] = size
+                self._size += size
+            self._evict()
+
+    def _drop(self, key):
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._size -= size
+
+    def _evict(self):
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._size -= size
+            self.evictions += 1
+            self.discard(self.path(key))
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_audio_cache():
+    """Return the process-wide :class:`AudioCache`, creating it on first use"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AudioCache()
+    return _cache
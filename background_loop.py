@@ -0,0 +1,108 @@
+import asyncio
+import atexit
+import threading
+
+
+class BackgroundLoop:
+    """
+    A long-lived asyncio event loop running on its own daemon thread.
+
+    Any thread (typically a Streamlit script thread) can hand it coroutines
+    with submit() and gets a ``concurrent.futures.Future`` back. At most
+    ``max_concurrency`` submitted coroutines run at the same time; the rest
+    wait their turn on the loop, which gives back-pressure across every
+    session in the process.
+    """
+
+    def __init__(self, name="background-loop", max_concurrency=4):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self._loop = None
+        self._thread = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        """The running event loop, started on first access"""
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                self._start()
+            return self._loop
+
+    def submit(self, coro, limited=True):
+        """
+        Schedule a coroutine on the loop (thread-safe)
+
+        Args:
+            coro: The coroutine to run
+            limited (bool): Wait for one of the ``max_concurrency`` slots; pass
+                False for work that does its own admission control
+
+        Returns:
+            concurrent.futures.Future: Resolves to the coroutine's result
+        """
+        return asyncio.run_coroutine_threadsafe(self._limited(coro) if limited else coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the loop and block until it finishes"""
+        return self.submit(coro).result(timeout)
+
+    def in_flight(self):
+        """Number of submitted coroutines currently holding a slot"""
+        if self._slots is None:
+            return 0
+        return self.max_concurrency - self._slots._value
+
+    def shutdown(self, timeout=5.0):
+        """Cancel outstanding work, stop the loop and join its thread"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = self._slots = None
+        if loop is None or loop.is_closed():
+            return
+
+        async def cancel_all():
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        try:
+            asyncio.run_coroutine_threadsafe(cancel_all(), loop).result(timeout)
+        except Exception as e:
+            print(f"Background loop shutdown error: {str(e)}")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+        if not thread.is_alive():
+            loop.close()
+
+    def _start(self):
+        self._loop = asyncio.new_event_loop()
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._thread = threading.Thread(target=self._run, args=(self._loop,), name=self.name, daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _run(loop):
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    async def _limited(self, coro):
+        async with self._slots:
+            return await coro
+
+
+_background_loop = None
+_background_loop_lock = threading.Lock()
+
+
+def get_background_loop():
+    """Return the process-wide :class:`BackgroundLoop`, creating it on first use"""
+    global _background_loop
+    if _background_loop is None:
+        with _background_loop_lock:
+            if _background_loop is None:
+                _background_loop = BackgroundLoop(name="tts-loop")
+                atexit.register(_background_loop.shutdown)
+    return _background_loop
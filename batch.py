@@ -0,0 +1,296 @@
+"""
+Run the explain/debug/optimize modes over many source files at once.
+
+Every file matched by the given directories or globs is sent through each
+chosen mode, a few at a time, and every result is appended to a JSONL file
+as soon as it is ready. Code blocks in the answers are saved next to it,
+named the way the snippet sidebar names them. Running the same command
+again skips every (file content, mode) that was already settled: answered
+(by the --model asked for, if one was), or found too large. An
+interrupted or partly failed run picks up where it stopped; changed files
+are processed again.
+
+    python batch.py src/ "tests/**/*.py" --modes explain,optimize --output review.jsonl
+    python batch.py src/ --output review.jsonl   # again: only new, changed or failed files
+
+Each output line is one JSON object: file, content_hash, mode,
+requested_model (null when the router picked), status, error, backend and
+model (the ones that answered, also for answers replayed from the cache),
+cached, answer, snippets (paths of the saved files), answer_tokens,
+seconds and attempts.
+"""
+import argparse
+import collections
+import concurrent.futures
+import glob
+import json
+import os
+import sys
+import threading
+import time
+
+import pipeline
+from chat import PROMPT_TEMPLATES
+from code_blocks import EXTENSIONS, extract_code_snippets
+from context import estimate_tokens
+from jobs import DONE
+from snippet_store import SnippetStore, content_hash
+from vqd import ConversationToken
+
+# Source files picked up from a directory (globs match whatever they match)
+SOURCE_EXTENSIONS = tuple(f".{ext}" for ext in EXTENSIONS.values() if ext != "txt")
+# Language of a file by its ending, so comments can be ignored when matching cached answers
+LANGUAGES = {f".{ext}": language for language, ext in EXTENSIONS.items() if ext != "txt"}
+# Scheduler session the batch's requests are admitted as
+SESSION = "batch"
+# Status of a file not sent because of its size
+TOO_LARGE = "too_large"
+
+
+def find_files(patterns, extensions=SOURCE_EXTENSIONS):
+    """
+    Expand directories and globs into files
+
+    Args:
+        patterns (list): Directories (walked recursively, hidden entries skipped) and glob patterns
+        extensions (tuple): File endings taken from directories
+
+    Returns:
+        list: Sorted file paths, each once
+    """
+    files = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, dirs, names in os.walk(pattern):
+                dirs[:] = [name for name in dirs if not name.startswith(".")]
+                files.update(os.path.join(root, name) for name in names
+                             if name.endswith(extensions) and not name.startswith("."))
+        else:
+            files.update(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+    return sorted(files)
+
+
+def settled_results(output_path):
+    """
+    Read which (content_hash, mode) pairs an earlier output already settled
+
+    Returns:
+        dict: (content_hash, mode) -> set of the models that answered it, plus
+            TOO_LARGE if the file was found too large; empty if the output doesn't exist yet
+    """
+    settled = collections.defaultdict(set)
+    if not os.path.exists(output_path):
+        return settled
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by an interrupted run
+                continue
+            if record.get("status") == DONE:
+                settled[record["content_hash"], record["mode"]].add(record.get("model"))
+            elif record.get("status") == TOO_LARGE:
+                settled[record["content_hash"], record["mode"]].add(TOO_LARGE)
+    return settled
+
+
+def save_snippets(answer, directory):
+    """
+    Write the code blocks of an answer to ``directory``
+
+    Returns:
+        list: Paths of the written files, in answer order
+    """
+    codes, languages = extract_code_snippets(answer)
+    store = SnippetStore()
+    paths = []
+    for code, language in zip(codes, languages):
+        if not code.strip():
+            continue
+        count = len(store)
+        snippet = store.add(code, language)
+        if len(store) == count:
+            continue
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, snippet.filename)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(snippet.code)
+        paths.append(path)
+    return paths
+
+
+class BatchRun:
+    """
+    One pass over a set of files.
+
+    Args:
+        output_path (str): JSONL file results are appended to
+        snippets_dir (str): Where code blocks of the answers are saved
+        modes (list): Modes to run every file through
+        model (str): Model to ask, or None to let the router pick the backend
+        concurrency (int): Files processed at once
+        retries (int): Extra attempts for a failed request, with exponential backoff
+        max_bytes (int): Larger files are recorded as skipped instead of sent
+    """
+
+    def __init__(self, output_path, snippets_dir, modes, model=None, concurrency=4, retries=2, max_bytes=100_000):
+        self.output_path = output_path
+        self.snippets_dir = snippets_dir
+        self.modes = modes
+        self.model = model
+        self.concurrency = concurrency
+        self.retries = retries
+        self.max_bytes = max_bytes
+        self.stats = {"done": 0, "error": 0, "skipped": 0, TOO_LARGE: 0, "cached": 0, "answer_tokens": 0}
+        self._files_done = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._active = set()
+
+    def run(self, files):
+        """
+        Process every (file, mode) the output hasn't settled yet
+
+        Returns:
+            dict: Counts, throughput and elapsed time
+        """
+        settled = settled_results(self.output_path)
+        tasks = []
+        for path in files:
+            try:
+                with open(path, encoding="utf-8") as f:
+                    code = f.read()
+            except (OSError, UnicodeDecodeError) as e:
+                print(f"Skipping {path}: {str(e)}", file=sys.stderr)
+                continue
+            digest = content_hash(code)
+            too_large = len(code.encode("utf-8")) > self.max_bytes
+            for mode in self.modes:
+                if self._settled(settled.get((digest, mode), ()), too_large):
+                    self.stats["skipped"] += 1
+                else:
+                    tasks.append((path, code, digest, mode))
+
+        started = time.perf_counter()
+        with open(self.output_path, "a", encoding="utf-8") as output:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency,
+                                                             thread_name_prefix="batch")
+            try:
+                futures = [executor.submit(self._process, output, *task) for task in tasks]
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+            except KeyboardInterrupt:
+                # Finished results are already written; the next run resumes from them
+                self._stop.set()
+                with self._lock:
+                    for job in self._active:
+                        job.cancel()
+                print("Interrupted; run again to resume", file=sys.stderr)
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
+        return self._summary(len(tasks), time.perf_counter() - started)
+
+    def _process(self, output, path, code, digest, mode):
+        if self._stop.is_set():
+            return
+        record = {"file": path, "content_hash": digest, "mode": mode, "requested_model": self.model}
+        started = time.perf_counter()
+        if len(code.encode("utf-8")) > self.max_bytes:
+            record.update(status=TOO_LARGE, error=f"Larger than {self.max_bytes} bytes")
+        else:
+            job, attempts = self._ask(mode, code, LANGUAGES.get(os.path.splitext(path)[1].lower()))
+            answer = job.text if job.status == DONE else ""
+            # An answer cached before the cache kept its origin was asked of the requested model
+            model = job.model or (self.model if job.cached else None)
+            record.update(status=job.status, error=job.error, backend=job.backend, model=model, cached=job.cached,
+                          answer=answer, snippets=save_snippets(answer, self._snippet_dir(path, mode)),
+                          answer_tokens=estimate_tokens(answer), attempts=attempts)
+        record["seconds"] = round(time.perf_counter() - started, 3)
+        if self._stop.is_set() and record["status"] != DONE:
+            return
+
+        with self._lock:
+            output.write(json.dumps(record) + "\n")
+            output.flush()
+            status = record["status"] if record["status"] in self.stats else "error"
+            self.stats[status] += 1
+            if record["status"] == DONE:
+                self._files_done.add(path)
+                self.stats["cached"] += record["cached"]
+                if not record["cached"]:
+                    self.stats["answer_tokens"] += record["answer_tokens"]
+            print(f"{record['status']:>9}  {mode:<8} {path} ({record['seconds']:.1f}s)", file=sys.stderr)
+
+    def _settled(self, results, too_large):
+        # A file over the size limit is settled once recorded as such; raising --max-bytes sends it again
+        if too_large:
+            return TOO_LARGE in results
+        answered = {model for model in results if model != TOO_LARGE}
+        return self.model in answered if self.model else bool(answered)
+
+    def _ask(self, mode, code, language):
+        # Each file is its own conversation, with no earlier history
+        for attempt in range(1, self.retries + 2):
+            job = pipeline.submit_turn(mode, code, [], ConversationToken(), model=self.model, session=SESSION,
+                                       session_limit=self.concurrency, language=language)
+            with self._lock:
+                self._active.add(job)
+            try:
+                while not job.done:
+                    job.wait(len(job.text), timeout=1.0)
+            finally:
+                with self._lock:
+                    self._active.discard(job)
+            if job.status == DONE or attempt > self.retries or self._stop.is_set():
+                return job, attempt
+            time.sleep(0.5 * 2 ** (attempt - 1))
+
+    def _snippet_dir(self, path, mode):
+        relative = os.path.relpath(path)
+        if relative.startswith(os.pardir):
+            relative = os.path.abspath(path).lstrip(os.sep)
+        return os.path.join(self.snippets_dir, f"{relative}.{mode}")
+
+    def _summary(self, tasks, elapsed):
+        minutes = elapsed / 60
+        return dict(
+            self.stats,
+            tasks=tasks,
+            files=len(self._files_done),
+            elapsed_s=round(elapsed, 2),
+            files_per_minute=round(len(self._files_done) / minutes, 2) if minutes else 0.0,
+            tokens_per_second=round(self.stats["answer_tokens"] / elapsed, 2) if elapsed else 0.0,
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="Directories or glob patterns (quote globs)")
+    parser.add_argument("--modes", default="explain", help=f"Comma-separated, from {', '.join(PROMPT_TEMPLATES)}")
+    parser.add_argument("--output", default="batch_results.jsonl", help="JSONL results, appended to")
+    parser.add_argument("--snippets-dir", help="Where code blocks are saved (default: <output>_snippets)")
+    parser.add_argument("--model", help="Model to ask (default: the router picks)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Files processed at once")
+    parser.add_argument("--retries", type=int, default=2, help="Extra attempts for a failed request")
+    parser.add_argument("--max-bytes", type=int, default=100_000, help="Skip larger files")
+    args = parser.parse_args(argv)
+
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    unknown = [mode for mode in modes if mode not in PROMPT_TEMPLATES]
+    if unknown or not modes:
+        parser.error(f"Unknown modes {', '.join(unknown)}; choose from {', '.join(PROMPT_TEMPLATES)}")
+    files = find_files(args.paths)
+    if not files:
+        parser.error("No files matched")
+
+    snippets_dir = args.snippets_dir or f"{os.path.splitext(args.output)[0]}_snippets"
+    run = BatchRun(args.output, snippets_dir, modes, model=args.model, concurrency=args.concurrency,
+                   retries=args.retries, max_bytes=args.max_bytes)
+    summary = run.run(files)
+    print(json.dumps(summary, indent=2))
+    return 1 if summary["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""
+Load test of api.py: many concurrent SSE chat streams on one process.
+
+Starts mock_servers.py and api.py in subprocesses (api.py pointed at the
+stand-ins), then opens --streams chat streams at once, each with its own
+input so none are coalesced. Reported as JSON:
+
+- first_delta_ms  p50/p95/max time from the request to its first "delta" event
+- total_ms        p50/p95/max time to the "done" event
+- errors          streams that failed or did not finish with status "done"
+- snippets        "snippet" events received, over all streams
+- wall_s          time for every stream to finish
+- cpu_s           CPU time used by api.py and by the stand-ins
+
+    python bench/api_benchmark.py --streams 300
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_mock_servers(args):
+    """Start mock_servers.py in a subprocess and return (process, base URL)"""
+    command = [sys.executable, os.path.join(ROOT, "bench", "mock_servers.py"),
+               "--token-rate", str(args.token_rate), "--latency", str(args.latency)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line.startswith("listening on "):
+        process.kill()
+        raise RuntimeError(f"Mock servers failed to start: {line!r}")
+    return process, line[len("listening on "):].strip()
+
+
+async def start_api(mock_url, args):
+    """Start api.py in a subprocess and return (process, base URL) once it answers"""
+    port = _free_port()
+    env = dict(os.environ, DDG_BASE_URL=mock_url, CHATAPP_BACKENDS="ddg", CHATAPP_STORAGE="memory",
+               TTS_VOICES_OFFLINE="1", CHATAPP_CHAT_MAX_CONCURRENCY=str(args.capacity),
+               CHATAPP_CHAT_SESSION_CONCURRENCY=str(args.capacity))
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "api.py"), "--port", str(port)], cwd=ROOT,
+                               env=env, stdout=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    async with aiohttp.ClientSession() as session:
+        for _ in range(200):
+            try:
+                async with session.get(f"{base_url}/v1/health") as response:
+                    if response.status == 200:
+                        return process, base_url
+            except aiohttp.ClientConnectionError:
+                pass
+            await asyncio.sleep(0.1)
+    process.kill()
+    raise RuntimeError("api.py failed to start")
+
+
+async def one_stream(session, base_url, index):
+    started = time.perf_counter()
+    result = {"first_delta": None, "total": None, "snippets": 0, "ok": False}
+    body = {"mode": "chat", "input": f"Explain moving averages ({index})"}
+    try:
+        async with session.post(f"{base_url}/v1/chat", json=body) as response:
+            event = None
+            async for raw in response.content:
+                line = raw.decode("utf-8").rstrip("\n")
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: "):
+                    if event == "delta" and result["first_delta"] is None:
+                        result["first_delta"] = time.perf_counter() - started
+                    elif event == "snippet":
+                        result["snippets"] += 1
+                    elif event == "done":
+                        result["ok"] = json.loads(line[len("data: "):])["status"] == "done"
+    except aiohttp.ClientError:
+        pass
+    result["total"] = time.perf_counter() - started
+    return result
+
+
+def _summary(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    return {
+        "p50": round(statistics.median(values) * 1000, 1),
+        "p95": round(values[min(len(values) - 1, int(len(values) * 0.95))] * 1000, 1),
+        "max": round(values[-1] * 1000, 1),
+    }
+
+
+async def run(args):
+    mock, mock_url = start_mock_servers(args)
+    api = None
+    try:
+        api, base_url = await start_api(mock_url, args)
+        connector = aiohttp.TCPConnector(limit=0)
+        timeout = aiohttp.ClientTimeout(total=args.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            started = time.perf_counter()
+            results = await asyncio.gather(*(one_stream(session, base_url, i) for i in range(args.streams)))
+            wall = time.perf_counter() - started
+        summary = {
+            "streams": args.streams,
+            "capacity": args.capacity,
+            "first_delta_ms": _summary([r["first_delta"] for r in results if r["first_delta"] is not None]),
+            "total_ms": _summary([r["total"] for r in results if r["ok"]]),
+            "errors": sum(1 for r in results if not r["ok"]),
+            "snippets": sum(r["snippets"] for r in results),
+            "wall_s": round(wall, 2),
+        }
+    finally:
+        cpu = {}
+        for name, process in (("api", api), ("mock", mock)):
+            if process:
+                process.terminate()
+                _, _, usage = os.wait4(process.pid, 0)
+                process.returncode = 0
+                cpu[name] = round(usage.ru_utime + usage.ru_stime, 2)
+    summary["cpu_s"] = cpu
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=300, help="Concurrent chat streams")
+    parser.add_argument("--capacity", type=int, default=512, help="Upstream requests api.py may have in flight")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="SSE events per second from the stand-in")
+    parser.add_argument("--latency", type=float, default=0.05, help="Stand-in seconds before the first byte")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds a stream may take")
+    parser.add_argument("--output", help="Write the results here instead of printing them")
+    args = parser.parse_args(argv)
+
+    text = json.dumps(asyncio.run(run(args)), indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,288 @@
+"""
+End-to-end benchmark of the chat, snippet extraction and speech paths
+against the local stand-ins in mock_servers.py (started in a subprocess, so
+their CPU time isn't counted).
+
+Every scenario reports wall time, CPU time and peak Python memory; the chat
+scenario also reports time to first token and the number of renders. The
+results are printed (or written with --output) as JSON. With --baseline the
+run is compared against an earlier result and the exit status is 1 if any
+metric got worse by more than --tolerance.
+
+    python bench/benchmark.py --output bench/baseline.json
+    python bench/benchmark.py --baseline bench/baseline.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Keep the benchmark away from the user's caches and the voice list endpoint
+os.environ["TTS_CACHE_DIR"] = tempfile.mkdtemp(prefix="chatapp-bench-tts-")
+os.environ.setdefault("TTS_VOICES_OFFLINE", "1")
+
+import edge_tts.communicate  # noqa: E402
+
+import chat  # noqa: E402
+import vqd  # noqa: E402
+from code_blocks import extract_code_snippets  # noqa: E402
+from renderer import StreamRenderer  # noqa: E402
+from tts import clean_text_for_speech, text_to_speech  # noqa: E402
+
+# Metrics where a higher value is not a regression
+_INFORMATIONAL = {"chars", "bytes", "errors", "calls", "speech_chars"}
+# Metrics added up over the runs instead of taking the median
+_SUMMED = {"errors"}
+
+
+class _Placeholder:
+    """Stands in for st.empty(): counts draws instead of sending them to a browser"""
+
+    def __init__(self):
+        self.draws = 0
+
+    def container(self):
+        return self
+
+    def empty(self):
+        return self
+
+    def markdown(self, text):
+        self.draws += 1
+
+
+def start_mock_servers(args):
+    """Start mock_servers.py in a subprocess and return (process, base URL)"""
+    command = [sys.executable, os.path.join(ROOT, "bench", "mock_servers.py"),
+               "--token-rate", str(args.token_rate), "--chunk-chars", str(args.chunk_chars),
+               "--latency", str(args.latency), "--error-rate", str(args.error_rate),
+               "--answer-repeat", str(args.answer_repeat), "--tts-speed", str(args.tts_speed),
+               "--seed", str(args.seed)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line.startswith("listening on "):
+        process.kill()
+        raise RuntimeError(f"Mock servers failed to start: {line!r}")
+    return process, line[len("listening on "):].strip()
+
+
+def point_app_at(base_url):
+    """Send every DDG and edge-tts request of this process to the stand-ins"""
+    vqd.STATUS_URL = f"{base_url}/duckchat/v1/status"
+    chat.CHAT_URL = f"{base_url}/duckchat/v1/chat"
+    edge_tts.communicate.WSS_URL = f"{base_url.replace('http', 'ws', 1)}/edge/v1?TrustedClientToken=bench"
+
+
+def measure(scenario, runs):
+    """
+    Run a scenario ``runs`` times for timings, then once more under
+    tracemalloc for peak memory (tracing slows Python down, so it is kept
+    out of the timed runs)
+
+    Args:
+        scenario (callable): Called with the run index, returns a dict of extra metrics
+        runs (int): Timed runs; the median of each metric is reported (the total for errors)
+
+    Returns:
+        dict: Metric name -> median value
+    """
+    samples = []
+    for run in range(runs):
+        wall, cpu = time.perf_counter(), time.process_time()
+        extra = scenario(run)
+        sample = {"total_ms": (time.perf_counter() - wall) * 1000, "cpu_ms": (time.process_time() - cpu) * 1000}
+        sample.update(extra)
+        samples.append(sample)
+
+    tracemalloc.start()
+    try:
+        scenario(runs)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    result = {}
+    for key in samples[0]:
+        values = [sample[key] for sample in samples]
+        result[key] = round(sum(values) if key in _SUMMED else statistics.median(values), 3)
+    result["peak_kb"] = round(peak / 1024, 1)
+    return result
+
+
+def chat_scenario(args):
+    token = vqd.ConversationToken(vqd.VqdTokenManager(pool_size=1))
+    messages = [{"role": "user", "content": "Explain a moving average"}]
+
+    def scenario(run):
+        placeholder = _Placeholder()
+        renderer = StreamRenderer(placeholder, flush_interval=args.flush_ms / 1000, flush_chars=args.flush_chars)
+        start = time.perf_counter()
+        first = None
+        errors = 0
+        try:
+            for delta in chat.get_ai_response(messages, token):
+                if first is None:
+                    first = time.perf_counter()
+                renderer.feed(delta)
+        except Exception:
+            errors = 1
+        text = renderer.close()
+        return {
+            "ttft_ms": ((first or time.perf_counter()) - start) * 1000,
+            "renders": renderer.render_count,
+            "chars": len(text),
+            "errors": errors,
+        }
+
+    return scenario
+
+
+def fetch_answer(args):
+    """One complete answer from the stand-in, used as input by the offline scenarios"""
+    token = vqd.ConversationToken(vqd.VqdTokenManager(pool_size=1))
+    for _ in range(10):
+        try:
+            return "".join(chat.get_ai_response([{"role": "user", "content": "answer"}], token))
+        except Exception:
+            continue
+    raise RuntimeError("The mock chat endpoint failed 10 times in a row; lower --error-rate")
+
+
+def repeat_scenario(function, text, calls):
+    def scenario(run):
+        for _ in range(calls):
+            function(text)
+        return {"calls": calls}
+
+    return scenario
+
+
+def long_answer(answer, speech_chars):
+    """Repeat ``answer`` until it has at least ``speech_chars`` characters of speech"""
+    repeat = -(-speech_chars // max(len(clean_text_for_speech(answer)), 1))
+    return "\n\n".join([answer] * repeat)
+
+
+def tts_scenario(text, cached):
+    speech_chars = len(clean_text_for_speech(text))
+
+    def scenario(run):
+        # A fresh prefix per run misses the audio cache; the cached variant warms it first
+        speech_text = text if cached else f"Run {run} {time.time()}. {text}"
+        if cached:
+            text_to_speech(speech_text)
+        start = time.perf_counter()
+        path = text_to_speech(speech_text)
+        elapsed = (time.perf_counter() - start) * 1000
+        return {
+            "synthesis_ms": elapsed,
+            "bytes": os.path.getsize(path) if path else 0,
+            "speech_chars": speech_chars,
+            "errors": 0 if path else 1,
+        }
+
+    return scenario
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare two result sets
+
+    Returns:
+        tuple: (comparison dict, list of regression descriptions)
+    """
+    comparison = {}
+    regressions = []
+    for name, metrics in results.items():
+        previous = baseline.get(name, {})
+        for metric, value in metrics.items():
+            if metric not in previous:
+                continue
+            before = previous[metric]
+            change = (value - before) / before if before else 0.0
+            comparison.setdefault(name, {})[metric] = {"baseline": before, "current": value,
+                                                       "change": round(change, 3)}
+            if metric not in _INFORMATIONAL and change > tolerance:
+                regressions.append(f"{name}.{metric}: {before} -> {value} ({change:+.0%})")
+    return comparison, regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Timed runs per scenario")
+    parser.add_argument("--calls", type=int, default=200, help="Calls per run for the offline scenarios")
+    parser.add_argument("--token-rate", type=float, default=200.0)
+    parser.add_argument("--chunk-chars", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--answer-repeat", type=int, default=1)
+    parser.add_argument("--tts-speed", type=float, default=50.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--long-speech-chars", type=int, default=5000,
+                        help="Speech length of the long-answer text_to_speech scenario")
+    parser.add_argument("--flush-ms", type=float, default=50, help="StreamRenderer flush interval")
+    parser.add_argument("--flush-chars", type=int, default=256, help="StreamRenderer flush size")
+    parser.add_argument("--output", help="Write the JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="Earlier results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed slowdown before failing, 0.10 = 10%%")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    process, base_url = start_mock_servers(args)
+    try:
+        # The app logs with print(); keep stdout for the JSON report
+        with contextlib.redirect_stdout(sys.stderr):
+            point_app_at(base_url)
+            answer = fetch_answer(args)
+            results = {
+                "chat_stream": measure(chat_scenario(args), args.runs),
+                "extract_code_snippets": measure(repeat_scenario(extract_code_snippets, answer, args.calls),
+                                                 args.runs),
+                "clean_text_for_speech": measure(repeat_scenario(clean_text_for_speech, answer, args.calls),
+                                                 args.runs),
+                "text_to_speech": measure(tts_scenario(answer, cached=False), args.runs),
+                "text_to_speech_cached": measure(tts_scenario(answer, cached=True), args.runs),
+                "text_to_speech_long": measure(tts_scenario(long_answer(answer, args.long_speech_chars), cached=False),
+                                               args.runs),
+            }
+    finally:
+        process.terminate()
+        process.wait()
+
+    report = {
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "results": results,
+    }
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        report["comparison"], regressions = compare(results, baseline["results"], args.tolerance)
+        report["regressions"] = regressions
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
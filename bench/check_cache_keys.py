@@ -0,0 +1,87 @@
+"""
+Regression check for the response cache key.
+
+Pairs of code submissions that must share a cache entry (they differ only
+in whitespace, or in comments of a language that is known) and pairs that
+must not (they differ in code, including code that only looks like a
+comment when the language is guessed). A shared key also means concurrent
+submissions share one upstream stream (see singleflight.py), so a wrong
+match serves one code's answer for another. The exit status is 1 on any
+failure.
+
+    python bench/check_cache_keys.py
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from response_cache import ResponseCache  # noqa: E402
+
+# (name, first, second, language) pairs that must get the same key
+SAME = [
+    ("indentation and blank lines",
+     "def half(x):\n    return x // 2\n",
+     "    def half(x):\n\n        return x // 2   \n", None),
+    ("runs of spaces",
+     "total = a  +   b\n", "total = a + b\n", None),
+    ("python comment, language given",
+     "def half(x):\n    return x // 2  # floor\n", "def half(x):\n    return x // 2\n", "python"),
+    ("javascript comments, language given",
+     "/* halve */\nconst half = (x) => x / 2; // arrow\n", "const half = (x) => x / 2;\n", "javascript"),
+    ("python comment, fenced",
+     "```python\ndef half(x):\n    # floor\n    return x // 2\n```",
+     "```python\ndef half(x):\n    return x // 2\n```", None),
+]
+
+# (name, first, second, language) pairs that must get different keys
+DIFFERENT = [
+    ("python floor division, language guessed as javascript",
+     "def half(variable):\n    return variable // 2\n",
+     "def half(variable):\n    return variable // 3\n", None),
+    ("python floor division with function in a name",
+     "def apply_function(x):\n    return x // 2\n",
+     "def apply_function(x):\n    return x // 4\n", None),
+    ("python floor division, language given",
+     "def half(x):\n    return x // 2\n", "def half(x):\n    return x // 3\n", "python"),
+    ("hash in a shell-like line, language unknown",
+     "count = 1 # 2\n", "count = 1 # 3\n", None),
+    ("comment marker inside a string",
+     'print("a // b")\n', 'print("a // c")\n', "javascript"),
+    ("different code",
+     "const half = (x) => x / 2;\n", "const half = (x) => x / 3;\n", "javascript"),
+    ("blank line inside a string",
+     's = """a\n\nb"""\nprint(s)', 's = """a\nb"""\nprint(s)', "python"),
+    ("trailing spaces inside a string",
+     's = """a   \nb"""', 's = """a\nb"""', None),
+    ("indentation inside a string",
+     '    s = """a\n    b"""', 's = """a\nb"""', None),
+]
+
+
+def check():
+    """
+    Returns:
+        list: Names of the failed cases
+    """
+    failures = []
+    for expected_same, cases in ((True, SAME), (False, DIFFERENT)):
+        for name, first, second, language in cases:
+            same = (ResponseCache.make_key("explain", "model", first, language)
+                    == ResponseCache.make_key("explain", "model", second, language))
+            if same != expected_same:
+                failures.append(name)
+    return failures
+
+
+def main():
+    failures = check()
+    for name in failures:
+        print(f"FAILED: {name}")
+    print(f"{len(SAME) + len(DIFFERENT)} cases, {len(failures)} failures")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""
+Regression check for the speech text cleaner.
+
+speech_corpus.jsonl holds markdown inputs (whole answers, the sentences
+StreamingSpeech cuts them into, generated mixes of markup and odd cases
+where the cleaning rules overlap) together with the output of the original
+multi-pass clean_text_for_speech. Every input is cleaned in one call, fed to
+a SpeechStream in chunks of several sizes, and fed sentence by sentence the
+way StreamingSpeech does; all of them must reproduce the expected text byte
+for byte. The exit status is 1 on any mismatch.
+
+    python bench/check_speech_corpus.py
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from speech_normalizer import DEFAULT_NORMALIZER  # noqa: E402
+from tts import SentenceSplitter, clean_text_for_speech  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "speech_corpus.jsonl")
+
+
+def load_corpus(path=CORPUS):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def clean_in_chunks(text, size):
+    stream = DEFAULT_NORMALIZER.stream()
+    pieces = [stream.feed(text[start:start + size]) for start in range(0, len(text), size)]
+    pieces.append(stream.flush())
+    return "".join(pieces)
+
+
+def clean_by_sentence(text, delta_size=7):
+    splitter = SentenceSplitter()
+    stream = DEFAULT_NORMALIZER.stream()
+    pieces = []
+    for start in range(0, len(text), delta_size):
+        for sentence in splitter.feed(text[start:start + delta_size]):
+            pieces.append(stream.feed(sentence, at_boundary=True))
+    pieces.append(stream.feed(splitter.flush()))
+    pieces.append(stream.flush())
+    return "".join(pieces)
+
+
+def check(cases, chunk_sizes):
+    """
+    Returns:
+        list: (case index, mode, expected, actual) for every mismatch
+    """
+    modes = {"clean": clean_text_for_speech, "sentences": clean_by_sentence}
+    for size in chunk_sizes:
+        modes[f"chunks_{size}"] = lambda text, size=size: clean_in_chunks(text, size)
+    mismatches = []
+    for index, case in enumerate(cases):
+        for mode, function in modes.items():
+            actual = function(case["input"])
+            if actual != case["expected"]:
+                mismatches.append((index, mode, case["expected"], actual))
+    return mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=CORPUS)
+    parser.add_argument("--chunk-sizes", default="1,3,16,64", help="Comma-separated SpeechStream chunk sizes")
+    parser.add_argument("--show", type=int, default=10, help="Mismatches to print")
+    args = parser.parse_args(argv)
+
+    cases = load_corpus(args.corpus)
+    mismatches = check(cases, [int(size) for size in args.chunk_sizes.split(",")])
+    for index, mode, expected, actual in mismatches[:args.show]:
+        print(f"case {index} ({mode}):\n  input    {cases[index]['input']!r}\n"
+              f"  expected {expected!r}\n  actual   {actual!r}")
+
+    start = time.perf_counter()
+    for case in cases:
+        clean_text_for_speech(case["input"])
+    elapsed = time.perf_counter() - start
+    print(f"{len(cases)} cases, {len(mismatches)} mismatches; "
+          f"clean_text_for_speech: {elapsed / len(cases) * 1e6:.1f} us per case")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
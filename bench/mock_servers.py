@@ -0,0 +1,268 @@
+"""
+Local stand-ins for the services the app talks to:
+
+- GET  /duckchat/v1/status   hands out an X-Vqd-4 token
+- POST /duckchat/v1/chat     streams a canned answer as server-sent events
+- GET  /edge/v1              speaks the edge-tts websocket protocol and
+                             returns silent MP3 frames
+- POST /v1/chat/completions  streams the same answer in the OpenAI format
+- GET  /v1/models            lists the model it pretends to be
+
+Token rate, chunk size, latency and error injection are configurable, so
+the benchmark can reproduce slow, fast or flaky backends. Run it on its own
+to point the app at it:
+
+    python bench/mock_servers.py --port 8765
+    DDG_BASE_URL=http://127.0.0.1:8765 streamlit run main.py
+    CHATAPP_OPENAI_URL=http://127.0.0.1:8765/v1 CHATAPP_BACKENDS=openai streamlit run main.py
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import sys
+import uuid
+
+from aiohttp import web
+
+DEFAULT_ANSWER = """Here is an explanation of the code, step by step. The function walks the list once, so it runs in linear time.
+
+```python
+def moving_average(values, window):
+    total = sum(values[:window])
+    averages = [total / window]
+    for i in range(window, len(values)):
+        total += values[i] - values[i - window]
+        averages.append(total / window)
+    return averages
+```
+
+A few notes: the first window is summed directly, e.g. with `sum()`, and every later average reuses the running total. This avoids the O(n*k) cost of summing each window again!
+
+Here is the same idea in JavaScript, i.e. for a browser:
+
+```javascript
+function movingAverage(values, window) {
+  let total = values.slice(0, window).reduce((a, b) => a + b, 0);
+  const averages = [total / window];
+  for (let i = window; i < values.length; i++) {
+    total += values[i] - values[i - window];
+    averages.push(total / window);
+  }
+  return averages;
+}
+```
+
+See [the docs](https://example.com/docs) for more & let me know if you have questions.
+"""
+
+# One silent MPEG-2 layer III frame: 24 kHz, 48 kbit/s, mono (the format edge-tts asks for).
+# 576 samples per frame, 144 bytes per frame.
+MP3_FRAME = bytes([0xFF, 0xF3, 0x64, 0xC0]) + bytes(140)
+MP3_FRAME_SECONDS = 576 / 24000
+
+# Rough speaking speed used to size the audio for a text
+CHARS_PER_SECOND = 15
+
+_SSML_TEXT = re.compile(r"<prosody[^>]*>(.*?)</prosody>", re.DOTALL)
+
+
+class MockConfig:
+    """
+    Behaviour of the stand-ins.
+
+    Args:
+        token_rate (float): SSE events per second on the chat stream
+        chunk_chars (int): Characters of the answer per SSE event
+        latency (float): Seconds before the first byte of every response
+        error_rate (float): Fraction of requests that fail (HTTP 500, or a dropped websocket)
+        answer (str): Markdown streamed back by the chat endpoint
+        answer_repeat (int): Send the answer this many times, for longer streams
+        audio_chunk_bytes (int): Bytes of MP3 per websocket message
+        tts_speed (float): How many times faster than real time audio is produced
+        seed (int): Seed for error injection, so runs are reproducible
+    """
+
+    def __init__(self, token_rate=200.0, chunk_chars=8, latency=0.05, error_rate=0.0, answer=DEFAULT_ANSWER,
+                 answer_repeat=1, audio_chunk_bytes=4096, tts_speed=50.0, seed=0):
+        self.token_rate = token_rate
+        self.chunk_chars = chunk_chars
+        self.latency = latency
+        self.error_rate = error_rate
+        self.answer = answer
+        self.answer_repeat = answer_repeat
+        self.audio_chunk_bytes = audio_chunk_bytes
+        self.tts_speed = tts_speed
+        self.seed = seed
+
+    def as_dict(self):
+        config = dict(vars(self))
+        config["answer_chars"] = len(config.pop("answer")) * self.answer_repeat
+        return config
+
+
+class MockServices:
+    """The stand-ins on one aiohttp app"""
+
+    def __init__(self, config=None):
+        self.config = config or MockConfig()
+        self.requests = {"status": 0, "chat": 0, "openai": 0, "tts": 0, "errors": 0}
+        self._random = random.Random(self.config.seed)
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/duckchat/v1/status", self.status)
+        app.router.add_post("/duckchat/v1/chat", self.chat)
+        app.router.add_get("/edge/v1", self.tts)
+        app.router.add_post("/v1/chat/completions", self.openai_chat)
+        app.router.add_get("/v1/models", self.openai_models)
+        app.router.add_get("/stats", self.stats)
+        return app
+
+    def _fail(self):
+        if self.config.error_rate and self._random.random() < self.config.error_rate:
+            self.requests["errors"] += 1
+            return True
+        return False
+
+    async def status(self, request):
+        self.requests["status"] += 1
+        await asyncio.sleep(self.config.latency)
+        if self._fail():
+            raise web.HTTPInternalServerError()
+        return web.Response(headers={"X-Vqd-4": uuid.uuid4().hex})
+
+    async def chat(self, request):
+        self.requests["chat"] += 1
+        if not request.headers.get("x-vqd-4"):
+            raise web.HTTPBadRequest(text="missing x-vqd-4")
+        await request.read()
+        await asyncio.sleep(self.config.latency)
+        if self._fail():
+            raise web.HTTPInternalServerError()
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "X-Vqd-4": uuid.uuid4().hex})
+        await response.prepare(request)
+        await self._stream_answer(response, lambda chunk: {"message": chunk})
+        return response
+
+    async def openai_chat(self, request):
+        self.requests["openai"] += 1
+        body = await request.json()
+        await asyncio.sleep(self.config.latency)
+        if self._fail():
+            raise web.HTTPInternalServerError()
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        model = body.get("model", "mock")
+        await self._stream_answer(response, lambda chunk: {
+            "object": "chat.completion.chunk", "model": model,
+            "choices": [{"index": 0, "delta": {"content": chunk}, "finish_reason": None}],
+        })
+        return response
+
+    async def openai_models(self, request):
+        return web.json_response({"object": "list", "data": [{"id": "mock", "object": "model"}]})
+
+    async def _stream_answer(self, response, event):
+        answer = self.config.answer * self.config.answer_repeat
+        delay = 1 / self.config.token_rate if self.config.token_rate else 0
+        for start in range(0, len(answer), self.config.chunk_chars):
+            chunk = answer[start:start + self.config.chunk_chars]
+            await response.write(f"data: {json.dumps(event(chunk))}\n\n".encode("utf-8"))
+            await asyncio.sleep(delay)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+
+    async def tts(self, request):
+        self.requests["tts"] += 1
+        websocket = web.WebSocketResponse()
+        await websocket.prepare(request)
+
+        # speech.config first, then the SSML request with the text
+        text = ""
+        async for message in websocket:
+            if "Path:ssml" in message.data:
+                match = _SSML_TEXT.search(message.data)
+                text = match.group(1) if match else message.data
+                break
+        await asyncio.sleep(self.config.latency)
+        if self._fail():
+            await websocket.close()
+            return websocket
+
+        request_id = uuid.uuid4().hex
+        await websocket.send_str(self._text_message(request_id, "turn.start", "{}"))
+        frames = max(1, int(len(text) / CHARS_PER_SECOND / MP3_FRAME_SECONDS))
+        frames_per_message = max(1, self.config.audio_chunk_bytes // len(MP3_FRAME))
+        header = (f"X-RequestId:{request_id}\r\nContent-Type:audio/mpeg\r\nPath:audio\r\n").encode("utf-8")
+        while frames > 0:
+            count = min(frames, frames_per_message)
+            frames -= count
+            await websocket.send_bytes(len(header).to_bytes(2, "big") + header + MP3_FRAME * count)
+            await asyncio.sleep(count * MP3_FRAME_SECONDS / self.config.tts_speed)
+        await websocket.send_str(self._text_message(request_id, "turn.end", "{}"))
+        await websocket.close()
+        return websocket
+
+    async def stats(self, request):
+        return web.json_response(self.requests)
+
+    @staticmethod
+    def _text_message(request_id, path, body):
+        return f"X-RequestId:{request_id}\r\nContent-Type:application/json; charset=utf-8\r\nPath:{path}\r\n\r\n{body}"
+
+
+async def serve(config, host="127.0.0.1", port=0):
+    """Start the stand-ins and return (runner, base URL)"""
+    runner = web.AppRunner(MockServices(config).app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://{host}:{port}"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="0 picks a free port")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="SSE events per second")
+    parser.add_argument("--chunk-chars", type=int, default=8, help="Characters per SSE event")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds before the first byte")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--answer-repeat", type=int, default=1, help="Repeat the canned answer N times")
+    parser.add_argument("--audio-chunk-bytes", type=int, default=4096)
+    parser.add_argument("--tts-speed", type=float, default=50.0, help="Audio produced N times faster than real time")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def config_from_args(args):
+    return MockConfig(token_rate=args.token_rate, chunk_chars=args.chunk_chars, latency=args.latency,
+                      error_rate=args.error_rate, answer_repeat=args.answer_repeat,
+                      audio_chunk_bytes=args.audio_chunk_bytes, tts_speed=args.tts_speed, seed=args.seed)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    async def run():
+        runner, base_url = await serve(config_from_args(args), args.host, args.port)
+        # The benchmark reads this line to find the port
+        print(f"listening on {base_url}", flush=True)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    sys.exit(main())
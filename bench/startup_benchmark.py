@@ -0,0 +1,106 @@
+"""
+Cold start and rerun cost of main.py.
+
+Each sample runs the app in a fresh interpreter with Streamlit's AppTest
+(no browser, no server): the first run includes importing the app's
+modules, later runs are the reruns every widget change triggers. Reported
+per scenario:
+
+- import_ms       importing Streamlit and its testing harness (not the app)
+- first_run_ms    the first script run, app imports included
+- rerun_ms        median of the following reruns
+- style_elements  markdown elements carrying a <style> block on a rerun
+- lazy_modules    optional dependencies that were not imported (edge_tts, streamlit_ace, sseclient)
+
+Results are printed (or written with --output) as JSON.
+
+    python bench/startup_benchmark.py --samples 5 --reruns 20
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules the app should only import once they are used
+LAZY_MODULES = ("edge_tts", "streamlit_ace", "sseclient")
+
+# Runs inside the fresh interpreter; prints one JSON line
+_SAMPLE = r"""
+import json, statistics, sys, time
+started = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+imported = time.perf_counter()
+at = AppTest.from_file("main.py", default_timeout=120)
+for key, value in json.loads(sys.argv[2]).items():
+    at.session_state[key] = value
+at.run()
+first_run = time.perf_counter()
+reruns = []
+for _ in range(int(sys.argv[1])):
+    start = time.perf_counter()
+    at.run()
+    reruns.append(time.perf_counter() - start)
+assert not at.exception, at.exception
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "first_run_ms": (first_run - imported) * 1000,
+    "rerun_ms": statistics.median(reruns) * 1000 if reruns else 0.0,
+    "style_elements": sum(1 for element in at.markdown if "<style" in element.value),
+    "lazy_modules": [name for name in %r if name not in sys.modules],
+}))
+""" % (LAZY_MODULES,)
+
+SCENARIOS = {
+    "voice_on": {},
+    "voice_off": {"voice_enabled": False},
+}
+
+
+def sample(reruns, state):
+    env = dict(os.environ, CHATAPP_STORAGE="memory", TTS_VOICES_OFFLINE="1",
+               DDG_BASE_URL=os.environ.get("DDG_BASE_URL", "http://127.0.0.1:9"))
+    result = subprocess.run([sys.executable, "-c", _SAMPLE, str(reruns), json.dumps(state)], cwd=ROOT, env=env,
+                            capture_output=True, text=True, timeout=600)
+    lines = [line for line in result.stdout.splitlines() if line.startswith("{")]
+    if result.returncode or not lines:
+        raise RuntimeError(f"App run failed:\n{result.stderr[-2000:]}")
+    return json.loads(lines[-1])
+
+
+def measure(samples, reruns, state):
+    results = [sample(reruns, state) for _ in range(samples)]
+    summary = {key: round(statistics.median(result[key] for result in results), 3)
+               for key in ("import_ms", "first_run_ms", "rerun_ms")}
+    summary["style_elements"] = results[-1]["style_elements"]
+    summary["lazy_modules"] = results[-1]["lazy_modules"]
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=5, help="Fresh interpreters per scenario")
+    parser.add_argument("--reruns", type=int, default=20, help="Reruns timed per interpreter")
+    parser.add_argument("--output", help="Write the results here instead of printing them")
+    args = parser.parse_args(argv)
+
+    results = {
+        "python": sys.version.split()[0],
+        "samples": args.samples,
+        "reruns": args.reruns,
+        "scenarios": {name: measure(args.samples, args.reruns, state) for name, state in SCENARIOS.items()},
+    }
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+import json
+import time
+
+import metrics
+from transport import get_transport
+from vqd import DDG_BASE_URL
+
+CHAT_URL = f'{DDG_BASE_URL}/duckchat/v1/chat'
+MODEL = "claude-3-haiku-20240307"
+# Models the DuckDuckGo chat offers, the default first
+MODELS = (MODEL, "gpt-4o-mini", "o3-mini", "meta-llama/Llama-3.3-70B-Instruct-Turbo",
+          "mistralai/Mistral-Small-24B-Instruct-2501")
+
+# Prompt wrapped around the user's code in each mode; chat sends the input as is
+PROMPT_TEMPLATES = {
+    "explain": "Please explain this code in simple terms, highlight any issues, and suggest improvements: {input}",
+    "debug": "Debug this code and provide a corrected version with explanations: {input}",
+    "optimize": "Optimize this code for better performance and explain your changes: {input}",
+}
+
+
+def build_prompt(mode, user_input):
+    """Adjust the prompt based on the mode"""
+    template = PROMPT_TEMPLATES.get(mode)
+    return template.format(input=user_input) if template else user_input
+
+
+def get_ai_response(messages, token, cancel_event=None, on_response=None, model=MODEL):
+    """
+    Stream an AI response from DuckDuckGo
+    
+    Args:
+        messages (list): Conversation to send, ending with the current prompt
+        token (vqd.ConversationToken): The conversation's VQD token
+        cancel_event (threading.Event): Stop reading the stream once set
+        on_response (callable): Called with the HTTP response before streaming starts
+        model (str): Model to ask
+    
+    Yields:
+        str: Text deltas as they arrive
+    """
+    headers = {
+        'accept': 'text/event-stream',
+        'Content-Type': 'application/json'
+    }
+    data = json.dumps({"model": model, "messages": messages})
+    transport = get_transport()
+    
+    with metrics.span("vqd"):
+        headers['x-vqd-4'] = token.get()
+    with metrics.span("chat_request"):
+        response = transport.post(CHAT_URL, headers=headers, data=data, stream=True)
+        if 400 <= response.status_code < 500:
+            # Most likely a stale token: take a fresh one and retry once
+            response.close()
+            metrics.count("vqd_retry")
+            with metrics.span("vqd"):
+                headers['x-vqd-4'] = token.get(refresh=True)
+            response = transport.post(CHAT_URL, headers=headers, data=data, stream=True)
+        response.raise_for_status()
+    token.update(response)
+    if on_response:
+        on_response(response)
+    
+    import sseclient  # Imported on the first request rather than at app start
+    
+    # Time spent waiting on the stream, not counting the consumer's time between deltas
+    read_seconds = 0.0
+    try:
+        waited = time.perf_counter()
+        for event in sseclient.SSEClient(response).events():
+            read_seconds += time.perf_counter() - waited
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            if event.data == '[DONE]':
+                break
+            try:
+                parsed_data = json.loads(event.data)
+            except json.JSONDecodeError:
+                continue
+            if 'message' in parsed_data:
+                yield parsed_data['message']
+            waited = time.perf_counter()
+    finally:
+        # Returns the connection to the pool, or drops it if the stream was cut short
+        response.close()
+        response.timing.finish()
+        metrics.observe("sse_read", read_seconds)
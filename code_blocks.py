@@ -0,0 +1,177 @@
+import re
+from collections import namedtuple
+
+# Fence info strings we recognise, mapped to the language name used in the app
+LANGUAGE_ALIASES = {
+    "js": "javascript",
+    "javascript": "javascript",
+    "py": "python",
+    "python": "python",
+    "ts": "typescript",
+    "typescript": "typescript",
+    "java": "java",
+    "c#": "csharp",
+    "csharp": "csharp",
+    "html": "html",
+    "htm": "html",
+    "css": "css",
+    "json": "json",
+    "xml": "xml",
+}
+
+# Fallback for unknown or missing info strings: first rule with a marker in the code wins
+LANGUAGE_HINTS = (
+    (("public class",), "java"),
+    (("function", "var", "const"), "javascript"),
+    (("def ", "import "), "python"),
+)
+
+EXTENSIONS = {
+    "python": "py",
+    "javascript": "js",
+    "typescript": "ts",
+    "java": "java",
+    "csharp": "cs",
+    "html": "html",
+    "css": "css",
+    "json": "json",
+    "xml": "xml",
+    "text": "txt"
+}
+
+_DEF_NAME = re.compile(r'def\s+([a-zA-Z0-9_]+)')
+_CLASS_NAME = re.compile(r'class\s+([a-zA-Z0-9_]+)')
+_FUNCTION_NAME = re.compile(r'function\s+([a-zA-Z0-9_]+)')
+
+# Patterns tried in order to name a snippet after its function or class
+NAME_PATTERNS = {
+    "python": (_DEF_NAME, _CLASS_NAME),
+    "javascript": (_FUNCTION_NAME, _CLASS_NAME),
+    "typescript": (_FUNCTION_NAME, _CLASS_NAME),
+    "java": (_CLASS_NAME,),
+}
+
+FENCE = "```"
+
+CodeBlock = namedtuple("CodeBlock", ["code", "language", "info"])
+
+
+def resolve_language(info, code):
+    """
+    Map a fence info string to a language, guessing from the code when the
+    info string is missing or not recognised
+
+    Returns:
+        str: Language name, "text" if nothing matched
+    """
+    language = LANGUAGE_ALIASES.get(info.strip().lower())
+    if language:
+        return language
+    for markers, hinted in LANGUAGE_HINTS:
+        if any(marker in code for marker in markers):
+            return hinted
+    return "text"
+
+
+def guess_file_stem(code, language):
+    """Return the first function or class name in the code, or None"""
+    for pattern in NAME_PATTERNS.get(language, ()):
+        match = pattern.search(code)
+        if match:
+            return match.group(1)
+    return None
+
+
+class FenceParser:
+    """
+    Incremental parser for fenced code blocks in streamed markdown.
+
+    Feed it deltas as they arrive; every block is emitted as soon as its
+    closing fence has been seen. Each character is scanned once, except for
+    a couple of trailing characters held back in case a fence is split
+    across deltas. Blocks still open when the stream ends are not emitted.
+    """
+
+    _OUTSIDE, _INFO, _CODE = range(3)
+
+    def __init__(self, on_block=None):
+        self.on_block = on_block
+        self.blocks = []
+        self._buffer = ""
+        self._pos = 0
+        self._state = self._OUTSIDE
+        self._info_start = 0
+        self._code_start = 0
+        self._info = ""
+
+    def feed(self, delta):
+        """
+        Consume a delta
+
+        Args:
+            delta (str): Newly streamed markdown
+
+        Returns:
+            list: CodeBlocks completed by this delta
+        """
+        self._buffer += delta
+        buffer = self._buffer
+        completed = []
+        while True:
+            if self._state == self._OUTSIDE:
+                start = buffer.find(FENCE, self._pos)
+                if start == -1:
+                    self._pos = max(self._pos, len(buffer) - len(FENCE) + 1)
+                    break
+                self._info_start = self._pos = start + len(FENCE)
+                self._state = self._INFO
+            elif self._state == self._INFO:
+                newline = buffer.find("\n", self._pos)
+                if newline == -1:
+                    self._pos = len(buffer)
+                    break
+                self._info = buffer[self._info_start:newline]
+                self._code_start = self._pos = newline + 1
+                self._state = self._CODE
+            else:
+                end = buffer.find(FENCE, self._pos)
+                if end == -1:
+                    self._pos = max(self._pos, len(buffer) - len(FENCE) + 1)
+                    break
+                code = buffer[self._code_start:end]
+                block = CodeBlock(code, resolve_language(self._info, code), self._info.strip())
+                completed.append(block)
+                self._pos = end + len(FENCE)
+                self._state = self._OUTSIDE
+
+        self._compact()
+        for block in completed:
+            self.blocks.append(block)
+            if self.on_block:
+                self.on_block(block)
+        return completed
+
+    def _compact(self):
+        # Drop text that can no longer be part of a block
+        if self._state == self._OUTSIDE:
+            keep_from = self._pos
+        elif self._state == self._INFO:
+            keep_from = self._info_start
+        else:
+            keep_from = self._code_start
+        if keep_from:
+            self._buffer = self._buffer[keep_from:]
+            self._pos -= keep_from
+            self._info_start -= keep_from
+            self._code_start -= keep_from
+
+
+def extract_code_snippets(markdown_text):
+    """
+    Extract fenced code blocks from a complete markdown text
+
+    Returns:
+        tuple: (snippets, languages), two parallel lists
+    """
+    blocks = FenceParser().feed(markdown_text)
+    return [block.code for block in blocks], [block.language for block in blocks]
@@ -0,0 +1,90 @@
+import re
+
+# Rough size of a token for English text and code; close enough for budgeting
+CHARS_PER_TOKEN = 4
+
+_CODE_BLOCK = re.compile(r"```([^\n`]*)\n([\s\S]*?)```")
+
+
+def estimate_tokens(text):
+    """Approximate token count of a piece of text"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def condense_code_blocks(text):
+    """Replace every fenced code block with a one-line placeholder"""
+    def placeholder(match):
+        language = match.group(1).strip() or "code"
+        lines = match.group(2).count("\n") + 1
+        return f"[{language} code block omitted, {lines} lines]"
+
+    return _CODE_BLOCK.sub(placeholder, text)
+
+
+class ConversationWindow:
+    """
+    Builds the ``messages`` list sent to the chat backend from the session
+    history, trimmed to a token budget.
+
+    The newest ``keep_recent`` messages are always sent whole. Older
+    messages are added newest first while they fit; an older assistant
+    message that doesn't fit is sent with its code blocks condensed, and
+    once nothing more fits everything older is dropped. Token counts are
+    cached per message ID, so each request only measures new messages.
+    """
+
+    def __init__(self, budget=3000, keep_recent=4):
+        self.budget = budget
+        self.keep_recent = keep_recent
+        self._sizes = {}  # message id -> (tokens, condensed text, condensed tokens)
+
+    def build(self, history, prompt):
+        """
+        Select the history to send along with the current prompt
+
+        Args:
+            history (list): Earlier messages, oldest first, each with an "id"
+            prompt (str): The prompt for this turn
+
+        Returns:
+            list: API messages ({"role", "content"}), ending with the prompt
+        """
+        remaining = self.budget - estimate_tokens(prompt)
+        selected = []
+        for position, message in enumerate(reversed(history)):
+            tokens, condensed, condensed_tokens = self._measure(message)
+            content = message["content"]
+            if position >= self.keep_recent and tokens > remaining:
+                if message["role"] != "assistant" or condensed_tokens > remaining:
+                    break
+                content, tokens = condensed, condensed_tokens
+            selected.append({"role": message["role"], "content": content})
+            remaining -= tokens
+
+        selected.reverse()
+        # The conversation sent upstream has to open with a user turn
+        while selected and selected[0]["role"] != "user":
+            selected.pop(0)
+        selected.append({"role": "user", "content": prompt})
+        return selected
+
+    def forget(self, message_ids=None):
+        """Drop cached sizes, for all messages or only the given ones"""
+        if message_ids is None:
+            self._sizes.clear()
+        else:
+            for message_id in message_ids:
+                self._sizes.pop(message_id, None)
+
+    def _measure(self, message):
+        sizes = self._sizes.get(message["id"])
+        if sizes is None:
+            content = message["content"]
+            tokens = estimate_tokens(content)
+            if message["role"] == "assistant" and "```" in content:
+                condensed = condense_code_blocks(content)
+                sizes = (tokens, condensed, estimate_tokens(condensed))
+            else:
+                sizes = (tokens, content, tokens)
+            self._sizes[message["id"]] = sizes
+        return sizes
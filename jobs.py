@@ -0,0 +1,265 @@
+import concurrent.futures
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+import metrics
+from code_blocks import FenceParser
+from profiler import SamplingProfiler
+from providers import get_router
+from response_cache import get_response_cache
+from scheduler import admitted, get_chat_scheduler
+from singleflight import get_singleflight
+from tts import join_segments
+
+# Worker threads for chat jobs. Each job holds one while it runs, including
+# while it waits for admission, so a server with many clients wants more.
+JOB_WORKERS = int(os.environ.get("CHATAPP_JOB_WORKERS", 16))
+
+# Job states; everything but QUEUED and RUNNING is final
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+CANCELLED = "cancelled"
+ERROR = "error"
+
+
+class ChatJob:
+    """
+    One assistant turn running on the worker pool.
+
+    The worker appends deltas to ``text``, collects code blocks as they
+    close and feeds the optional StreamingSpeech. The Streamlit script only
+    reads from the job (see wait()), so any number of reruns can attach to
+    it while it runs, and cancel() stops it from any thread.
+    """
+
+    def __init__(self, speech=None, profile=False):
+        self.id = uuid.uuid4().hex
+        self.status = QUEUED
+        self.text = ""
+        self.error = None
+        self.code_blocks = []
+        self.speech = speech
+        self.audio = None
+        self.timing = None
+        self.backend = None     # Name of the chat backend that answered
+        self.model = None       # Model that answered
+        self.cached = False     # Replayed from the response cache
+        self.profile = profile  # Sample the worker's stack while the turn runs
+        self.profile_report = None
+        self.created_at = time.monotonic()
+        self.consumed = False   # Set once the result has been added to the conversation
+
+        self._cancelled = threading.Event()
+        self._subscription = None  # Its reader of the shared upstream stream (see singleflight.py)
+        self._changed = threading.Condition()
+        self._watchers = []
+
+    @property
+    def done(self):
+        return self.status in (DONE, CANCELLED, ERROR)
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """
+        Stop the turn. Leaving the shared stream closes the upstream response
+        right away, unless other sessions are still reading it.
+        """
+        self._cancelled.set()
+        subscription = self._subscription
+        if subscription is not None:
+            subscription.close()
+        with self._changed:
+            self._changed.notify_all()
+
+    def wait(self, offset, timeout=None):
+        """
+        Wait until there is text past ``offset`` or the job has finished
+
+        Returns:
+            str: The text produced after ``offset`` (may be empty)
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: len(self.text) > offset or self.done or self.cancelled, timeout)
+            return self.text[offset:]
+
+    def watch(self, callback):
+        """
+        Call ``callback()`` from the worker thread whenever the text grows or
+        the job finishes, for readers that can't block in wait(), like an
+        event loop. The job may have moved on before the callback was added,
+        so read it once after watching.
+        """
+        with self._changed:
+            self._watchers.append(callback)
+
+    def unwatch(self, callback):
+        with self._changed:
+            if callback in self._watchers:
+                self._watchers.remove(callback)
+
+    def queue_position(self):
+        """
+        Returns:
+            int: Place of the turn's upstream request in the admission queue, 0 once it runs
+        """
+        subscription = self._subscription
+        return subscription.stream.queue_position() if subscription is not None else 0
+
+    def _attach(self, response):
+        self.timing = response.timing
+
+    def _set_backend(self, name, model):
+        self.backend = name
+        self.model = model
+
+    def _append(self, delta):
+        with self._changed:
+            self.text += delta
+            self._changed.notify_all()
+            watchers = list(self._watchers)
+        for callback in watchers:
+            callback()
+
+    def _finish(self, status, error=None):
+        with self._changed:
+            self.error = error
+            self.status = status
+            self._subscription = None
+            self._changed.notify_all()
+            watchers = list(self._watchers)
+        for callback in watchers:
+            callback()
+
+
+def replay(text, chunk_chars=64):
+    """Yield a cached answer in chunks, like a live stream"""
+    for start in range(0, len(text), chunk_chars):
+        yield text[start:start + chunk_chars]
+
+
+def run_chat_job(job, deltas, cache_key=None):
+    """
+    Worker body: stream the response into the job
+
+    Args:
+        job (ChatJob): The job to fill in
+        deltas (iterable): Text deltas, from BackendRouter.stream() or replay()
+        cache_key (str): Store the complete answer in the response cache under this key
+    """
+    parser = FenceParser()
+    job.code_blocks = parser.blocks
+    status, error = DONE, None
+    job.status = RUNNING
+    profiler = SamplingProfiler().start() if job.profile else None
+    started = time.perf_counter()
+    try:
+        for delta in deltas:
+            if not job.text:
+                metrics.observe("ttft", time.perf_counter() - started)
+            with metrics.span("extract"):
+                parser.feed(delta)
+            if job.speech:
+                with metrics.span("speech_feed"):
+                    job.speech.feed(delta)
+            job._append(delta)
+    except Exception as e:
+        error = str(e)
+    finally:
+        # Stop reading a shared stream now rather than when the iterator is collected
+        close = getattr(deltas, "close", None)
+        if close is not None:
+            close()
+        metrics.observe("turn", time.perf_counter() - started)
+        if profiler:
+            job.profile_report = profiler.stop().summary()
+    if job.cancelled:
+        status, error = CANCELLED, None
+    elif error:
+        status = ERROR
+    elif cache_key and job.text:
+        get_response_cache().put(cache_key, job.text, backend=job.backend, model=job.model)
+
+    if job.speech:
+        try:
+            job.speech.finish()
+            if status != CANCELLED:
+                job.audio = join_segments(job.speech.wait())
+        except Exception as e:
+            print(f"TTS Error: {str(e)}")
+    metrics.count(f"turn_{status}")
+    job._finish(status, error)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_job_pool():
+    """Return the process-wide worker pool for chat jobs"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = concurrent.futures.ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="chat-job")
+    return _pool
+
+
+def flight_key(messages, model=None):
+    """Identify a request by everything sent upstream, for sharing it between sessions"""
+    return hashlib.sha256(json.dumps([model, messages], sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def submit_chat_job(messages, token, speech=None, cache_key=None, session=None, session_limit=None,
+                    profile=False, model=None):
+    """
+    Start an assistant turn in the background. Identical requests already in
+    flight, from this session or another, are joined rather than sent again:
+    code modes by their response cache key (mode, model and normalized code),
+    chat by the whole conversation sent.
+
+    Args:
+        messages (list): Conversation to send, ending with the current prompt
+        token (vqd.ConversationToken): The conversation's VQD token
+        speech (tts.StreamingSpeech): Speak the response while it streams
+        cache_key (str): Cache the complete answer under this key
+        session (str): Who the turn is for, for fair admission between sessions (see scheduler.py)
+        session_limit (int): Requests the session may have in flight upstream at once
+        profile (bool): Keep a sampling profile of the turn in ``job.profile_report``
+        model (str): Model to ask, or None to let the router pick the backend
+
+    Returns:
+        ChatJob: The running job
+    """
+    job = ChatJob(speech, profile=profile)
+
+    def start(stream):
+        # Only the request that goes upstream queues for admission; sessions joining it don't
+        stream.ticket = get_chat_scheduler().submit(session, limit=session_limit)
+        return admitted(stream.ticket, stream.cancel_event, lambda: get_router().stream(
+            messages, model=model, token=token, cancel_event=stream.cancel_event,
+            on_response=stream.attach, on_backend=stream.set_backend))
+
+    job._subscription = get_singleflight().stream(cache_key or flight_key(messages, model), start,
+                                                  on_response=job._attach, on_backend=job._set_backend)
+    get_job_pool().submit(run_chat_job, job, job._subscription, cache_key)
+    return job
+
+
+def submit_cached_job(text, speech=None, backend=None, model=None):
+    """Replay a cached answer as a job, so it goes through the same rendering and speech as a live one"""
+    job = ChatJob(speech)
+    job.cached = True
+    # Who gave the answer originally, when the cache knows
+    job.backend = backend
+    job.model = model
+    metrics.count("response_cache_hit")
+    get_job_pool().submit(run_chat_job, job, replay(text))
+    return job
@@ -1,13 +1,24 @@
 import asyncio
-import json
-import requests
 import streamlit as st
-import sseclient
 import urllib3
-import re
-from streamlit_ace import st_ace
-import time
-from tts import text_to_speech
+import os
+import uuid
+from tts import DEFAULT_VOICE, StreamingSpeech
+from voices import get_voice_catalogue
+from storage import get_storage
+from renderer import StreamRenderer
+from vqd import ConversationToken
+from chat import PROMPT_TEMPLATES
+from providers import get_router
+from scheduler import get_chat_scheduler, get_tts_scheduler
+from jobs import CANCELLED, ERROR, QUEUED
+import pipeline
+import metrics
+from assets import audio_chainer, load_css, style_injector
+from session_schema import init_session_state
+
+# st.experimental_rerun was renamed to st.rerun
+rerun = getattr(st, "rerun", None) or st.experimental_rerun
 
 # Page configuration
 st.set_page_config(
@@ -17,349 +28,275 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Custom CSS for modern styling
-st.markdown("""
-<style>
-    .main-header {
-        font-family: 'Helvetica Neue', sans-serif;
-        font-weight: 700;
-        color: #4F8BF9;
-        margin-bottom: 1rem;
-    }
-    
-    .stButton button {
-        background-color: #4F8BF9;
-        color: white;
-        border-radius: 8px;
-        border: none;
-        padding: 0.5rem 1rem;
-        transition: all 0.3s;
-    }
-    
-    .stButton button:hover {
-        background-color: #3670CF;
-        box-shadow: 0px 4px 8px rgba(0, 0, 0, 0.1);
-    }
-    
-    .code-header {
-        font-size: 1.2rem;
-        font-weight: 600;
-        color: #4F8BF9;
-        margin-top: 1rem;
-        margin-bottom: 0.5rem;
-    }
-    
-    .snippet-card {
-        border: 1px solid #e6e6e6;
-        border-radius: 8px;
-        padding: 1rem;
-        margin-bottom: 1rem;
-        background-color: #f9f9f9;
-        transition: all 0.3s;
-    }
-    
-    .snippet-card:hover {
-        box-shadow: 0px 4px 8px rgba(0, 0, 0, 0.1);
-    }
-    
-    .code-actions {
-        display: flex;
-        justify-content: space-between;
-        margin-top: 0.5rem;
-    }
-    
-    /* Chat message styling */
-    .user-message {
-        background-color: #E1F5FE;
-        padding: 1rem;
-        border-radius: 8px;
-        margin-bottom: 1rem;
-        border-left: 5px solid #4FC3F7;
-    }
-    
-    .assistant-message {
-        background-color: #F5F5F5;
-        padding: 1rem;
-        border-radius: 8px;
-        margin-bottom: 1rem;
-        border-left: 5px solid #9E9E9E;
-    }
-    
-    /* Typing indicator */
-    .typing-indicator {
-        display: flex;
-        padding: 10px;
-    }
-    
-    .typing-indicator span {
-        height: 10px;
-        width: 10px;
-        background-color: #4F8BF9;
-        border-radius: 50%;
-        display: inline-block;
-        margin: 0 2px;
-        opacity: 0.8;
-    }
-    
-    .typing-indicator span:nth-child(1) {
-        animation: bounce 1s infinite 0.2s;
-    }
-    .typing-indicator span:nth-child(2) {
-        animation: bounce 1s infinite 0.4s;
-    }
-    .typing-indicator span:nth-child(3) {
-        animation: bounce 1s infinite 0.6s;
-    }
-    
-    @keyframes bounce {
-        0%, 100% { transform: translateY(0); }
-        50% { transform: translateY(-5px); }
-    }
-    
-    /* Fullscreen code editor */
-    .fullscreen-overlay {
-        position: fixed;
-        top: 0;
-        left: 0;
-        width: 100%;
-        height: 100%;
-        background-color: rgba(0, 0, 0, 0.8);
-        z-index: 1000;
-        display: flex;
-        flex-direction: column;
-        justify-content: center;
-        align-items: center;
-    }
-    
-    .close-button {
-        position: absolute;
-        top: 20px;
-        right: 20px;
-        color: white;
-        font-size: 24px;
-        cursor: pointer;
-    }
-    
-    /* Make the sidebar wider */
-    [data-testid="stSidebar"] {
-        min-width: 350px !important;
-    }
-</style>
-""", unsafe_allow_html=True)
+# Initialize session states (see session_schema.py); reruns skip this
+init_session_state(st.session_state)
+
+# Custom CSS for modern styling, sent to the browser once per session (it stays in the page <head>)
+if not st.session_state.css_injected:
+    page_scripts = style_injector(load_css()) + audio_chainer()
+    try:
+        st.html(page_scripts, unsafe_allow_javascript=True)
+    except (AttributeError, TypeError):
+        # Older Streamlit can't run scripts in the page; a zero-height component reaches into it instead
+        import streamlit.components.v1 as components
+        components.html(page_scripts, height=0)
+    st.session_state.css_injected = True
+
+# Metrics endpoint/file, if configured (CHATAPP_METRICS_PORT / CHATAPP_METRICS_FILE)
+metrics.start_exporter()
 
 # App title with styled header
 st.markdown('<h1 class="main-header">Advanced Coding Assistant 🤖</h1>', unsafe_allow_html=True)
 
-# Initialize session states
-if "messages" not in st.session_state:
-    st.session_state.messages = []
+# Optional persistent storage (CHATAPP_STORAGE); the conversation ID lives in the URL so a reload restores it
+storage = get_storage()
 
-if "code_snippets" not in st.session_state:
-    st.session_state.code_snippets = []
+if "conversation_id" not in st.session_state:
+    conversation_id = st.query_params.get("c") if storage.persistent else None
+    if conversation_id:
+        # Only the newest page is loaded, older messages are fetched by "Load earlier messages"
+        page = st.session_state.history_page_size * 2
+        st.session_state.messages = storage.load_messages(conversation_id, limit=page)
+        st.session_state.history_has_more = len(st.session_state.messages) == page
+        for snippet_id, code, language, filename, message_id in storage.load_snippets(conversation_id):
+            st.session_state.snippets.add(code, language, message_id=message_id,
+                                          snippet_id=snippet_id, filename=filename)
+    else:
+        conversation_id = storage.new_conversation()
+        st.session_state.history_has_more = False
+        if storage.persistent:
+            st.query_params["c"] = conversation_id
+    st.session_state.conversation_id = conversation_id
 
-if "file_names" not in st.session_state:
-    st.session_state.file_names = []
-    
-if "vqd4l" not in st.session_state:
-    st.session_state.vqd4l = None
-    
-if "is_typing" not in st.session_state:
-    st.session_state.is_typing = False
 
-if "current_mode" not in st.session_state:
-    st.session_state.current_mode = "chat"  # Default mode
-    
-if "voice_enabled" not in st.session_state:
-    st.session_state.voice_enabled = True
+# Function to show the ACE code editor; the component is only imported once a code mode needs it
+def code_editor(**kwargs):
+    from streamlit_ace import st_ace
+    return st_ace(**kwargs)
 
-if "show_fullscreen_editor" not in st.session_state:
-    st.session_state.show_fullscreen_editor = False
-    
-if "fullscreen_code" not in st.session_state:
-    st.session_state.fullscreen_code = ""
-    
-if "fullscreen_language" not in st.session_state:
-    st.session_state.fullscreen_language = "python"
 
+# Function to add a chat message with a stable ID to the conversation
+def add_message(role, content, **extra):
+    message = {"id": uuid.uuid4().hex, "role": role, "content": content, **extra}
+    st.session_state.messages.append(message)
+    storage.save_message(st.session_state.conversation_id, message)
+    return message
 
-# Function to extract code snippets from markdown text
-def extract_code_snippets(markdown_text):
-    code_blocks = re.findall(r'```(.*?)\n([\s\S]*?)```', markdown_text)
-    snippets = []
-    languages = []
-    
-    for lang, code in code_blocks:
-        lang = lang.strip().lower() if lang.strip() else "text"
-        # Convert common language aliases
-        if lang in ["js", "javascript"]:
-            lang = "javascript"
-        elif lang in ["py", "python"]:
-            lang = "python"
-        elif lang in ["ts", "typescript"]:
-            lang = "typescript"
-        elif lang in ["java"]:
-            lang = "java"
-        elif lang in ["c#", "csharp"]:
-            lang = "csharp"
-        elif lang in ["html", "htm"]:
-            lang = "html"
-        elif lang in ["css"]:
-            lang = "css"
-        elif lang in ["json"]:
-            lang = "json"
-        elif lang in ["xml"]:
-            lang = "xml"
-        else:
-            # Default to python for unknown languages
-            if "public class" in code:
-                lang = "java"
-            elif "function" in code or "var" in code or "const" in code:
-                lang = "javascript"
-            elif "def " in code or "import " in code:
-                lang = "python"
-            else:
-                lang = "text"
-        
-        snippets.append(code)
-        languages.append(lang)
-    
-    return snippets, languages
-
-
-# Function to generate file names based on code content
-def generate_file_name(code, language):
-    extensions = {
-        "python": "py",
-        "javascript": "js",
-        "typescript": "ts",
-        "java": "java",
-        "csharp": "cs",
-        "html": "html",
-        "css": "css",
-        "json": "json",
-        "xml": "xml",
-        "text": "txt"
-    }
-    
-    ext = extensions.get(language, "txt")
-    
-    # Try to extract function or class name from code
-    if language == "python":
-        match = re.search(r'def\s+([a-zA-Z0-9_]+)', code)
-        if match:
-            return f"{match.group(1)}.{ext}"
-        match = re.search(r'class\s+([a-zA-Z0-9_]+)', code)
-        if match:
-            return f"{match.group(1)}.{ext}"
-    elif language == "javascript" or language == "typescript":
-        match = re.search(r'function\s+([a-zA-Z0-9_]+)', code)
-        if match:
-            return f"{match.group(1)}.{ext}"
-        match = re.search(r'class\s+([a-zA-Z0-9_]+)', code)
-        if match:
-            return f"{match.group(1)}.{ext}"
-    elif language == "java":
-        match = re.search(r'class\s+([a-zA-Z0-9_]+)', code)
-        if match:
-            return f"{match.group(1)}.{ext}"
-    
-    # Default filename if no pattern is found
-    return f"snippet_{len(st.session_state.code_snippets) + 1}.{ext}"
-
-
-# Function to get the vqd4 token
-def vqd4():
-    url = "https://duckduckgo.com/duckchat/v1/status"
-    vqd4payload = {}
-    headers = {
-        'sec-gpc': '1',
-        'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
-                      'Chrome/126.0.0.0 Safari/537.36',
-        'x-vqd-accept': '1'
-    }
-    response = requests.request("GET", url, headers=headers, data=vqd4payload)
-    st.session_state.vqd4l = response.headers.get('X-Vqd-4')
-    return st.session_state.vqd4l
 
+# Function to save the code snippets captured while streaming (duplicates are merged by the store)
+def save_snippets(blocks, message_id):
+    for block in blocks:
+        if block.code.strip():  # Ignore empty snippets
+            snippet = st.session_state.snippets.add(block.code, block.language, message_id=message_id)
+            storage.save_snippet(st.session_state.conversation_id, snippet)
 
-# Function to get AI response from DuckDuckGo
-def get_ai_response(user_input):
-    st.session_state.is_typing = True
-    
-    url = 'https://duckduckgo.com/duckchat/v1/chat'
-    headers = {
-        'accept': 'text/event-stream',
-        'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
-                      'Chrome/126.0.0.0 Safari/537.36',
-        'x-vqd-4': vqd4() if not st.session_state.get('vqd4l') else st.session_state.vqd4l,
-        'Content-Type': 'application/json'
+
+# Function to page older messages in from storage once everything in memory is shown
+def load_earlier_messages():
+    if st.session_state.history_has_more and st.session_state.messages:
+        page = st.session_state.history_page_size * 2
+        older = storage.load_messages(st.session_state.conversation_id,
+                                      before_id=st.session_state.messages[0]["id"], limit=page)
+        st.session_state.messages = older + st.session_state.messages
+        st.session_state.history_has_more = len(older) == page
+    st.session_state.history_pages += 1
+
+
+# Function to wrap a chat message in its styled container
+def message_html(message):
+    css_class = "user-message" if message["role"] == "user" else "assistant-message"
+    return f'<div class="{css_class}">{message["content"]}</div>'
+
+
+# Function to describe how an assistant message was streamed
+def message_caption(message):
+    if not message.get("renders"):
+        return None
+    caption = f"Streamed in {message['renders']} renders"
+    if message.get("cached"):
+        caption += " · from cache"
+    if message.get("backend"):
+        caption += f" · via {message['backend']}"
+    if message.get("timing"):
+        caption += (f" · first byte {message['timing']['ttfb'] * 1000:.0f} ms"
+                    f" · total {message['timing']['total'] * 1000:.0f} ms")
+    return caption
+
+
+# Function to show code blocks in the sidebar as soon as the stream closes them
+def show_live_snippets(blocks):
+    with live_snippet_area.container():
+        st.markdown('<div class="code-header">New Code Snippets</div>', unsafe_allow_html=True)
+        for block in blocks:
+            if block.code.strip():
+                st.code(block.code, language=block.language)
+
+
+# Function to show synthesized sentences as soon as they are ready, in order; the page plays them back to back
+def play_ready_segments(speech, container, shown):
+    # Only an answer heard for the first time starts by itself; a rerun shows its players again without replaying
+    autoplay = not speech.delivered
+    speech.ready()
+    for index in range(shown, len(speech.delivered)):
+        container.audio(speech.delivered[index], format='audio/mp3', start_time=0, autoplay=autoplay and index == 0)
+    return len(speech.delivered)
+
+
+# Function to submit one answer in the given mode, served from the response cache when possible
+def submit_turn(mode, user_input, token, speech=None, force_refresh=False):
+    # Send the conversation so far (minus the user message just added for this turn)
+    return pipeline.submit_turn(mode, user_input, st.session_state.messages[:-1], token, speech,
+                                force_refresh=force_refresh, model=st.session_state.model,
+                                context_window=st.session_state.context_window,
+                                session=st.session_state.session_id,
+                                session_limit=st.session_state.request_limit,
+                                profile=st.session_state.profile_requests)
+
+
+# Function to start the assistant turn for the user message just added, without waiting for it
+def start_turn(user_input, force_refresh=False):
+    mode = st.session_state.current_mode
+    speech = (StreamingSpeech(voice=st.session_state.voice, session=st.session_state.session_id)
+              if st.session_state.voice_enabled else None)
+    st.session_state.active_jobs = {
+        mode: submit_turn(mode, user_input, st.session_state.vqd_token, speech, force_refresh)
     }
-    
-    # Adjust the prompt based on the current mode
-    if st.session_state.current_mode == "explain":
-        prompt = f"Please explain this code in simple terms, highlight any issues, and suggest improvements: {user_input}"
-    elif st.session_state.current_mode == "debug":
-        prompt = f"Debug this code and provide a corrected version with explanations: {user_input}"
-    elif st.session_state.current_mode == "optimize":
-        prompt = f"Optimize this code for better performance and explain your changes: {user_input}"
-    else:  # chat mode
-        prompt = user_input
-    
-    data = {
-        "model": "claude-3-haiku-20240307",
-        "messages": [{"role": "user", "content": prompt}]
+    st.session_state.is_typing = True
+
+
+# Function to explain, debug and optimize the same code at once
+def start_analysis(code_input, force_refresh=False):
+    # Each analysis runs as its own upstream conversation so they don't race on one rotating token
+    st.session_state.active_jobs = {
+        mode: submit_turn(mode, code_input, ConversationToken(), force_refresh=force_refresh)
+        for mode in PROMPT_TEMPLATES
     }
-    
-    try:
-        response = requests.post(url, headers=headers, data=json.dumps(data), stream=True)
-        client = sseclient.SSEClient(response)
-        ai_full_response = ""
-        temp_response = st.empty()
-        
-        # Display typing indicator
-        with temp_response:
-            st.markdown(
-                """
-                <div class="typing-indicator">
-                    <span></span>
-                    <span></span>
-                    <span></span>
-                </div>
-                """,
-                unsafe_allow_html=True
-            )
-        
-        for event in client.events():
-            if event.data != '[DONE]':
-                try:
-                    parsed_data = json.loads(event.data)
-                    if 'message' in parsed_data:
-                        ai_full_response += parsed_data['message']
-                        # Update the response in real-time
-                        with temp_response:
-                            st.markdown(ai_full_response)
-                except json.JSONDecodeError:
-                    pass
-            else:
-                temp_response.empty()
-        
-        st.session_state.is_typing = False
-        return ai_full_response
-    
-    except Exception as e:
-        st.session_state.is_typing = False
-        st.error(f"Error: {str(e)}")
-        return f"I'm sorry, I encountered an error: {str(e)}. Please try again later."
+    st.session_state.is_typing = True
+
+
+# Function to stop the turn in progress
+def cancel_jobs():
+    for job in st.session_state.active_jobs.values():
+        job.cancel()
+    st.session_state.active_jobs = {}
+    st.session_state.is_typing = False
+
+
+# Function to render whatever a job produced since the last poll
+def drain_job(view):
+    job = view["job"]
+    text = job.text
+    view["renderer"].feed(text[view["offset"]:])
+    view["offset"] = len(text)
+    if job.speech:
+        view["segments"] = play_ready_segments(job.speech, view["audio"], view["segments"])
+    # Touching the page on every poll lets a click elsewhere interrupt this run
+    position = job.queue_position()
+    if position:
+        view["status"].caption(f"Queued: {position - 1} request{'' if position == 2 else 's'} ahead of yours..."
+                               if position > 1 else "Queued: yours is next...")
+    elif job.status == QUEUED:
+        view["status"].caption("Waiting for a free request slot...")
+    else:
+        view["status"].caption(f"Generating... {view['offset']} characters")
 
 
-# Function to handle text-to-speech
-def handle_tts(ai_full_response):
-    if st.session_state.voice_enabled:
-        try:
-            audiofile = text_to_speech(ai_full_response)
-            st.audio(audiofile, format='audio/mp3', start_time=0)
-        except Exception as e:
-            st.warning(f"Text-to-speech failed: {str(e)}")
+# Function to show the running jobs, one per area; any rerun attaches to them again from the start
+def render_jobs(jobs, areas):
+    views = []
+    for job, area in zip(jobs, areas):
+        with area:
+            temp_response = st.empty()
+            
+            # Display typing indicator
+            with temp_response:
+                st.markdown(
+                    """
+                    <div class="typing-indicator">
+                        <span></span>
+                        <span></span>
+                        <span></span>
+                    </div>
+                    """,
+                    unsafe_allow_html=True
+                )
+            
+            views.append({
+                "job": job,
+                "renderer": StreamRenderer(
+                    temp_response,
+                    flush_interval=st.session_state.render_flush_ms / 1000,
+                    flush_chars=st.session_state.render_flush_chars
+                ),
+                "audio": st.container() if job.speech else None,
+                "status": st.empty(),
+                "offset": 0,
+                "segments": 0,
+            })
+    
+    shown_blocks = 0
+    while True:
+        running = [view for view in views if not view["job"].done]
+        if not running:
+            break
+        running[0]["job"].wait(running[0]["offset"], timeout=0.1)
+        for view in views:
+            drain_job(view)
+        # Code blocks are picked up while streaming and shown in the sidebar right away
+        blocks = [block for job in jobs for block in job.code_blocks]
+        if len(blocks) > shown_blocks:
+            shown_blocks = len(blocks)
+            show_live_snippets(blocks)
+    
+    for view in views:
+        drain_job(view)
+        view["renderer"].close()
+        view["status"].empty()
+    return [view["renderer"].render_count for view in views]
+
+
+# Function to describe how a job ended, as the text kept in the conversation
+def job_content(job):
+    if job.status == ERROR:
+        st.error(f"Error: {job.error}")
+        return f"I'm sorry, I encountered an error: {job.error}. Please try again later."
+    if job.status == CANCELLED:
+        return job.text + "\n\n*(stopped)*"
+    return job.text
+
+
+# Function to add the finished turn to the conversation; an analysis becomes one message with a section per mode
+def finalize_jobs(jobs, renders):
+    st.session_state.active_jobs = {}
+    st.session_state.is_typing = False
+    if any(job.consumed for job in jobs.values()):
+        return
+    for job in jobs.values():
+        job.consumed = True
+    
+    if len(jobs) == 1:
+        content = job_content(next(iter(jobs.values())))
+    else:
+        content = "\n\n".join(f"**{mode.capitalize()}**\n\n{job_content(job)}" for mode, job in jobs.items())
+    
+    # The slowest request is the one the user waited for
+    timings = [job.timing for job in jobs.values() if job.timing]
+    timing = max(timings, key=lambda timing: timing.total or 0) if timings else None
+    audios = [job.audio for job in jobs.values() if job.audio]
+    profiles = [f"[{mode}] {job.profile_report}" if len(jobs) > 1 else job.profile_report
+                for mode, job in jobs.items() if job.profile_report]
+    
+    # Add assistant response
+    message = add_message("assistant", content,
+                          renders=sum(renders),
+                          timing=timing.as_dict() if timing else None,
+                          audio=audios[0] if audios else None,
+                          cached=all(job.cached for job in jobs.values()),
+                          backend=", ".join(sorted({job.backend for job in jobs.values() if job.backend})) or None,
+                          profile="\n\n".join(profiles) or None)
+    
+    # Save the code snippets captured while streaming
+    save_snippets([block for job in jobs.values() for block in job.code_blocks], message["id"])
 
 
 # Create a two-column layout
@@ -388,58 +325,161 @@ with col2:
         elif mode == "Optimize Code":
             st.session_state.current_mode = "optimize"
         
+        # Model selection; "Auto" routes each turn to the backend answering fastest
+        models = get_router().models()
+        model = st.selectbox(
+            "Model:", ["Auto"] + models,
+            index=models.index(st.session_state.model) + 1 if st.session_state.model in models else 0
+        )
+        st.session_state.model = None if model == "Auto" else model
+        
         # Voice toggle
         st.session_state.voice_enabled = st.toggle("Enable Voice Response", value=st.session_state.voice_enabled)
         
+        # Voice picker, served from the cached voice catalogue
+        if st.session_state.voice_enabled:
+            catalogue = get_voice_catalogue()
+            current = catalogue.get(st.session_state.voice) or catalogue.get(DEFAULT_VOICE)
+            locales = catalogue.locales()
+            locale = st.selectbox(
+                "Voice language:", locales,
+                index=locales.index(current["Locale"]) if current else 0
+            )
+            names = [voice["ShortName"] for voice in catalogue.find(locale=locale)]
+            st.session_state.voice = st.selectbox(
+                "Voice:", names,
+                index=names.index(st.session_state.voice) if st.session_state.voice in names else 0
+            )
+        
+        # Streaming render policy
+        with st.expander("Streaming Settings"):
+            st.session_state.render_flush_ms = st.number_input(
+                "Flush interval (ms)", min_value=0, max_value=1000, step=10,
+                value=st.session_state.render_flush_ms
+            )
+            st.session_state.render_flush_chars = st.number_input(
+                "Flush size (chars)", min_value=1, max_value=4096, step=64,
+                value=st.session_state.render_flush_chars
+            )
+        
+        # Debug tools
+        with st.expander("Debug"):
+            st.session_state.profile_requests = st.toggle(
+                "Profile requests", value=st.session_state.profile_requests,
+                help="Sample where each request spends its time and show it under the answer"
+            )
+            for name, stats in get_router().snapshot().items():
+                ttft = f"{stats['ttft'] * 1000:.0f} ms" if stats["ttft"] is not None else "n/a"
+                st.caption(f"Backend {name}: first token {ttft} · errors {stats['error_rate'] * 100:.0f}%"
+                           f"{'' if stats['available'] else ' · cooling down'}")
+            for scheduler in (get_chat_scheduler(), get_tts_scheduler()):
+                waiting, in_flight = scheduler.depth()
+                st.caption(f"Queue {scheduler.name}: {in_flight}/{scheduler.capacity} running · {waiting} waiting")
+            if metrics.METRICS_PORT:
+                st.caption(f"Metrics: http://127.0.0.1:{metrics.METRICS_PORT}/metrics")
+            elif metrics.METRICS_FILE:
+                st.caption(f"Metrics: {metrics.METRICS_FILE}")
+        
         # Clear chat button
         if st.button("Clear Chat"):
             st.session_state.messages = []
-            st.session_state.code_snippets = []
-            st.session_state.file_names = []
-            st.experimental_rerun()
+            st.session_state.context_window.forget()
+            st.session_state.history_pages = 1
+            cancel_jobs()
+            st.session_state.vqd_token.reset()  # Start the next conversation on a fresh token
+            st.session_state.snippets.clear()
+            st.session_state.conversation_id = storage.new_conversation()
+            st.session_state.history_has_more = False
+            if storage.persistent:
+                st.query_params["c"] = st.session_state.conversation_id
+            rerun()
+    
+        # Conversation context sent with each request
+        with st.expander("Conversation Settings"):
+            st.session_state.context_window.budget = st.number_input(
+                "Context budget (tokens)", min_value=500, max_value=32000, step=500,
+                value=st.session_state.context_window.budget
+            )
+            # Applies to the next request; those in flight keep the limit they were queued with
+            st.session_state.request_limit = st.number_input(
+                "Parallel requests", min_value=1, max_value=8, step=1,
+                value=st.session_state.request_limit
+            )
+        
+        # Full-text search over this conversation's stored messages and snippets
+        if storage.persistent:
+            query = st.text_input("Search history", placeholder="Search messages and snippets...")
+            if query:
+                for result in storage.search(query, st.session_state.conversation_id):
+                    st.markdown(f"- *{result['kind']}* · {result['excerpt']}")
     
     # Code snippet section
-    if st.session_state.code_snippets:
+    snippets = st.session_state.snippets
+    if len(snippets):
         st.markdown('<div class="code-header">Saved Code Snippets</div>', unsafe_allow_html=True)
         
-        for idx, (snippet, language) in enumerate(zip(st.session_state.code_snippets, st.session_state.file_names)):
-            with st.expander(f"Snippet {idx+1}: {st.session_state.file_names[idx]}"):
-                st.code(snippet, language=language.split('.')[-1] if '.' in language else 'python')
+        for snippet in snippets.page(0, st.session_state.snippets_visible):
+            with st.expander(f"Snippet {snippet.id}: {snippet.filename}"):
+                st.code(snippet.code, language=snippet.language)
                 
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    if st.button("Edit", key=f"edit_{idx}"):
-                        st.session_state.fullscreen_code = snippet
-                        st.session_state.fullscreen_language = language.split('.')[-1] if '.' in language else 'python'
+                edit_col, copy_col, delete_col = st.columns(3)
+                with edit_col:
+                    if st.button("Edit", key=f"edit_{snippet.id}"):
+                        st.session_state.fullscreen_code = snippet.code
+                        st.session_state.fullscreen_language = snippet.language
                         st.session_state.show_fullscreen_editor = True
-                        st.session_state.editing_idx = idx
-                with col2:
-                    if st.button("Copy", key=f"copy_{idx}"):
+                        st.session_state.editing_id = snippet.id
+                with copy_col:
+                    if st.button("Copy", key=f"copy_{snippet.id}"):
                         # We can't actually copy to clipboard in Streamlit, but we can show a success message
                         st.success("Code copied to clipboard!")
-                with col3:
-                    if st.button("Delete", key=f"delete_{idx}"):
-                        st.session_state.code_snippets.pop(idx)
-                        st.session_state.file_names.pop(idx)
-                        st.experimental_rerun()
+                with delete_col:
+                    if st.button("Delete", key=f"delete_{snippet.id}"):
+                        snippets.delete(snippet.id)
+                        storage.delete_snippet(st.session_state.conversation_id, snippet.id)
+                        rerun()
+        
+        if len(snippets) > st.session_state.snippets_visible:
+            if st.button(f"Show more snippets ({len(snippets) - st.session_state.snippets_visible} hidden)"):
+                st.session_state.snippets_visible += 20
+                rerun()
+
+    # Filled in while a response is streaming
+    live_snippet_area = st.empty()
 
 with col1:
     # Chat interface
     chat_container = st.container()
     
     with chat_container:
-        # Display existing chat messages
-        for message in st.session_state.messages:
-            if message["role"] == "user":
-                st.markdown(f'<div class="user-message">{message["content"]}</div>', unsafe_allow_html=True)
-            else:
-                st.markdown(f'<div class="assistant-message">{message["content"]}</div>', unsafe_allow_html=True)
+        # Only the most recent turns are drawn (and converted from markdown) on each rerun; older ones are paged in on demand
+        messages = st.session_state.messages
+        visible = st.session_state.history_page_size * 2 * st.session_state.history_pages
+        if len(messages) > visible or st.session_state.history_has_more:
+            if st.button("Load earlier messages"):
+                load_earlier_messages()
+                rerun()
+        
+        for message in messages[-visible:]:
+            st.markdown(message_html(message), unsafe_allow_html=True)
+            if message["role"] == "assistant":
+                if message.get("audio") and os.path.exists(message["audio"]):
+                    st.audio(message["audio"], format='audio/mp3', start_time=0)
+                caption = message_caption(message)
+                if caption:
+                    st.caption(caption)
+                if message.get("profile"):
+                    with st.expander("Request profile"):
+                        st.code(message["profile"], language="text")
+        
+        # Filled in by the turn in progress, see the end of the script
+        job_area = st.container()
     
     # User input based on the selected mode
     if st.session_state.current_mode in ["explain", "debug", "optimize"]:
         # Code input area
         st.markdown(f'<div class="code-header">Enter code to {st.session_state.current_mode}:</div>', unsafe_allow_html=True)
-        code_input = st_ace(
+        code_input = code_editor(
             placeholder=f"Enter your code here to {st.session_state.current_mode}...",
             language="python",
             theme="monokai",
@@ -447,57 +487,37 @@ with col1:
             key="code_input"
         )
         
-        if st.button(f"{mode.split()[0]} Code"):
+        force_refresh = st.checkbox("Force refresh", help="Ask again instead of reusing a cached answer for this code")
+        
+        if st.button(f"{mode.split()[0]} Code", disabled=st.session_state.is_typing):
             if code_input:
                 # Add user message
-                st.session_state.messages.append({"role": "user", "content": f"Please {st.session_state.current_mode} this code:\n```\n{code_input}\n```"})
-                
-                # Get AI response
-                with st.spinner(f"{mode.split()[0]}ing your code..."):
-                    ai_response = get_ai_response(code_input)
+                add_message("user", f"Please {st.session_state.current_mode} this code:\n```\n{code_input}\n```")
                 
-                # Add assistant response
-                st.session_state.messages.append({"role": "assistant", "content": ai_response})
-                
-                # Extract and save code snippets
-                snippets, languages = extract_code_snippets(ai_response)
-                for i, (snippet, lang) in enumerate(zip(snippets, languages)):
-                    if snippet.strip():  # Ignore empty snippets
-                        st.session_state.code_snippets.append(snippet)
-                        filename = generate_file_name(snippet, lang)
-                        st.session_state.file_names.append(filename)
-                
-                # Text-to-speech for the response
-                handle_tts(ai_response)
+                # Get AI response in the background
+                start_turn(code_input, force_refresh=force_refresh)
+                rerun()
+        
+        if st.button("Analyze all", disabled=st.session_state.is_typing,
+                     help="Explain, debug and optimize this code at the same time"):
+            if code_input:
+                # Add user message
+                add_message("user", f"Please explain, debug and optimize this code:\n```\n{code_input}\n```")
                 
-                st.experimental_rerun()
+                # Get all three AI responses in the background
+                start_analysis(code_input, force_refresh=force_refresh)
+                rerun()
     else:
         # Normal chat input
-        user_input = st.chat_input("Ask me anything about coding...")
+        user_input = st.chat_input("Ask me anything about coding...", disabled=st.session_state.is_typing)
         
         if user_input:
             # Add user message
-            st.session_state.messages.append({"role": "user", "content": user_input})
-            
-            # Get AI response
-            with st.spinner("Processing your request..."):
-                ai_response = get_ai_response(user_input)
-            
-            # Add assistant response
-            st.session_state.messages.append({"role": "assistant", "content": ai_response})
-            
-            # Extract and save code snippets
-            snippets, languages = extract_code_snippets(ai_response)
-            for i, (snippet, lang) in enumerate(zip(snippets, languages)):
-                if snippet.strip():  # Ignore empty snippets
-                    st.session_state.code_snippets.append(snippet)
-                    filename = generate_file_name(snippet, lang)
-                    st.session_state.file_names.append(filename)
+            add_message("user", user_input)
             
-            # Text-to-speech for the response
-            handle_tts(ai_response)
-            
-            st.experimental_rerun()
+            # Get AI response in the background
+            start_turn(user_input)
+            rerun()
 
 # Fullscreen code editor
 if st.session_state.show_fullscreen_editor:
@@ -513,7 +533,7 @@ if st.session_state.show_fullscreen_editor:
         </div>
         """, unsafe_allow_html=True)
         
-        edited_code = st_ace(
+        edited_code = code_editor(
             value=st.session_state.fullscreen_code,
             language=st.session_state.fullscreen_language,
             theme="monokai",
@@ -525,12 +545,33 @@ if st.session_state.show_fullscreen_editor:
         with col1:
             if st.button("Save Changes"):
                 # Update the code snippet
-                idx = st.session_state.editing_idx
-                st.session_state.code_snippets[idx] = edited_code
+                if st.session_state.editing_id in st.session_state.snippets:
+                    snippet = st.session_state.snippets.update(st.session_state.editing_id, edited_code)
+                    storage.save_snippet(st.session_state.conversation_id, snippet)
                 st.session_state.show_fullscreen_editor = False
-                st.experimental_rerun()
+                rerun()
         
         with col2:
             if st.button("Cancel"):
                 st.session_state.show_fullscreen_editor = False
-                st.experimental_rerun()
+                rerun()
+
+# Stream the turn in progress last so the rest of the page is already drawn; the jobs themselves
+# run in the background, so reruns from any widget just attach to them again
+jobs = st.session_state.active_jobs
+if jobs:
+    with job_area:
+        if st.button("Stop generating"):
+            for job in jobs.values():
+                job.cancel()
+        if len(jobs) > 1:
+            areas = st.tabs([mode.capitalize() for mode in jobs])
+            label = "Analyzing your code..."
+        else:
+            areas = [st.container()]
+            label = (f"{mode.split()[0]}ing your code..." if st.session_state.current_mode != "chat"
+                     else "Processing your request...")
+        with st.spinner(label):
+            renders = render_jobs(list(jobs.values()), areas)
+        finalize_jobs(jobs, renders)
+    rerun()
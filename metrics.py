@@ -0,0 +1,286 @@
+import atexit
+import bisect
+import contextlib
+import http.server
+import os
+import threading
+import time
+
+# Metrics are off unless one of these is set:
+#   CHATAPP_METRICS_PORT=9464           serve Prometheus text format on http://127.0.0.1:9464/metrics
+#   CHATAPP_METRICS_FILE=/path/to/file  rewrite the same text every CHATAPP_METRICS_INTERVAL seconds
+METRICS_PORT = os.environ.get("CHATAPP_METRICS_PORT")
+METRICS_FILE = os.environ.get("CHATAPP_METRICS_FILE")
+METRICS_INTERVAL = float(os.environ.get("CHATAPP_METRICS_INTERVAL", 10))
+ENABLED = bool(METRICS_PORT or METRICS_FILE)
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    """A monotonically increasing count per label set"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _format_labels(self.labels, key), value) for key, value in sorted(self._values.items())]
+
+
+class Gauge:
+    """A value that goes up and down, per label set"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _format_labels(self.labels, key), value) for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+    """Observations bucketed by upper bound, with their sum and count, per label set"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                values[index] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(values)) for key, values in sorted(self._values.items())]
+        samples = []
+        for key, values in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", _format_labels(self.labels, key, [("le", bound)]), cumulative))
+            samples.append((f"{self.name}_bucket", _format_labels(self.labels, key, [("le", "+Inf")]), values[-1]))
+            samples.append((f"{self.name}_sum", _format_labels(self.labels, key), round(values[-2], 6)))
+            samples.append((f"{self.name}_count", _format_labels(self.labels, key), values[-1]))
+        return samples
+
+
+class Registry:
+    """The set of metrics exported by this process"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text, labels=()):
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text, labels=()):
+        return self._get(Gauge, name, help_text, labels)
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help_text, labels, buckets)
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {value}" for name, labels, value in metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def _get(self, cls, name, *args):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args)
+            return metric
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "chatapp_stage_seconds", "Time spent in each stage of the turn pipeline", labels=("stage",))
+STAGE_ERRORS = REGISTRY.counter(
+    "chatapp_stage_errors_total", "Stages that ended with an exception", labels=("stage",))
+EVENTS = REGISTRY.counter(
+    "chatapp_events_total", "Things that happened in the turn pipeline", labels=("event",))
+QUEUE_DEPTH = REGISTRY.gauge(
+    "chatapp_queue_depth", "Upstream requests waiting for admission, per queue", labels=("queue",))
+QUEUE_IN_FLIGHT = REGISTRY.gauge(
+    "chatapp_queue_in_flight", "Upstream requests admitted and running, per queue", labels=("queue",))
+QUEUE_WAIT = REGISTRY.histogram(
+    "chatapp_queue_wait_seconds", "Time upstream requests waited for admission, per queue", labels=("queue",))
+BACKEND_TTFT = REGISTRY.histogram(
+    "chatapp_backend_ttft_seconds", "Time to the first token, per chat backend", labels=("backend",))
+BACKEND_REQUESTS = REGISTRY.counter(
+    "chatapp_backend_requests_total", "Chat requests per backend and outcome", labels=("backend", "outcome"))
+
+# Shared no-op context for when metrics are off; costs one call and no allocation
+_NOOP = contextlib.nullcontext()
+
+
+class _Span:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        STAGE_SECONDS.observe(time.perf_counter() - self.start, stage=self.stage)
+        if exc_type is not None:
+            STAGE_ERRORS.inc(stage=self.stage)
+        return False
+
+
+def span(stage):
+    """
+    Time a block as one stage of the pipeline
+
+        with metrics.span("tts_synthesis"):
+            ...
+    """
+    return _Span(stage) if ENABLED else _NOOP
+
+
+def observe(stage, seconds):
+    """Record a duration measured by the caller, e.g. summed over a generator's lifetime"""
+    if ENABLED:
+        STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+def count(event, amount=1):
+    if ENABLED:
+        EVENTS.inc(amount, event=event)
+
+
+def queue_depth(queue, waiting, in_flight):
+    if ENABLED:
+        QUEUE_DEPTH.set(waiting, queue=queue)
+        QUEUE_IN_FLIGHT.set(in_flight, queue=queue)
+
+
+def queue_wait(queue, seconds):
+    if ENABLED:
+        QUEUE_WAIT.observe(seconds, queue=queue)
+
+
+def backend_result(backend, outcome, ttft=None):
+    """Record how a request to a chat backend went, and its time to first token if it answered"""
+    if ENABLED:
+        BACKEND_REQUESTS.inc(backend=backend, outcome=outcome)
+        if ttft is not None:
+            BACKEND_TTFT.observe(ttft, backend=backend)
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def write_file(path=METRICS_FILE):
+    """Atomically replace ``path`` with the current metrics"""
+    partial_path = f"{path}.part"
+    with open(partial_path, "w", encoding="utf-8") as f:
+        f.write(REGISTRY.render())
+    os.replace(partial_path, path)
+
+
+def _write_loop(path, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            write_file(path)
+        except OSError as e:
+            print(f"Metrics write error: {str(e)}")
+
+
+_exporter_started = False
+_exporter_lock = threading.Lock()
+
+
+def start_exporter():
+    """Start the endpoint and/or file writer configured by the environment, once per process"""
+    global _exporter_started
+    if not ENABLED or _exporter_started:
+        return
+    with _exporter_lock:
+        if _exporter_started:
+            return
+        _exporter_started = True
+        if METRICS_PORT:
+            try:
+                server = http.server.ThreadingHTTPServer(("127.0.0.1", int(METRICS_PORT)), _MetricsHandler)
+            except OSError as e:
+                print(f"Metrics endpoint error: {str(e)}")
+            else:
+                threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        if METRICS_FILE:
+            threading.Thread(target=_write_loop, args=(METRICS_FILE, METRICS_INTERVAL),
+                             name="metrics-file", daemon=True).start()
+            atexit.register(write_file, METRICS_FILE)
@@ -0,0 +1,79 @@
+from chat import PROMPT_TEMPLATES, build_prompt
+from context import ConversationWindow
+from jobs import submit_cached_job, submit_chat_job
+from response_cache import get_response_cache
+from snippet_store import SnippetStore
+
+MODES = ("chat",) + tuple(PROMPT_TEMPLATES)
+# Cache key model for turns the router sends to any backend; their answers
+# may come from any model, so they aren't reused for a model asked by name
+AUTO_MODEL = "auto"
+
+
+def submit_turn(mode, user_input, history, token, speech=None, force_refresh=False, model=None,
+                context_window=None, session=None, session_limit=None, profile=False, language=None):
+    """
+    Start one answer in the given mode, served from the response cache when possible
+
+    Args:
+        mode (str): One of MODES
+        user_input (str): The user's message, or the code for a code mode
+        history (list): Earlier messages ({"id", "role", "content"}), oldest first
+        token (vqd.ConversationToken): The conversation's VQD token
+        speech (tts.StreamingSpeech): Speak the answer while it streams
+        force_refresh (bool): Ask again instead of reusing a cached answer
+        model (str): Model to ask, or None to let the router pick the backend
+        context_window (context.ConversationWindow): Trims the history sent; a default one if None
+        session (str): Who the turn is for, for fair admission between sessions
+        session_limit (int): Requests the session may have in flight upstream at once
+        profile (bool): Keep a sampling profile of the turn
+        language (str): Language of the code, when the caller knows it (see response_cache.normalize_code)
+
+    Returns:
+        jobs.ChatJob: The running job
+    """
+    # Code modes reuse the answer to the same code, unless a refresh was asked for
+    cache_key = None
+    if mode in PROMPT_TEMPLATES:
+        cache = get_response_cache()
+        cache_key = cache.make_key(mode, model or AUTO_MODEL, user_input, language)
+        cached = None if force_refresh else cache.lookup(cache_key)
+        if cached is not None:
+            return submit_cached_job(cached["text"], speech, backend=cached["backend"], model=cached["model"])
+
+    prompt = build_prompt(mode, user_input)
+    window = context_window or ConversationWindow(budget=3000)
+    messages = window.build(history, prompt)
+    return submit_chat_job(messages, token, speech, cache_key=cache_key, session=session,
+                           session_limit=session_limit, profile=profile, model=model)
+
+
+def describe_snippets(blocks, store=None):
+    """
+    Name code blocks the way the snippet sidebar does and describe them as plain data
+
+    Args:
+        blocks (list): code_blocks.CodeBlock tuples, in order
+        store (SnippetStore): Store earlier blocks of the same answer went to, so
+            names stay unique across calls; a fresh one if None
+
+    Returns:
+        list: {"id", "filename", "language", "code", "content_hash"} dicts; empty
+            and repeated blocks are left out, like in the sidebar
+    """
+    store = SnippetStore() if store is None else store
+    snippets = []
+    for block in blocks:
+        if not block.code.strip():
+            continue
+        count = len(store)
+        snippet = store.add(block.code, block.language)
+        if len(store) > count:
+            snippets.append({
+                "id": snippet.id,
+                "filename": snippet.filename,
+                "language": snippet.language,
+                "code": snippet.code,
+                "content_hash": snippet.content_hash,
+            })
+    return snippets
@@ -0,0 +1,94 @@
+import collections
+import sys
+import threading
+import time
+
+
+class SamplingProfiler:
+    """
+    Wall-clock sampling profiler for one thread.
+
+    A helper thread looks at the target thread's stack every ``interval``
+    seconds (via sys._current_frames) and counts each distinct stack, so it
+    costs nothing when not running and only the sampling thread's time while
+    it is. Time blocked on the network shows up too, which is what a slow
+    turn usually needs. Results are available as folded stacks (the input
+    format of flamegraph tools) or as the functions seen most often.
+    """
+
+    def __init__(self, thread_id=None, interval=0.005, max_depth=64):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        self._started_at = 0.0
+
+    def start(self):
+        self._stop.clear()
+        self._started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._sample_loop, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.duration = time.perf_counter() - self._started_at
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.stop()
+        return False
+
+    def folded(self):
+        """Return one "outer;...;inner count" line per distinct stack"""
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+    def top(self, limit=15):
+        """
+        Functions by the share of samples they appear in (inclusive time),
+        leaving out the frames at the root of every sample
+
+        Returns:
+            list: (function, fraction of samples) tuples, highest first
+        """
+        stacks = [(stack.split(";"), count) for stack, count in self.stacks.items()]
+        # Frames every sample shares (thread bootstrap, the worker loop) say nothing; skip them
+        common = 0
+        if stacks:
+            shortest = min(len(frames) for frames, _ in stacks)
+            while common < shortest and len({frames[common] for frames, _ in stacks}) == 1:
+                common += 1
+        seen = collections.Counter()
+        for frames, count in stacks:
+            for function in set(frames[common:]):
+                seen[function] += count
+        return [(function, count / self.samples) for function, count in seen.most_common(limit)] if self.samples else []
+
+    def summary(self, limit=15):
+        """A short text report of top()"""
+        lines = [f"{self.samples} samples over {self.duration * 1000:.0f} ms"]
+        lines.extend(f"{fraction * 100:5.1f}%  {function}" for function, fraction in self.top(limit))
+        return "\n".join(lines)
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None and len(names) < self.max_depth:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(names))] += 1
+            self.samples += 1
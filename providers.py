@@ -0,0 +1,418 @@
+import abc
+import json
+import os
+import random
+import threading
+import time
+
+import metrics
+from chat import MODELS, get_ai_response
+from transport import get_transport
+from vqd import STATUS_URL, ConversationToken
+
+# Backends to route between, in order of preference before any latency is known.
+# "openai" is any server speaking the OpenAI chat completions API with
+# streaming, e.g. CHATAPP_OPENAI_URL=https://api.openai.com/v1 or a local
+# llama.cpp / vLLM / Ollama server; the first model listed is its default.
+OPENAI_URL = os.environ.get("CHATAPP_OPENAI_URL", "").rstrip("/")
+OPENAI_API_KEY = os.environ.get("CHATAPP_OPENAI_API_KEY")
+OPENAI_MODELS = [model.strip() for model in os.environ.get("CHATAPP_OPENAI_MODELS", "gpt-4o-mini").split(",")
+                 if model.strip()]
+BACKENDS = [name.strip() for name in os.environ.get("CHATAPP_BACKENDS", "ddg,openai").split(",") if name.strip()]
+# Seconds between background health checks; 0 turns them off
+HEALTH_INTERVAL = float(os.environ.get("CHATAPP_HEALTH_INTERVAL", 60))
+
+HEALTH_TIMEOUT = (3.0, 5.0)
+
+
+class ChatBackend(abc.ABC):
+    """
+    A service that streams chat completions.
+
+    Subclasses implement stream() and health_check(); ``models`` lists the
+    models the backend can serve, the first being its default.
+    """
+
+    name = "backend"
+
+    def __init__(self, models):
+        self.models = list(models)
+
+    @property
+    def default_model(self):
+        return self.models[0]
+
+    def serves(self, model):
+        return model is None or model in self.models
+
+    @abc.abstractmethod
+    def stream(self, messages, model=None, token=None, cancel_event=None, on_response=None):
+        """
+        Stream a response
+
+        Args:
+            messages (list): Conversation to send, ending with the current prompt
+            model (str): Model to ask, or None for the backend's default
+            token (vqd.ConversationToken): The conversation's VQD token, for backends that use one
+            cancel_event (threading.Event): Stop reading the stream once set
+            on_response (callable): Called with the HTTP response before streaming starts
+
+        Yields:
+            str: Text deltas as they arrive
+        """
+
+    @abc.abstractmethod
+    def health_check(self):
+        """
+        Returns:
+            bool: Whether the backend answered
+        """
+
+
+class DuckDuckGoBackend(ChatBackend):
+    """The DuckDuckGo AI chat (see chat.get_ai_response)"""
+
+    name = "ddg"
+
+    def __init__(self, models=MODELS):
+        super().__init__(models)
+
+    def stream(self, messages, model=None, token=None, cancel_event=None, on_response=None):
+        # A conversation that started on another backend has no token yet
+        token = token if token is not None else ConversationToken()
+        return get_ai_response(messages, token, cancel_event=cancel_event, on_response=on_response,
+                               model=model or self.default_model)
+
+    def health_check(self):
+        response = get_transport().get(STATUS_URL, headers={'x-vqd-accept': '1'}, timeout=HEALTH_TIMEOUT)
+        response.close()
+        return response.ok
+
+
+class OpenAIBackend(ChatBackend):
+    """
+    A server with an OpenAI-style ``/chat/completions`` endpoint, read as
+    server-sent events with ``stream: true``
+
+    Args:
+        base_url (str): API root, up to and including the version, e.g. https://api.openai.com/v1
+        models (list): Models to offer, the first being the default
+        api_key (str): Sent as a bearer token, if set
+        name (str): Name the backend is reported under
+    """
+
+    def __init__(self, base_url, models, api_key=None, name="openai"):
+        super().__init__(models)
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.name = name
+
+    def _headers(self):
+        headers = {'Content-Type': 'application/json'}
+        if self.api_key:
+            headers['Authorization'] = f'Bearer {self.api_key}'
+        return headers
+
+    def stream(self, messages, model=None, token=None, cancel_event=None, on_response=None):
+        headers = self._headers()
+        headers['accept'] = 'text/event-stream'
+        data = json.dumps({"model": model or self.default_model, "messages": messages, "stream": True})
+
+        with metrics.span("chat_request"):
+            response = get_transport().post(f"{self.base_url}/chat/completions", headers=headers,
+                                            data=data, stream=True)
+            if not response.ok:
+                response.close()
+                response.raise_for_status()
+        if on_response:
+            on_response(response)
+
+        import sseclient  # Imported on the first request rather than at app start
+        
+        read_seconds = 0.0
+        try:
+            waited = time.perf_counter()
+            for event in sseclient.SSEClient(response).events():
+                read_seconds += time.perf_counter() - waited
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                if event.data == '[DONE]':
+                    break
+                try:
+                    parsed_data = json.loads(event.data)
+                except json.JSONDecodeError:
+                    continue
+                if 'error' in parsed_data:
+                    error = parsed_data['error']
+                    raise RuntimeError(error.get('message', error) if isinstance(error, dict) else error)
+                for choice in parsed_data.get('choices') or ():
+                    content = (choice.get('delta') or {}).get('content')
+                    if content:
+                        yield content
+                waited = time.perf_counter()
+        finally:
+            response.close()
+            response.timing.finish()
+            metrics.observe("sse_read", read_seconds)
+
+    def health_check(self):
+        response = get_transport().get(f"{self.base_url}/models", headers=self._headers(), timeout=HEALTH_TIMEOUT)
+        response.close()
+        return response.ok
+
+
+class BackendStats:
+    """
+    Running time-to-first-token and error rate of one backend.
+
+    Both are exponentially weighted, so the router follows a backend that
+    gets slower or starts failing within a handful of turns. After
+    ``trip_after`` consecutive failures the backend is left out of routing
+    for ``cooldown`` seconds, or until a health check succeeds.
+    """
+
+    def __init__(self, alpha=0.3, trip_after=3, cooldown=30.0):
+        self.alpha = alpha
+        self.trip_after = trip_after
+        self.cooldown = cooldown
+        self.ttft = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.down_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        return time.monotonic() >= self.down_until
+
+    def score(self):
+        """Expected wait for a first token, with failures counted as retries; lower is better"""
+        with self._lock:
+            if self.ttft is None:
+                # Untried is worth measuring; never answered is worth avoiding
+                return float("inf") if self.errors else 0.0
+            return self.ttft / max(1.0 - self.error_rate, 0.05)
+
+    def success(self, ttft):
+        with self._lock:
+            self.requests += 1
+            self.ttft = ttft if self.ttft is None else self.ttft + self.alpha * (ttft - self.ttft)
+            self.error_rate -= self.alpha * self.error_rate
+            self.consecutive_errors = 0
+            self.down_until = 0.0
+
+    def failure(self, request=True):
+        """Record a failed request; ``request=False`` for one already recorded as a success"""
+        with self._lock:
+            self.requests += request
+            self.errors += 1
+            self.error_rate += self.alpha * (1.0 - self.error_rate)
+            self.consecutive_errors += 1
+            if self.consecutive_errors >= self.trip_after:
+                self.down_until = time.monotonic() + self.cooldown
+
+    def healthy(self, ok):
+        """Record a health check: a pass closes the circuit, a failure opens it"""
+        with self._lock:
+            if ok:
+                self.consecutive_errors = 0
+                self.down_until = 0.0
+            else:
+                self.down_until = time.monotonic() + self.cooldown
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "ttft": self.ttft,
+                "error_rate": self.error_rate,
+                "requests": self.requests,
+                "errors": self.errors,
+                "available": time.monotonic() >= self.down_until,
+            }
+
+
+class BackendRouter:
+    """
+    Sends each turn to the backend expected to answer first.
+
+    Backends are ranked by BackendStats.score(), with the occasional turn
+    (``explore``) sent to the runner-up so its numbers stay current. A
+    backend that fails before its first token is recorded as an error and
+    the turn moves on to the next one; once text has been shown the turn
+    can't switch backends, so later errors end it as before.
+
+    Args:
+        backends (list): ChatBackend instances, in order of preference
+        explore (float): Fraction of turns that try the second-best backend first
+    """
+
+    def __init__(self, backends, explore=0.05):
+        if not backends:
+            raise ValueError("At least one chat backend is needed")
+        self.backends = list(backends)
+        self.stats = {backend.name: BackendStats() for backend in self.backends}
+        self.explore = explore
+        self._random = random.Random()
+        self._health_thread = None
+        self._stop = threading.Event()
+
+    def models(self):
+        """Every model some backend serves, defaults first, without duplicates"""
+        models = []
+        for backend in self.backends:
+            for model in backend.models:
+                if model not in models:
+                    models.append(model)
+        return models
+
+    def candidates(self, model=None):
+        """
+        Backends to try for ``model``, best first; those in cooldown come last
+
+        Returns:
+            list: ChatBackend instances
+        """
+        serving = [backend for backend in self.backends if backend.serves(model)]
+        available = [backend for backend in serving if self.stats[backend.name].available]
+        down = [backend for backend in serving if not self.stats[backend.name].available]
+        # sorted() is stable, so ties keep the configured order
+        available.sort(key=lambda backend: self.stats[backend.name].score())
+        if len(available) > 1 and self._random.random() < self.explore:
+            available[0], available[1] = available[1], available[0]
+        return available + down
+
+    def stream(self, messages, model=None, token=None, cancel_event=None, on_response=None, on_backend=None):
+        """
+        Stream a response from the best backend, failing over until one produces text
+
+        Args:
+            messages (list): Conversation to send, ending with the current prompt
+            model (str): Model to ask, or None for whichever backend is best
+            token (vqd.ConversationToken): The conversation's VQD token
+            cancel_event (threading.Event): Stop reading the stream once set
+            on_response (callable): Called with each HTTP response before streaming starts
+            on_backend (callable): Called with the name of the backend that answers and the model it used
+
+        Yields:
+            str: Text deltas as they arrive
+        """
+        candidates = self.candidates(model)
+        if not candidates:
+            raise ValueError(f"No chat backend serves {model}")
+        error = None
+        for backend in candidates:
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            stats = self.stats[backend.name]
+            started = time.perf_counter()
+            first = True
+            # Sent once the stream is over, so a request is counted under one outcome
+            outcome = ttft = None
+            try:
+                for delta in backend.stream(messages, model=model, token=token,
+                                            cancel_event=cancel_event, on_response=on_response):
+                    if first:
+                        first = False
+                        ttft = time.perf_counter() - started
+                        stats.success(ttft)
+                        outcome = "ok"
+                        if on_backend:
+                            on_backend(backend.name, model or backend.default_model)
+                    yield delta
+            except Exception as e:
+                if cancel_event is not None and cancel_event.is_set():
+                    return
+                outcome = "error"
+                if not first:
+                    # Already counted as answered; only the error is added
+                    stats.failure(request=False)
+                    raise
+                stats.failure()
+                print(f"Backend {backend.name} Error: {str(e)}")
+                error = e
+                continue
+            finally:
+                if outcome:
+                    metrics.backend_result(backend.name, outcome, ttft)
+            if first and not (cancel_event is not None and cancel_event.is_set()):
+                # Ended cleanly without a word; count it as answered, there's nothing to fail over from
+                stats.success(time.perf_counter() - started)
+                metrics.backend_result(backend.name, "empty")
+                if on_backend:
+                    on_backend(backend.name, model or backend.default_model)
+            return
+        raise error
+
+    def check_health(self):
+        """
+        Health-check every backend and update its stats
+
+        Returns:
+            dict: backend name -> whether it answered
+        """
+        results = {}
+        for backend in self.backends:
+            try:
+                ok = backend.health_check()
+            except Exception as e:
+                print(f"Health check {backend.name} Error: {str(e)}")
+                ok = False
+            self.stats[backend.name].healthy(ok)
+            results[backend.name] = ok
+        return results
+
+    def start_health_checks(self, interval=HEALTH_INTERVAL):
+        """Check every ``interval`` seconds on a daemon thread; a no-op if already running"""
+        if interval <= 0 or self._health_thread is not None:
+            return
+        self._health_thread = threading.Thread(target=self._health_loop, args=(interval,),
+                                               name="backend-health", daemon=True)
+        self._health_thread.start()
+
+    def stop_health_checks(self):
+        self._stop.set()
+
+    def _health_loop(self, interval):
+        while not self._stop.wait(interval):
+            self.check_health()
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: backend name -> BackendStats.as_dict()
+        """
+        return {name: stats.as_dict() for name, stats in self.stats.items()}
+
+
+def backends_from_env():
+    """Build the backends listed in CHATAPP_BACKENDS; "openai" is skipped unless CHATAPP_OPENAI_URL is set"""
+    backends = []
+    for name in BACKENDS:
+        if name == "ddg":
+            backends.append(DuckDuckGoBackend())
+        elif name == "openai":
+            if OPENAI_URL and OPENAI_MODELS:
+                backends.append(OpenAIBackend(OPENAI_URL, OPENAI_MODELS, api_key=OPENAI_API_KEY))
+        else:
+            print(f"Backend Error: unknown backend {name!r}")
+    return backends or [DuckDuckGoBackend()]
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    """Return the process-wide :class:`BackendRouter`, creating it on first use"""
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = BackendRouter(backends_from_env())
+                # With one backend there is nothing to route around
+                if len(_router.backends) > 1:
+                    _router.start_health_checks()
+    return _router
+
@@ -0,0 +1,96 @@
+import time
+
+import metrics
+
+
+class StreamRenderer:
+    """
+    Render a streamed markdown response incrementally.
+
+    Deltas are buffered and flushed either every ``flush_interval`` seconds or
+    once ``flush_chars`` characters are pending, whichever comes first. Blocks
+    that are finished (a paragraph followed by a blank line, or a closed code
+    fence) are frozen in their own element and never re-sent; only the
+    trailing open block is re-rendered on each flush.
+    """
+
+    def __init__(self, placeholder, flush_interval=0.05, flush_chars=256):
+        self.placeholder = placeholder
+        self.flush_interval = flush_interval
+        self.flush_chars = flush_chars
+
+        self.text = ""
+        self.render_count = 0
+
+        self._pending = ""
+        self._last_flush = time.monotonic()
+        self._frozen_upto = 0      # End offset of the last frozen block
+        self._scan_pos = 0         # Offset of the first line not yet scanned
+        self._in_fence = False
+        self._container = None
+        self._tail = None
+
+    def feed(self, delta):
+        """Queue a delta and flush if the policy says so"""
+        self._pending += delta
+        if (len(self._pending) >= self.flush_chars
+                or time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Render pending deltas: freeze finished blocks, redraw the open one"""
+        if not self._pending:
+            return
+        self.text += self._pending
+        self._pending = ""
+        self._last_flush = time.monotonic()
+
+        boundary = self._scan_blocks()
+        if boundary > self._frozen_upto:
+            # Everything up to the boundary is final, write it one last time
+            block = self.text[self._frozen_upto:boundary]
+            if block.strip():
+                self._draw_tail(block)
+            self._frozen_upto = boundary
+            self._tail = None
+
+        tail = self.text[self._frozen_upto:]
+        if tail.strip():
+            self._draw_tail(tail)
+
+    def close(self):
+        """Flush whatever is still buffered and return the full text"""
+        self.flush()
+        return self.text
+
+    def _draw_tail(self, markdown_text):
+        if self._container is None:
+            # Replaces whatever the placeholder showed (e.g. a typing indicator)
+            self._container = self.placeholder.container()
+        if self._tail is None:
+            self._tail = self._container.empty()
+        with metrics.span("render"):
+            self._tail.markdown(markdown_text)
+        self.render_count += 1
+
+    def _scan_blocks(self):
+        """
+        Scan the newly completed lines and return the offset after the last
+        closed block. Only lines added since the previous call are visited.
+        """
+        boundary = self._frozen_upto
+        text = self.text
+        while True:
+            end = text.find("\n", self._scan_pos)
+            if end == -1:
+                break
+            line = text[self._scan_pos:end].strip()
+            self._scan_pos = end + 1
+
+            if line.startswith("```"):
+                self._in_fence = not self._in_fence
+                if not self._in_fence:
+                    boundary = self._scan_pos
+            elif not self._in_fence and not line:
+                boundary = self._scan_pos
+        return boundary
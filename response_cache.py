@@ -0,0 +1,243 @@
+import collections
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+from code_blocks import FENCE, LANGUAGE_ALIASES
+
+# Unset keeps cached answers in memory only; set it to also keep them on disk across restarts
+CACHE_DIR = os.environ.get("RESPONSE_CACHE_DIR")
+CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", 24 * 60 * 60))
+CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 256))
+
+_C_FAMILY = ("javascript", "typescript", "java", "csharp")
+
+_TOKEN = re.compile(r'''
+    (?P<string>"""[\s\S]*?"""|\'\'\'[\s\S]*?\'\'\'|"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*'|`(?:\\.|[^`\\])*`)
+  | (?P<block>/\*[\s\S]*?\*/)
+  | (?P<line>//|\#)
+  | (?P<space>[ \t]+)
+  | (?P<other>[^"'`/\#\s]+|[\s\S])
+''', re.VERBOSE)
+_TO_EOL = re.compile(r"[^\n]*")
+
+
+def unfence(code):
+    """
+    Split an input that is one fenced block (```python ... ```) into its
+    language and body
+
+    Returns:
+        tuple: (language named by the info string or None, the code inside
+            the fence); (None, code) for an input that isn't fenced
+    """
+    stripped = code.strip()
+    if stripped.startswith(FENCE) and stripped.endswith(FENCE) and "\n" in stripped:
+        info, body = stripped[len(FENCE):-len(FENCE)].split("\n", 1)
+        if FENCE not in body:
+            return LANGUAGE_ALIASES.get(info.strip().lower()), body
+    return None, code
+
+
+def normalize_code(code, language=None):
+    """
+    Normalize code so trivially different submissions share a cache entry
+
+    Runs of spaces are collapsed, trailing whitespace, blank lines and
+    common indentation are dropped. String literals, whitespace inside them
+    included, and the relative indentation are kept. Comments are only removed when the language is
+    known, from ``language`` or the info string of a fenced input: ``#`` in
+    Python, ``//`` and ``/* */`` in C-like languages. A language guessed
+    from the code itself is never trusted for this, since ``//`` and ``#``
+    are operators elsewhere (Python's ``x // 2``, for one).
+
+    Args:
+        code (str): The submitted code
+        language (str): Language name as resolved by code_blocks, if known
+
+    Returns:
+        str: The normalized code
+    """
+    fenced_language, code = unfence(code)
+    language = language or fenced_language
+    code = code.expandtabs(4) + "\n"
+    # Lines are split at newlines outside string literals only, so the
+    # whitespace and blank lines inside a literal reach the key unchanged
+    lines = []
+    line = []
+    pos = 0
+    while pos < len(code):
+        match = _TOKEN.match(code, pos)
+        kind, token = match.lastgroup, match.group()
+        pos = match.end()
+        at_line_start = not code[code.rfind("\n", 0, match.start()) + 1:match.start()].strip()
+        if kind == "block" and language in _C_FAMILY:
+            continue
+        if kind == "line" and ((token == "#" and language == "python") or (token == "//" and language in _C_FAMILY)):
+            pos = _TO_EOL.match(code, pos).end()
+            continue
+        if token == "\n":
+            text = "".join(line).rstrip()
+            if text:
+                lines.append(text)
+            line = []
+            continue
+        if kind == "space" and not at_line_start:
+            token = " "
+        line.append(token)
+    indent = min((len(text) - len(text.lstrip(" ")) for text in lines), default=0)
+    return "\n".join(text[indent:] for text in lines)
+
+
+class ResponseCache:
+    """
+    Cache of complete AI answers for the code modes.
+
+    Entries live in an in-memory LRU of ``max_entries`` answers and, when a
+    ``directory`` is given, in one JSON file per entry so they survive a
+    restart. Entries older than ``ttl`` seconds are treated as missing in
+    both tiers. Disk entries are written to a temporary file and renamed
+    into place.
+    """
+
+    def __init__(self, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, directory=CACHE_DIR):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = collections.OrderedDict()  # key -> (text, created_at, backend, model), oldest first
+        self._lock = threading.Lock()
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(mode, model, code, language=None):
+        """Hash the mode, model and normalized code into a cache key (see normalize_code for ``language``)"""
+        digest = hashlib.sha256()
+        for part in (mode, model, normalize_code(code, language)):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Look up a cached answer
+
+        Returns:
+            str: The answer, or None on a miss or once it has expired
+        """
+        entry = self.lookup(key)
+        return entry["text"] if entry is not None else None
+
+    def lookup(self, key):
+        """
+        Look up a cached answer along with who gave it
+
+        Returns:
+            dict: {"text", "backend", "model"} (backend and model are None for
+                answers cached without them), or None on a miss or once it has expired
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[1], now):
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None and self.directory:
+            entry = self._read(key, now)
+            if entry is not None:
+                self._remember(key, entry)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return {"text": entry[0], "backend": entry[2], "model": entry[3]}
+
+    def put(self, key, text, backend=None, model=None):
+        """Store an answer, and the backend and model that gave it, in every tier"""
+        entry = (text, time.time(), backend, model)
+        self._remember(key, entry)
+        if self.directory:
+            self._write(key, entry)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.directory:
+            self._remove(self._path(key))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "disk": bool(self.directory),
+            }
+
+    def _expired(self, created_at, now):
+        return now - created_at > self.ttl
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _read(self, key, now):
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self._expired(data["created_at"], now):
+            self._remove(path)
+            return None
+        return data["text"], data["created_at"], data.get("backend"), data.get("model")
+
+    def _write(self, key, entry):
+        partial_path = os.path.join(self.directory, f"{key}.{uuid.uuid4().hex}.part")
+        try:
+            with open(partial_path, "w", encoding="utf-8") as f:
+                json.dump({"text": entry[0], "created_at": entry[1], "backend": entry[2], "model": entry[3]}, f)
+            os.replace(partial_path, self._path(key))
+        except OSError as e:
+            print(f"Response cache write error: {str(e)}")
+            self._remove(partial_path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Return the process-wide :class:`ResponseCache`, creating it on first use"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
@@ -0,0 +1,256 @@
+import asyncio
+import contextlib
+import itertools
+import os
+import threading
+import time
+
+import metrics
+
+# Upstream calls the whole process may have in flight, and one session may,
+# by default (the chat limit is the "Parallel requests" setting per session).
+# Requests over either limit wait in a queue shared fairly between sessions.
+CHAT_MAX_CONCURRENCY = int(os.environ.get("CHATAPP_CHAT_MAX_CONCURRENCY", 8))
+CHAT_SESSION_CONCURRENCY = int(os.environ.get("CHATAPP_CHAT_SESSION_CONCURRENCY", 3))
+TTS_MAX_CONCURRENCY = int(os.environ.get("TTS_MAX_CONCURRENCY", 4))
+TTS_SESSION_CONCURRENCY = int(os.environ.get("TTS_SESSION_CONCURRENCY", TTS_MAX_CONCURRENCY))
+
+
+class Ticket:
+    """
+    One request's place in a FairScheduler: queued until granted, then
+    holding a slot until released. release() is safe to call more than
+    once, and before the ticket was granted (it just leaves the queue).
+    """
+
+    def __init__(self, scheduler, session, weight, limit):
+        self.scheduler = scheduler
+        self.session = session
+        self.weight = weight
+        self.limit = limit
+        self.start = 0.0        # Virtual start time, set when queued
+        self.seq = 0
+        self.queued_at = time.monotonic()
+        self.granted = False
+        self.released = False
+        self._event = threading.Event()
+        self._future = None     # asyncio future of an async waiter, with its loop
+        self._loop = None
+
+    @property
+    def waiting(self):
+        return not self.granted and not self.released
+
+    def position(self):
+        """1 for the next request to be admitted, 0 once admitted"""
+        return self.scheduler.position(self)
+
+    def wait(self, cancel_event=None, timeout=None):
+        """
+        Block until the ticket is granted
+
+        Args:
+            cancel_event (threading.Event): Give up (and leave the queue) once set
+            timeout (float): Give up after this many seconds
+
+        Returns:
+            bool: Whether a slot was granted
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._event.wait(0.1):
+            if ((cancel_event is not None and cancel_event.is_set())
+                    or (deadline is not None and time.monotonic() >= deadline)):
+                self.release()
+                return False
+        return True
+
+    def release(self):
+        self.scheduler.release(self)
+
+    def _grant(self):
+        self.granted = True
+        self._event.set()
+        if self._future is not None:
+            self._loop.call_soon_threadsafe(_set_result, self._future)
+
+
+def _set_result(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class FairScheduler:
+    """
+    Admission control for one kind of upstream call.
+
+    At most ``capacity`` requests run at once and at most a ticket's
+    ``limit`` (``session_limit`` by default) per session. Waiting requests
+    are admitted by start-time fair queueing: each session's requests are
+    stamped with a virtual start time that advances by 1/weight per
+    request, and the lowest stamp goes first. A session that sends a burst
+    therefore takes turns with the others instead of going ahead of them,
+    and one with twice the weight gets twice the turns.
+
+    Works from threads (submit() and Ticket.wait()) and from asyncio code
+    (acquire_async() and slot()).
+
+    Args:
+        name (str): Queue name in the metrics
+        capacity (int): Requests in flight across all sessions
+        session_limit (int): Requests in flight per session, unless a ticket says otherwise
+    """
+
+    def __init__(self, name, capacity, session_limit):
+        self.name = name
+        self.capacity = capacity
+        self.session_limit = session_limit
+        self.in_flight = 0
+        self._waiting = []
+        self._active = {}       # session -> requests in flight
+        self._finish = {}       # session -> virtual finish time of its last request
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def submit(self, session=None, weight=1.0, limit=None):
+        """
+        Queue a request; it may be granted right away
+
+        Args:
+            session (str): Who the request is for
+            weight (float): Share of the turns relative to other sessions
+            limit (int): Requests in flight for this session, instead of ``session_limit``
+
+        Returns:
+            Ticket: Wait on it, and release it once the request is over
+        """
+        ticket = Ticket(self, session, weight, limit or self.session_limit)
+        self._enqueue(ticket)
+        return ticket
+
+    async def acquire_async(self, session=None, weight=1.0, limit=None):
+        """Queue a request and wait for its slot on the running event loop; see submit()"""
+        ticket = Ticket(self, session, weight, limit or self.session_limit)
+        ticket._loop = asyncio.get_running_loop()
+        ticket._future = ticket._loop.create_future()
+        self._enqueue(ticket)
+        try:
+            await ticket._future
+        except asyncio.CancelledError:
+            ticket.release()
+            raise
+        return ticket
+
+    @contextlib.asynccontextmanager
+    async def slot(self, session=None, weight=1.0, limit=None):
+        """Hold a slot for the duration of an ``async with`` block"""
+        ticket = await self.acquire_async(session, weight, limit)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def release(self, ticket):
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket.granted:
+                self.in_flight -= 1
+                self._active[ticket.session] -= 1
+                if not self._active[ticket.session]:
+                    del self._active[ticket.session]
+            else:
+                self._waiting.remove(ticket)
+            # An idle session keeps no credit, only what it still owes
+            if (ticket.session not in self._active
+                    and self._finish.get(ticket.session, 0.0) <= self._virtual_time
+                    and not any(waiting.session == ticket.session for waiting in self._waiting)):
+                self._finish.pop(ticket.session, None)
+            self._dispatch()
+
+    def position(self, ticket):
+        """
+        Returns:
+            int: How many waiting requests go before ``ticket``, plus one; 0 if it isn't waiting
+        """
+        with self._lock:
+            if not ticket.waiting:
+                return 0
+            order = (ticket.start, ticket.seq)
+            return 1 + sum(1 for waiting in self._waiting if (waiting.start, waiting.seq) < order)
+
+    def depth(self):
+        """
+        Returns:
+            tuple: (requests waiting, requests in flight)
+        """
+        with self._lock:
+            return len(self._waiting), self.in_flight
+
+    def _enqueue(self, ticket):
+        with self._lock:
+            ticket.start = max(self._virtual_time, self._finish.get(ticket.session, 0.0))
+            ticket.seq = next(self._seq)
+            self._finish[ticket.session] = ticket.start + 1.0 / ticket.weight
+            self._waiting.append(ticket)
+            self._dispatch()
+
+    def _dispatch(self):
+        """Grant waiting tickets while there is room; called with the lock held"""
+        while self.in_flight < self.capacity and self._waiting:
+            eligible = [ticket for ticket in self._waiting
+                        if self._active.get(ticket.session, 0) < ticket.limit]
+            if not eligible:
+                break
+            ticket = min(eligible, key=lambda ticket: (ticket.start, ticket.seq))
+            self._waiting.remove(ticket)
+            self.in_flight += 1
+            self._active[ticket.session] = self._active.get(ticket.session, 0) + 1
+            self._virtual_time = max(self._virtual_time, ticket.start)
+            metrics.queue_wait(self.name, time.monotonic() - ticket.queued_at)
+            ticket._grant()
+        metrics.queue_depth(self.name, len(self._waiting), self.in_flight)
+
+
+def admitted(ticket, cancel_event, start):
+    """
+    Wait for ``ticket``, then yield from ``start()``; the slot is held until the stream ends
+
+    Args:
+        ticket (Ticket): The request's place in the queue
+        cancel_event (threading.Event): Stop waiting once set
+        start (callable): Returns the stream to run once admitted
+
+    Yields:
+        The items of the stream
+    """
+    try:
+        if ticket.wait(cancel_event):
+            yield from start()
+    finally:
+        ticket.release()
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def _get_scheduler(name, capacity, session_limit):
+    scheduler = _schedulers.get(name)
+    if scheduler is None:
+        with _schedulers_lock:
+            scheduler = _schedulers.get(name)
+            if scheduler is None:
+                scheduler = _schedulers[name] = FairScheduler(name, capacity, session_limit)
+    return scheduler
+
+
+def get_chat_scheduler():
+    """Return the process-wide :class:`FairScheduler` for chat streams"""
+    return _get_scheduler("chat", CHAT_MAX_CONCURRENCY, CHAT_SESSION_CONCURRENCY)
+
+
+def get_tts_scheduler():
+    """Return the process-wide :class:`FairScheduler` for speech synthesis"""
+    return _get_scheduler("tts", TTS_MAX_CONCURRENCY, TTS_SESSION_CONCURRENCY)
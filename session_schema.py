@@ -0,0 +1,73 @@
+import uuid
+
+from context import ConversationWindow
+from snippet_store import SnippetStore
+from vqd import ConversationToken, get_token_manager
+
+
+def _conversation_token():
+    # Warm the token pool so the first message doesn't wait on the status endpoint
+    get_token_manager().prefetch()
+    return ConversationToken()
+
+
+def _default_voice():
+    from tts import DEFAULT_VOICE
+    return DEFAULT_VOICE
+
+
+# Every per-session value main.py keeps, with what it starts as. A callable
+# is called to build the value (so mutable defaults aren't shared between
+# sessions); anything else is used as is.
+SESSION_SCHEMA = {
+    "messages": list,
+    "snippets": lambda: SnippetStore(max_snippets=200),
+    "snippets_visible": 20,
+    "vqd_token": _conversation_token,
+    "is_typing": False,
+    # The assistant turn streaming in the background, as mode -> job (see jobs.py)
+    "active_jobs": dict,
+    # Identifies this browser session to the upstream schedulers, which share capacity fairly between sessions
+    "session_id": lambda: uuid.uuid4().hex,
+    # Requests this session may have in flight at once
+    "request_limit": 3,
+    "current_mode": "chat",
+    "voice_enabled": True,
+    "voice": _default_voice,
+    # Model to ask; None lets the router pick the fastest healthy backend
+    "model": None,
+    "show_fullscreen_editor": False,
+    "fullscreen_code": "",
+    "fullscreen_language": "python",
+    # Streaming render policy: flush every N milliseconds or N buffered characters
+    "render_flush_ms": 50,
+    "render_flush_chars": 256,
+    # History view: show the last N turns per page
+    "history_page_size": 10,
+    "history_pages": 1,
+    # Debug: keep a sampling profile of each request
+    "profile_requests": False,
+    # History sent with each request, trimmed to a token budget
+    "context_window": lambda: ConversationWindow(budget=3000),
+    # The page stylesheet and scripts were sent to this session's browser (see assets.py)
+    "css_injected": False,
+}
+
+# Set once every key of the schema exists, so reruns skip the checks
+_READY = "_session_schema_ready"
+
+
+def init_session_state(state, schema=SESSION_SCHEMA):
+    """
+    Give ``state`` (st.session_state) every key of ``schema`` it doesn't have yet
+
+    Returns:
+        bool: Whether this was the session's first run
+    """
+    if state.get(_READY):
+        return False
+    for key, default in schema.items():
+        if key not in state:
+            state[key] = default() if callable(default) else default
+    state[_READY] = True
+    return True
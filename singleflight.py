@@ -0,0 +1,273 @@
+import threading
+
+import metrics
+
+
+class SharedStream:
+    """
+    One upstream response stream read by any number of subscribers.
+
+    Deltas are kept in a replay buffer, so a subscriber that joins late
+    first gets everything produced so far and then the live deltas. There
+    is no reader thread of its own: whichever subscriber runs out of
+    buffered deltas first pulls the next one from upstream while the others
+    wait, so the stream keeps going as long as anyone is reading it.
+
+    Args:
+        key (str): What the stream answers, e.g. a response cache key
+        start (callable): ``start(stream)`` returning the upstream iterator,
+            called by the first reader. It should stop once ``stream.cancel_event``
+            is set and report progress through ``stream.attach(response)`` and
+            ``stream.set_backend(name, model)``.
+    """
+
+    def __init__(self, key, start):
+        self.key = key
+        self.deltas = []
+        self.done = False
+        self.error = None
+        self.response = None
+        self.backend = None
+        self.model = None
+        self.ticket = None       # Admission ticket while the upstream request queues (see scheduler.py)
+        self.subscribers = []
+        self.cancel_event = threading.Event()
+        self._start = start
+        self._upstream = None
+        self._pulling = False
+        self._changed = threading.Condition()
+
+    def queue_position(self):
+        """Place of the upstream request in the admission queue, 0 once it runs"""
+        ticket = self.ticket
+        return ticket.position() if ticket is not None else 0
+
+    def read(self, index, subscription):
+        """
+        Return the delta at ``index``, waiting for it or pulling it from upstream
+
+        Returns:
+            str: The delta, or None once the stream ended or ``subscription`` was closed
+        """
+        while True:
+            with self._changed:
+                while True:
+                    if subscription.closed:
+                        return None
+                    if index < len(self.deltas):
+                        return self.deltas[index]
+                    if self.done:
+                        if self.error is not None:
+                            raise self.error
+                        return None
+                    if not self._pulling:
+                        break
+                    self._changed.wait()
+                self._pulling = True
+            self._pull()
+
+    def _pull(self):
+        delta = error = None
+        finished = False
+        try:
+            if self._upstream is None:
+                self._upstream = iter(self._start(self))
+            delta = next(self._upstream)
+        except StopIteration:
+            finished = True
+        except Exception as e:
+            finished, error = True, e
+        with self._changed:
+            self._pulling = False
+            if finished:
+                self._finish(error)
+            elif self.cancel_event.is_set():
+                # Everyone left while this delta was on its way
+                self._close_upstream()
+                self._finish(None)
+            else:
+                self.deltas.append(delta)
+            self._changed.notify_all()
+
+    def cancel(self):
+        """Stop the upstream stream; called once the last subscriber has left"""
+        self.cancel_event.set()
+        response = self.response
+        if response is not None:
+            response.close()
+        with self._changed:
+            # A reader in the middle of a pull closes the stream when it gets back
+            if not self._pulling and not self.done:
+                self._close_upstream()
+                self._finish(None)
+            self._changed.notify_all()
+
+    def _close_upstream(self):
+        close = getattr(self._upstream, "close", None)
+        if close is not None:
+            close()
+
+    def _finish(self, error):
+        self.done = True
+        self.error = error
+        self._upstream = None
+
+    def attach(self, response):
+        self.response = response
+        for subscription in list(self.subscribers):
+            subscription._response(response)
+        if self.cancel_event.is_set():
+            response.close()
+
+    def set_backend(self, name, model):
+        self.backend = name
+        self.model = model
+        for subscription in list(self.subscribers):
+            subscription._backend(name, model)
+
+
+class Subscription:
+    """
+    One reader of a SharedStream; iterate over it for the deltas. close()
+    (from any thread) stops the iteration, and the upstream stream with it
+    if nobody else is reading.
+    """
+
+    def __init__(self, flights, stream, on_response=None, on_backend=None):
+        self.flights = flights
+        self.stream = stream
+        self.closed = False
+        self.on_response = on_response
+        self.on_backend = on_backend
+        self._index = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        delta = self.stream.read(self._index, self)
+        if delta is None:
+            self.close()
+            raise StopIteration
+        self._index += 1
+        return delta
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.flights._leave(self)
+        with self.stream._changed:
+            self.stream._changed.notify_all()
+
+    def _response(self, response):
+        if self.on_response:
+            self.on_response(response)
+
+    def _backend(self, name, model):
+        if self.on_backend:
+            self.on_backend(name, model)
+
+
+class SingleFlight:
+    """
+    Process-wide coalescing of identical work in flight.
+
+    stream() hands every caller asking for the same key a Subscription to
+    one SharedStream; the stream and its replay buffer are dropped when the
+    last subscriber finishes or leaves. call() does the same for work that
+    produces a single result, sharing one future until it resolves.
+    """
+
+    def __init__(self):
+        self._streams = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def stream(self, key, start, on_response=None, on_backend=None):
+        """
+        Subscribe to the stream for ``key``, starting it if none is running
+
+        Args:
+            key (str): Identifies the response
+            start (callable): See SharedStream
+            on_response (callable): Called with the upstream HTTP response
+            on_backend (callable): Called with the name of the backend that answers and the model it used
+
+        Returns:
+            Subscription: Iterate over it for the deltas
+        """
+        with self._lock:
+            stream = self._streams.get(key)
+            # A failed or cancelled stream isn't joined; the caller gets a fresh attempt
+            if stream is None or (stream.done and (stream.error is not None or stream.cancel_event.is_set())):
+                stream = self._streams[key] = SharedStream(key, start)
+            elif stream.subscribers:
+                metrics.count("singleflight_join")
+            subscription = Subscription(self, stream, on_response, on_backend)
+            stream.subscribers.append(subscription)
+        if stream.response is not None:
+            subscription._response(stream.response)
+        if stream.backend is not None:
+            subscription._backend(stream.backend, stream.model)
+        return subscription
+
+    def call(self, key, submit):
+        """
+        Share one future between callers asking for ``key`` until it resolves
+
+        Args:
+            key (str): Identifies the result
+            submit (callable): Starts the work and returns a concurrent.futures.Future
+
+        Returns:
+            concurrent.futures.Future: The shared future
+        """
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None:
+                metrics.count("singleflight_call_join")
+                return future
+            future = self._futures[key] = submit()
+        future.add_done_callback(lambda done: self._forget(key, done))
+        return future
+
+    def in_flight(self):
+        """
+        Returns:
+            tuple: (streams, subscribers, futures) currently shared
+        """
+        with self._lock:
+            return (len(self._streams), sum(len(stream.subscribers) for stream in self._streams.values()),
+                    len(self._futures))
+
+    def _leave(self, subscription):
+        stream = subscription.stream
+        with self._lock:
+            if subscription in stream.subscribers:
+                stream.subscribers.remove(subscription)
+            if stream.subscribers:
+                return
+            if self._streams.get(stream.key) is stream:
+                del self._streams[stream.key]
+        if not stream.done:
+            stream.cancel()
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._futures.get(key) is future:
+                del self._futures[key]
+
+
+_singleflight = None
+_singleflight_lock = threading.Lock()
+
+
+def get_singleflight():
+    """Return the process-wide :class:`SingleFlight`, creating it on first use"""
+    global _singleflight
+    if _singleflight is None:
+        with _singleflight_lock:
+            if _singleflight is None:
+                _singleflight = SingleFlight()
+    return _singleflight
@@ -0,0 +1,153 @@
+import collections
+import hashlib
+import itertools
+
+from code_blocks import EXTENSIONS, guess_file_stem
+
+
+class Snippet:
+    """A saved code snippet. ``id`` never changes, even after edits or deletes."""
+
+    __slots__ = ("id", "code", "language", "filename", "message_id", "content_hash")
+
+    def __init__(self, snippet_id, code, language, filename, message_id, content_hash):
+        self.id = snippet_id
+        self.code = code
+        self.language = language
+        self.filename = filename
+        self.message_id = message_id
+        self.content_hash = content_hash
+
+
+def content_hash(code):
+    """Hash used to recognise the same snippet; ignores surrounding whitespace"""
+    return hashlib.sha1(code.strip().encode("utf-8")).hexdigest()
+
+
+class SnippetStore:
+    """
+    Ordered store of code snippets with stable IDs.
+
+    Snippets are deduplicated by content hash and indexed by language,
+    filename and the message they came from. File names are derived from the
+    function or class in the code, falling back to the snippet ID, and made
+    unique within the store. With ``max_snippets`` set, the oldest snippets
+    are evicted once the store is full.
+    """
+
+    def __init__(self, max_snippets=None):
+        self.max_snippets = max_snippets
+        self._snippets = collections.OrderedDict()  # id -> Snippet, oldest first
+        self._by_hash = {}
+        self._by_filename = {}
+        self._by_language = collections.defaultdict(dict)  # language -> {id: None}, ordered
+        self._by_message = collections.defaultdict(dict)
+        self._next_id = 1
+
+    def __len__(self):
+        return len(self._snippets)
+
+    def __iter__(self):
+        return iter(self._snippets.values())
+
+    def __contains__(self, snippet_id):
+        return snippet_id in self._snippets
+
+    def add(self, code, language, message_id=None, snippet_id=None, filename=None):
+        """
+        Save a snippet, or return the existing one if the same code is stored
+
+        Args:
+            code (str): The snippet source
+            language (str): Language name as resolved by code_blocks
+            message_id (str): ID of the chat message it came from
+            snippet_id (int): Reuse this ID, when restoring a saved snippet
+            filename (str): Reuse this file name, when restoring a saved snippet
+
+        Returns:
+            Snippet: The stored snippet
+        """
+        digest = content_hash(code)
+        existing = self._by_hash.get(digest)
+        if existing is not None:
+            return self._snippets[existing]
+
+        if snippet_id is None:
+            snippet_id = self._next_id
+        self._next_id = max(self._next_id, snippet_id + 1)
+        snippet = Snippet(snippet_id, code, language, filename or self._unique_filename(code, language, snippet_id),
+                          message_id, digest)
+        self._snippets[snippet_id] = snippet
+        self._index(snippet)
+
+        if self.max_snippets is not None:
+            while len(self._snippets) > self.max_snippets:
+                self.delete(next(iter(self._snippets)))
+        return snippet
+
+    def update(self, snippet_id, code):
+        """Replace the code of a snippet, keeping its ID and file name"""
+        snippet = self._snippets[snippet_id]
+        self._unindex(snippet)
+        snippet.code = code
+        snippet.content_hash = content_hash(code)
+        self._index(snippet)
+        return snippet
+
+    def delete(self, snippet_id):
+        snippet = self._snippets.pop(snippet_id, None)
+        if snippet is not None:
+            self._unindex(snippet)
+        return snippet
+
+    def clear(self):
+        """Remove every snippet; IDs keep counting up so they are never reused"""
+        self._snippets.clear()
+        self._by_hash.clear()
+        self._by_filename.clear()
+        self._by_language.clear()
+        self._by_message.clear()
+
+    def get(self, snippet_id):
+        return self._snippets.get(snippet_id)
+
+    def by_filename(self, filename):
+        snippet_id = self._by_filename.get(filename)
+        return self._snippets[snippet_id] if snippet_id is not None else None
+
+    def by_language(self, language):
+        return [self._snippets[snippet_id] for snippet_id in self._by_language.get(language, ())]
+
+    def by_message(self, message_id):
+        return [self._snippets[snippet_id] for snippet_id in self._by_message.get(message_id, ())]
+
+    def page(self, offset=0, limit=None):
+        """Return snippets in insertion order, visiting only the requested page"""
+        stop = None if limit is None else offset + limit
+        return list(itertools.islice(self._snippets.values(), offset, stop))
+
+    def _unique_filename(self, code, language, snippet_id):
+        ext = EXTENSIONS.get(language, "txt")
+        stem = guess_file_stem(code, language) or f"snippet_{snippet_id}"
+        filename = f"{stem}.{ext}"
+        suffix = 2
+        while filename in self._by_filename:
+            filename = f"{stem}_{suffix}.{ext}"
+            suffix += 1
+        return filename
+
+    def _index(self, snippet):
+        # A hash may already point at another snippet after an edit; keep the first one
+        self._by_hash.setdefault(snippet.content_hash, snippet.id)
+        self._by_filename[snippet.filename] = snippet.id
+        self._by_language[snippet.language][snippet.id] = None
+        self._by_message[snippet.message_id][snippet.id] = None
+
+    def _unindex(self, snippet):
+        if self._by_hash.get(snippet.content_hash) == snippet.id:
+            del self._by_hash[snippet.content_hash]
+        self._by_filename.pop(snippet.filename, None)
+        for index, key in ((self._by_language, snippet.language), (self._by_message, snippet.message_id)):
+            index[key].pop(snippet.id, None)
+            if not index[key]:
+                del index[key]
@@ -0,0 +1,303 @@
+import re
+
+# Symbols and abbreviations spelled out for better speech. Symbols are
+# replaced first, then abbreviations, each in the order listed.
+SPEECH_SYMBOLS = {
+    "&": " and ",
+    "@": " at ",
+    "%": " percent ",
+}
+SPEECH_ABBREVIATIONS = {
+    "e.g.": "for example",
+    "i.e.": "that is",
+    "etc.": "etcetera",
+    "vs.": "versus",
+}
+SPEECH_REPLACEMENTS = {**SPEECH_SYMBOLS, **SPEECH_ABBREVIATIONS}
+
+# The markup rules, one pattern each, in the order they apply. Later rules see
+# the output of earlier ones: "<*>" survives because emphasis is removed before
+# tags, and a URL is cut at the first whitespace left after links are replaced.
+_FENCE = re.compile(r"```.*?```", re.DOTALL)
+_INLINE_CODE = re.compile(r"`[^`]+`")
+_LINK = re.compile(r"\[([^\]]+)\]\([^)]+\)")
+_URL = re.compile(r"https?://\S+")
+_EMPHASIS = str.maketrans("", "", "*_~")
+_TAG = re.compile(r"<[^>]+>")
+_HEADER = re.compile(r"^#+\s", re.MULTILINE)
+_WHITESPACE = re.compile(r"\s+")
+
+# The same rules as one tokenizer, so SpeechStream can tell which constructs are
+# still open. At any offset at most one of them can start, so the leftmost match
+# is the one the rules above would act on, unless their matches overlap;
+# _strip_markup checks for that and gives up.
+_MARKUP = re.compile(r"""
+    (?P<fence>```.*?```)
+  | (?P<code>`[^`]+`)
+  | (?P<link>\[(?P<link_text>[^\]]+)\]\([^)]+\))
+  | (?P<url>https?://\S+)
+  | (?P<tag><[*_~]*[^>*_~][^>]*>)   # Still a tag once emphasis is removed
+  | (?P<hashes>\#+)
+  | (?P<emphasis>[*_~]+)
+  | (?P<opener>[`\[<])              # Starts nothing yet, but might once more text arrives
+""", re.DOTALL | re.VERBOSE)
+
+# Inside these, an earlier rule would have changed the text first
+_UNSAFE_LINK_TEXT = re.compile(r"[`<>#]")
+_UNSAFE_TAG = re.compile(r"[`\[\]]|https?://")
+# After a header's "#", characters that an earlier rule may remove or replace
+_UNSAFE_AFTER_HEADER = frozenset("`[<*_~")
+
+# Tokens that can contain whitespace, and so a place to cut a stream
+_SPANS_WHITESPACE = frozenset(("fence", "code", "link", "tag"))
+_LAST_SPACE = re.compile(r".*\s", re.DOTALL)
+
+
+def _strip_markup_staged(text):
+    """Apply the markup rules one after another, skipping those that can't match"""
+    if "`" in text:
+        if "```" in text:
+            text = _FENCE.sub(" ", text)
+        text = _INLINE_CODE.sub(" ", text)
+    if "](" in text:
+        text = _LINK.sub(r"\1", text)
+    if "://" in text:
+        text = _URL.sub(" ", text)
+    text = text.translate(_EMPHASIS)
+    if "<" in text:
+        text = _TAG.sub("", text)
+    if "#" in text:
+        text = _HEADER.sub("", text)
+    return text
+
+
+def _line_start_after(piece, line_start):
+    """Whether the output is at the start of a line after appending ``piece``"""
+    if not piece:
+        return line_start
+    newline = piece.rfind("\n")
+    return newline != -1 and newline == len(piece) - 1
+
+
+def _link_after_code(text, offset):
+    """
+    Whether removing inline code could turn the "[" before ``offset`` into a
+    link: it has to be inside the text or the target of the would-be link
+    """
+    bracket = text.find("]", offset)
+    if bracket == -1:
+        return False
+    if "`" in text[offset:bracket]:
+        return True
+    if not text.startswith("(", bracket + 1):
+        return False
+    close = text.find(")", bracket + 2)
+    return "`" in text[bracket + 2:close if close != -1 else len(text)]
+
+
+def _strip_markup(text, line_start=True):
+    """
+    Apply the markup rules in a single pass over ``text``
+
+    Args:
+        text (str): Markdown
+        line_start (bool): Whether ``text`` starts at the start of a line
+
+    Returns:
+        tuple: (stripped text, line_start after it, hold, floor). The text is
+            None if the rules overlap in a way one pass can't reproduce.
+            ``hold`` is the offset of the first construct that more text could
+            still complete (or of the overlap), ``floor`` the end of the last
+            construct that contains whitespace.
+    """
+    pieces = []
+    hold = len(text)
+    floor = 0
+    pos = 0
+    for match in _MARKUP.finditer(text):
+        start, end = match.span()
+        if start > pos:
+            plain = text[pos:start]
+            pieces.append(plain)
+            line_start = _line_start_after(plain, line_start)
+        pos = end
+        kind = match.lastgroup
+        if start < hold and kind in _SPANS_WHITESPACE:
+            floor = end
+
+        if kind == "emphasis":
+            continue
+        if kind == "hashes":
+            piece = match.group()
+            if line_start:
+                following = text[end:end + 1]
+                if not following:
+                    hold = min(hold, start)
+                elif following.isspace():
+                    # A header; removing it doesn't make the next line start here
+                    line_start = following == "\n"
+                    pos = end + 1
+                    continue
+                elif following in _UNSAFE_AFTER_HEADER or text.startswith(("http://", "https://"), end):
+                    return None, line_start, min(hold, start), floor
+        elif kind == "url":
+            piece = match.group()
+            if "`" in piece or "[" in piece:
+                return None, line_start, min(hold, start), floor
+            piece = " "
+        elif kind == "opener":
+            piece = match.group()
+            hold = min(hold, start)
+            if piece == "[" and _link_after_code(text, end):
+                return None, line_start, min(hold, start), floor
+        elif kind == "link":
+            link_text = match.group("link_text")
+            # Also a URL that the replaced link text would start, end or be part of
+            around = text[max(start - 7, 0):start] + link_text + text[end:end + 8]
+            if "`" in match.group() or _UNSAFE_LINK_TEXT.search(link_text) or _URL.search(around):
+                return None, line_start, min(hold, start), floor
+            piece = link_text.translate(_EMPHASIS)
+        elif kind == "tag":
+            if _UNSAFE_TAG.search(match.group()):
+                return None, line_start, min(hold, start), floor
+            continue
+        else:
+            # Code; an inline span that ends where a fence starts pairs up differently
+            if kind == "code" and text.startswith("`", end):
+                return None, line_start, min(hold, start), floor
+            piece = " "
+        pieces.append(piece)
+        line_start = _line_start_after(piece, line_start)
+
+    if pos < len(text):
+        plain = text[pos:]
+        pieces.append(plain)
+        line_start = _line_start_after(plain, line_start)
+    return "".join(pieces), line_start, hold, floor
+
+
+def _strip_markup_any(text, line_start=True):
+    stripped = _strip_markup(text, line_start)[0]
+    if stripped is not None:
+        return stripped
+    if line_start:
+        return _strip_markup_staged(text)
+    # A leading character that no rule touches keeps "#" at the start from reading as a header
+    return _strip_markup_staged("x" + text)[1:]
+
+
+class SpeechNormalizer:
+    """
+    Turn a markdown answer into plain text for speech: code, links, URLs,
+    formatting, tags and header marks are removed, whitespace is collapsed
+    and symbols and abbreviations are spelled out, in that order.
+
+    Every pattern is compiled once, rules whose trigger character isn't in
+    the text are skipped, and the character-level steps (emphasis,
+    whitespace, replacements) run as str methods rather than regexes.
+
+    Args:
+        symbols (dict): Extra symbols to spell out, after SPEECH_SYMBOLS
+        abbreviations (dict): Extra abbreviations to spell out, after SPEECH_ABBREVIATIONS.
+            Keys can't be empty or contain whitespace.
+    """
+
+    def __init__(self, symbols=None, abbreviations=None):
+        self.replacements = {**SPEECH_SYMBOLS, **(symbols or {}), **SPEECH_ABBREVIATIONS, **(abbreviations or {})}
+        for key in self.replacements:
+            if not key or _WHITESPACE.search(key):
+                raise ValueError(f"Invalid speech replacement key: {key!r}")
+        self.abbreviations = tuple(key for key in self.replacements if key.endswith("."))
+
+    def clean(self, text):
+        """
+        Args:
+            text (str): Markdown
+
+        Returns:
+            str: Text suitable for speech
+        """
+        return self._replace(" ".join(_strip_markup_staged(text).split())).strip()
+
+    def stream(self):
+        """Return a SpeechStream that cleans text arriving in chunks"""
+        return SpeechStream(self)
+
+    def _replace(self, text):
+        for old, new in self.replacements.items():
+            if old in text:
+                text = text.replace(old, new)
+        return text
+
+
+class SpeechStream:
+    """
+    Incremental SpeechNormalizer.clean(). Chunks can split a code fence, a
+    link or a tag anywhere: a one-pass tokenizer over the unsent text finds
+    the last cut that no open construct spans, and text after it is held
+    back until more arrives. The pieces returned by feed() and flush() add
+    up to clean() of the whole text.
+    """
+
+    def __init__(self, normalizer):
+        self.normalizer = normalizer
+        self._buffer = ""
+        self._line_start = True
+        self._space = False      # The last stripped text ended in whitespace
+        self._started = False    # Something other than whitespace was returned
+        self._trailing = ""      # Whitespace held back until more text follows
+
+    def feed(self, chunk, at_boundary=False):
+        """
+        Add a chunk and return the speech text that became final
+
+        Args:
+            chunk (str): Next piece of markdown
+            at_boundary (bool): The text that follows will start with whitespace
+                (as after a SentenceSplitter sentence), so the chunk's last word is complete
+
+        Returns:
+            str: Newly final text, possibly empty
+        """
+        self._buffer += chunk
+        stripped, line_start, hold, floor = _strip_markup(self._buffer, self._line_start)
+        if at_boundary and stripped is not None and hold == len(self._buffer):
+            cut = hold
+        else:
+            # Cut after the last whitespace that no construct still open spans
+            last_space = _LAST_SPACE.match(self._buffer, floor, hold)
+            if not last_space:
+                return ""
+            cut = last_space.end()
+            stripped, line_start = _strip_markup(self._buffer[:cut], self._line_start)[:2]
+        self._buffer = self._buffer[cut:]
+        self._line_start = line_start
+        return self._emit(stripped)
+
+    def flush(self):
+        """Return the rest of the text once the last chunk has been fed"""
+        text = self._emit(_strip_markup_any(self._buffer, self._line_start))
+        self._buffer = ""
+        self._line_start = True
+        self._space = self._started = False
+        self._trailing = ""
+        return text
+
+    def _emit(self, stripped):
+        if not stripped:
+            return ""
+        spoken = self.normalizer._replace(_WHITESPACE.sub(" ", stripped))
+        # Whitespace on both sides of a cut is one run
+        if self._space and stripped[0].isspace():
+            spoken = spoken[1:]
+        self._space = stripped[-1].isspace()
+        if not self._started:
+            spoken = spoken.lstrip()
+            self._started = bool(spoken)
+        spoken = self._trailing + spoken
+        text = spoken.rstrip()
+        self._trailing = spoken[len(text):]
+        return text
+
+
+DEFAULT_NORMALIZER = SpeechNormalizer()
@@ -0,0 +1,317 @@
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+# "memory" (default) keeps everything in st.session_state only;
+# "sqlite" or "sqlite:///path/to/file.db" persists to a local SQLite file
+STORAGE_URL = os.environ.get("CHATAPP_STORAGE", "memory")
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chatapp.db")
+
+# Message keys stored as columns; everything else goes into the JSON meta column
+_MESSAGE_COLUMNS = ("id", "role", "content")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    conversation_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    meta TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_by_conversation ON messages (conversation_id, seq);
+CREATE TABLE IF NOT EXISTS snippets (
+    conversation_id TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    message_id TEXT,
+    code TEXT NOT NULL,
+    language TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (conversation_id, id)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content, content='messages', content_rowid='seq'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS snippets_fts USING fts5(
+    code, filename, content='snippets', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, content) VALUES (new.seq, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.seq, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.seq, old.content);
+    INSERT INTO messages_fts (rowid, content) VALUES (new.seq, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS snippets_ai AFTER INSERT ON snippets BEGIN
+    INSERT INTO snippets_fts (rowid, code, filename) VALUES (new.rowid, new.code, new.filename);
+END;
+CREATE TRIGGER IF NOT EXISTS snippets_ad AFTER DELETE ON snippets BEGIN
+    INSERT INTO snippets_fts (snippets_fts, rowid, code, filename) VALUES ('delete', old.rowid, old.code, old.filename);
+END;
+CREATE TRIGGER IF NOT EXISTS snippets_au AFTER UPDATE ON snippets BEGIN
+    INSERT INTO snippets_fts (snippets_fts, rowid, code, filename) VALUES ('delete', old.rowid, old.code, old.filename);
+    INSERT INTO snippets_fts (rowid, code, filename) VALUES (new.rowid, new.code, new.filename);
+END;
+"""
+
+
+class MemoryStorage:
+    """
+    Default backend: nothing is persisted and the app keeps working from
+    st.session_state alone. Every write is a no-op and every read is empty.
+    """
+
+    persistent = False
+
+    def new_conversation(self):
+        return uuid.uuid4().hex
+
+    def save_message(self, conversation_id, message):
+        pass
+
+    def save_snippet(self, conversation_id, snippet):
+        pass
+
+    def delete_snippet(self, conversation_id, snippet_id):
+        pass
+
+    def load_messages(self, conversation_id, before_id=None, limit=20):
+        return []
+
+    def load_snippets(self, conversation_id):
+        return []
+
+    def search(self, query, conversation_id, limit=20):
+        return []
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteStorage(MemoryStorage):
+    """
+    Persists conversations, messages and snippets in a local SQLite file.
+
+    The database runs in WAL mode so page loads from Streamlit sessions
+    never wait on writes. Writes are queued and applied by one writer thread
+    in batched transactions (every ``flush_interval`` seconds or
+    ``batch_size`` writes). Messages and snippets are indexed with FTS5 for
+    search().
+    """
+
+    persistent = True
+
+    def __init__(self, path=DEFAULT_DB_PATH, flush_interval=0.2, batch_size=100):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        self._local = threading.local()
+        self._writes = queue.Queue()
+        self._closed = False
+
+        connection = self._connect()
+        connection.executescript(_SCHEMA)
+        connection.commit()
+
+        self._writer = threading.Thread(target=self._write_loop, name="sqlite-writer", daemon=True)
+        self._writer.start()
+
+    def new_conversation(self):
+        conversation_id = uuid.uuid4().hex
+        self._enqueue("INSERT OR IGNORE INTO conversations (id, created_at) VALUES (?, ?)",
+                      (conversation_id, time.time()))
+        return conversation_id
+
+    def save_message(self, conversation_id, message):
+        meta = {key: value for key, value in message.items() if key not in _MESSAGE_COLUMNS}
+        self._enqueue(
+            "INSERT INTO messages (id, conversation_id, role, content, meta, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET content = excluded.content, meta = excluded.meta",
+            (message["id"], conversation_id, message["role"], message["content"],
+             json.dumps(meta) if meta else None, time.time())
+        )
+
+    def save_snippet(self, conversation_id, snippet):
+        self._enqueue(
+            "INSERT INTO snippets (conversation_id, id, message_id, code, language, filename, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (conversation_id, id) DO UPDATE SET code = excluded.code",
+            (conversation_id, snippet.id, snippet.message_id, snippet.code, snippet.language,
+             snippet.filename, time.time())
+        )
+
+    def delete_snippet(self, conversation_id, snippet_id):
+        self._enqueue("DELETE FROM snippets WHERE conversation_id = ? AND id = ?", (conversation_id, snippet_id))
+
+    def load_messages(self, conversation_id, before_id=None, limit=20):
+        """
+        Load one page of a conversation
+
+        Args:
+            conversation_id (str): Conversation to read
+            before_id (str): Only return messages older than this message
+            limit (int): Page size
+
+        Returns:
+            list: Message dicts, oldest first
+        """
+        if before_id is None:
+            rows = self._query(
+                "SELECT id, role, content, meta FROM messages WHERE conversation_id = ? "
+                "ORDER BY seq DESC LIMIT ?", (conversation_id, limit))
+        else:
+            rows = self._query(
+                "SELECT id, role, content, meta FROM messages WHERE conversation_id = ? "
+                "AND seq < (SELECT seq FROM messages WHERE id = ?) ORDER BY seq DESC LIMIT ?",
+                (conversation_id, before_id, limit))
+        messages = []
+        for message_id, role, content, meta in reversed(rows):
+            message = {"id": message_id, "role": role, "content": content}
+            if meta:
+                message.update(json.loads(meta))
+            messages.append(message)
+        return messages
+
+    def load_snippets(self, conversation_id):
+        """Return (id, code, language, filename, message_id) rows in insertion order"""
+        return self._query(
+            "SELECT id, code, language, filename, message_id FROM snippets WHERE conversation_id = ? "
+            "ORDER BY id", (conversation_id,))
+
+    def search(self, query, conversation_id, limit=20):
+        """
+        Full-text search over the messages and snippets of one conversation
+
+        Args:
+            query (str): Search terms, each matched as a prefix
+            conversation_id (str): Conversation to search; others are never returned
+            limit (int): Most results to return
+
+        Returns:
+            list: Dicts with kind ("message" or "snippet"), conversation_id and a highlighted excerpt
+        """
+        match = self._match_expression(query)
+        if not match:
+            return []
+        rows = self._query(
+            "SELECT 'message', m.conversation_id, snippet(messages_fts, 0, '**', '**', '…', 12), bm25(messages_fts) "
+            "FROM messages_fts JOIN messages m ON m.seq = messages_fts.rowid "
+            "WHERE messages_fts MATCH ? AND m.conversation_id = ? "
+            "UNION ALL "
+            "SELECT 'snippet', s.conversation_id, s.filename || ': ' || snippet(snippets_fts, 0, '**', '**', '…', 12), "
+            "bm25(snippets_fts) "
+            "FROM snippets_fts JOIN snippets s ON s.rowid = snippets_fts.rowid "
+            "WHERE snippets_fts MATCH ? AND s.conversation_id = ? "
+            "ORDER BY 4 LIMIT ?", (match, conversation_id, match, conversation_id, limit))
+        return [{"kind": kind, "conversation_id": conversation_id, "excerpt": excerpt}
+                for kind, conversation_id, excerpt, _ in rows]
+
+    def flush(self):
+        """Block until every queued write is committed"""
+        self._writes.join()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._writes.put(None)
+            self._writer.join()
+
+    @staticmethod
+    def _match_expression(query):
+        # Quote every term so user input can't break the FTS5 query syntax
+        terms = [term.replace('"', '""') for term in query.split()]
+        return " ".join(f'"{term}"*' for term in terms)
+
+    def _connect(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _query(self, sql, params):
+        return self._connect().execute(sql, params).fetchall()
+
+    def _enqueue(self, sql, params):
+        self._writes.put((sql, params))
+
+    def _write_loop(self):
+        connection = self._connect()
+        while True:
+            batch = [self._writes.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not None:
+                try:
+                    batch.append(self._writes.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+
+            stop = batch[-1] is None
+            writes = [write for write in batch if write is not None]
+            try:
+                with connection:
+                    for sql, params in writes:
+                        connection.execute(sql, params)
+            except sqlite3.Error as e:
+                print(f"Storage write error: {str(e)}")
+            finally:
+                for _ in batch:
+                    self._writes.task_done()
+            if stop:
+                connection.close()
+                return
+
+
+def open_storage(url=STORAGE_URL):
+    """
+    Create the storage backend described by a storage URL
+
+    Args:
+        url (str): "memory", "sqlite" or "sqlite:///path/to/file.db"
+
+    Returns:
+        MemoryStorage: The backend (SQLiteStorage is a subclass)
+    """
+    if url == "memory":
+        return MemoryStorage()
+    if url == "sqlite":
+        return SQLiteStorage()
+    if url.startswith("sqlite:///"):
+        return SQLiteStorage(url[len("sqlite:///"):])
+    raise ValueError(f"Unsupported storage URL: {url}")
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """Return the process-wide storage backend selected by CHATAPP_STORAGE"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = open_storage()
+                atexit.register(_storage.close)
+    return _storage
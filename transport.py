@@ -0,0 +1,217 @@
+import collections
+import os
+import socket
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.exceptions import NameResolutionError
+from urllib3.util.retry import Retry
+
+USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+              'Chrome/126.0.0.0 Safari/537.36')
+
+# Keep-alive connections per host; requests beyond it wait for a free one
+POOL_MAXSIZE = int(os.environ.get("CHATAPP_HTTP_POOL_SIZE", 32))
+
+# Timing of the request currently running on this thread, filled in by the
+# connection classes below when a new socket has to be opened
+_local = threading.local()
+
+
+class RequestTiming:
+    """
+    Per-request timing breakdown in seconds.
+
+    ``dns``, ``connect`` and ``tls`` stay at 0 when a pooled keep-alive
+    connection was reused. ``ttfb`` is the time until the response headers
+    arrived and ``total`` is set by :meth:`finish` once the body is consumed.
+    """
+
+    def __init__(self, method, url):
+        self.method = method
+        self.url = url
+        self.dns = 0.0
+        self.connect = 0.0
+        self.tls = 0.0
+        self.ttfb = 0.0
+        self.total = 0.0
+        self.reused = True
+        self._start = time.perf_counter()
+
+    def finish(self):
+        """Mark the response as fully consumed"""
+        if not self.total:
+            self.total = time.perf_counter() - self._start
+        return self
+
+    def as_dict(self):
+        return {
+            "method": self.method,
+            "url": self.url,
+            "dns": self.dns,
+            "connect": self.connect,
+            "tls": self.tls,
+            "ttfb": self.ttfb,
+            "total": self.total,
+            "reused": self.reused,
+        }
+
+    def __repr__(self):
+        return (f"RequestTiming({self.method} {self.url} dns={self.dns * 1000:.1f}ms "
+                f"connect={self.connect * 1000:.1f}ms tls={self.tls * 1000:.1f}ms "
+                f"ttfb={self.ttfb * 1000:.1f}ms total={self.total * 1000:.1f}ms)")
+
+
+class _TimedConnectionMixin:
+    """Record DNS and TCP connect time of new sockets into the current timing"""
+
+    def _new_conn(self):
+        timing = getattr(_local, "timing", None)
+        if timing is None:
+            return super()._new_conn()
+
+        timing.reused = False
+        host = self._dns_host
+        start = time.perf_counter()
+        try:
+            addrinfo = socket.getaddrinfo(host, self.port, 0, socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            raise NameResolutionError(self.host, self, e) from e
+        resolved = time.perf_counter()
+        timing.dns += resolved - start
+
+        # Connect to the address we just resolved so the lookup isn't repeated
+        self._dns_host = addrinfo[0][4][0]
+        try:
+            sock = super()._new_conn()
+        finally:
+            self._dns_host = host
+        timing.connect += time.perf_counter() - resolved
+        return sock
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+
+    def connect(self):
+        timing = getattr(_local, "timing", None)
+        if timing is None:
+            return super().connect()
+
+        before = timing.dns + timing.connect
+        start = time.perf_counter()
+        super().connect()
+        # Whatever connect() spent beyond DNS and TCP was the TLS handshake
+        socket_setup = timing.dns + timing.connect - before
+        timing.tls += max(0.0, time.perf_counter() - start - socket_setup)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedAdapter(HTTPAdapter):
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+
+class Transport:
+    """
+    Process-wide HTTP client shared by every Streamlit session.
+
+    Wraps a single ``requests.Session`` with a bounded keep-alive connection
+    pool, explicit connect/read timeouts and retries with exponential backoff
+    on connection errors and 5xx responses. Every response carries a
+    :class:`RequestTiming` as ``response.timing``; the most recent ones are
+    also kept in :attr:`timings`.
+    """
+
+    def __init__(self, pool_connections=4, pool_maxsize=POOL_MAXSIZE, connect_timeout=5.0,
+                 read_timeout=60.0, retries=3, backoff_factor=0.3, history=100):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.timings = collections.deque(maxlen=history)
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=None,  # The chat POST is safe to retry before anything was streamed
+            raise_on_status=False,
+        )
+        adapter = _TimedAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                max_retries=retry, pool_block=True)
+
+        self.session = requests.Session()
+        self.session.headers['user-agent'] = USER_AGENT
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request through the shared pool
+
+        Args:
+            method (str): HTTP method
+            url (str): Target URL
+            **kwargs: Passed on to ``requests.Session.request``
+
+        Returns:
+            requests.Response: The response, with a ``timing`` attribute
+        """
+        kwargs.setdefault("timeout", (self.connect_timeout, self.read_timeout))
+        timing = RequestTiming(method, url)
+        _local.timing = timing
+        try:
+            response = self.session.request(method, url, **kwargs)
+        finally:
+            _local.timing = None
+
+        timing.ttfb = response.elapsed.total_seconds()
+        if not kwargs.get("stream"):
+            timing.finish()
+        response.timing = timing
+        self.timings.append(timing)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """Return the process-wide :class:`Transport`, creating it on first use"""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = Transport()
+    return _transport
@@ -1,120 +1,415 @@
-import asyncio
+import bisect
+import concurrent.futures
+import math
 import re
-import uuid
-import tempfile
+import threading
 import os
-import edge_tts
+import metrics
+from audio_cache import AudioCache, get_audio_cache
+from background_loop import get_background_loop
+from scheduler import get_tts_scheduler
+from singleflight import get_singleflight
+from speech_normalizer import DEFAULT_NORMALIZER, SPEECH_REPLACEMENTS  # noqa: F401 (re-exported)
+from voices import get_voice_catalogue
 
+DEFAULT_VOICE = "en-GB-SoniaNeural"
+DEFAULT_RATE = "+0%"
+DEFAULT_PITCH = "+0Hz"
 
-def text_to_speech(text, voice="en-GB-SoniaNeural", max_length=1000):
+# A sentence ends at terminal punctuation followed by whitespace, or at a
+# blank line. Code fences are matched too so that boundaries inside them
+# can be skipped.
+_SENTENCE_BOUNDARY = re.compile(r"```|[.!?](?=\s)|\n\n")
+_ABBREVIATIONS = DEFAULT_NORMALIZER.abbreviations
+
+# Long texts are synthesized as up to TTS_FAN_OUT chunks at once (more, in
+# waves, if a chunk would exceed TTS_MAX_CHUNK_CHARS), so a long answer takes
+# about as long as one chunk; texts shorter than two TTS_MIN_CHUNK_CHARS go
+# in one request
+TTS_FAN_OUT = int(os.environ.get("TTS_FAN_OUT", 4))
+TTS_MIN_CHUNK_CHARS = int(os.environ.get("TTS_MIN_CHUNK_CHARS", 500))
+TTS_MAX_CHUNK_CHARS = int(os.environ.get("TTS_MAX_CHUNK_CHARS", 2000))
+
+# Sentence ends and word gaps in cleaned text, where it can be cut into chunks
+_SPOKEN_SENTENCE_END = re.compile(r"[.!?]\s+")
+_WORD_GAP = re.compile(r"\s+")
+
+
+def text_to_speech(text, voice=DEFAULT_VOICE, rate=DEFAULT_RATE, pitch=DEFAULT_PITCH, fan_out=TTS_FAN_OUT,
+                   session=None):
     """
-    Convert text to speech using the Edge TTS service
+    Convert text to speech using the Edge TTS service. Long texts are split
+    at sentence ends into chunks that are synthesized in parallel and joined
+    into one MP3 file.
     
     Args:
         text (str): The text to convert to speech
         voice (str): The voice to use (default: en-GB-SoniaNeural)
-        max_length (int): Maximum length of text to process (default: 1000)
+        rate (str): Speaking rate adjustment, e.g. "+10%" (default: +0%)
+        pitch (str): Pitch adjustment, e.g. "-5Hz" (default: +0Hz)
+        fan_out (int): Most chunks synthesized at the same time
+        session (str): Who the speech is for, for fair admission between sessions (see scheduler.py)
     
     Returns:
-        str: Path to the generated audio file
+        str: Path to the generated (or cached) audio file
     """
-    # Create a temporary file with a unique name that will be automatically cleaned up
-    temp_dir = tempfile.gettempdir()
-    output_file = os.path.join(temp_dir, f"{uuid.uuid4()}.mp3")
-    
     # Filter and clean the text
-    cleaned_text = clean_text_for_speech(text)
-    
-    # Truncate if too long to avoid processing delays
-    if len(cleaned_text) > max_length:
-        cleaned_text = cleaned_text[:max_length] + "... (content truncated for speech)"
+    with metrics.span("tts_clean"):
+        cleaned_text = clean_text_for_speech(text)
     
     # Skip if there's no content after cleaning
     if not cleaned_text.strip():
         return None
     
-    async def amain():
-        """Main async function to generate speech"""
-        try:
-            communicate = edge_tts.Communicate(cleaned_text, voice)
-            with open(output_file, "wb") as file:
-                async for chunk in communicate.stream():
-                    if chunk["type"] == "audio":
-                        file.write(chunk["data"])
-        except Exception as e:
-            print(f"TTS Error: {str(e)}")
+    count = max(math.ceil(len(cleaned_text) / TTS_MAX_CHUNK_CHARS),
+                min(fan_out, len(cleaned_text) // TTS_MIN_CHUNK_CHARS))
+    chunks = split_for_speech(cleaned_text, count)
+    if len(chunks) > 1:
+        paths = _synthesize_chunks(chunks, voice, rate, pitch, fan_out, session)
+        if paths is None:
             return None
+        with metrics.span("tts_join"):
+            return join_segments(paths)
+    
+    # Repeated text is served straight from the cache
+    cache = get_audio_cache()
+    cached = cache.get(cache.make_key(cleaned_text, voice, rate, pitch))
+    if cached:
+        return cached
+    
+    # Run the async function on the shared background loop
+    return _submit_synthesis(cleaned_text, voice, rate, pitch, session).result()
+
 
-    # Run the async function
-    asyncio.run(amain())
+def split_for_speech(text, count):
+    """
+    Split cleaned text into ``count`` chunks of similar length, each cut at
+    the sentence end nearest to its share of the text (or between words,
+    inside a sentence that long)
     
-    # Return the path to the generated file if it exists and has content
-    if os.path.exists(output_file) and os.path.getsize(output_file) > 0:
-        return output_file
-    else:
-        return None
+    Returns:
+        list: Non-empty chunks, in order (fewer than ``count`` for short texts)
+    """
+    if count <= 1:
+        return [text]
+    size = len(text) / count
+    sentence_ends = [(match.start() + 1, match.end()) for match in _SPOKEN_SENTENCE_END.finditer(text)]
+    word_gaps = None
+    chunks = []
+    start = 0
+    for index in range(1, count):
+        target = index * size
+        cut = _nearest_cut(sentence_ends, target, start, size / 2)
+        if cut is None:
+            if word_gaps is None:
+                word_gaps = [match.span() for match in _WORD_GAP.finditer(text)]
+            cut = _nearest_cut(word_gaps, target, start, size / 2)
+        if cut is not None:
+            chunks.append(text[start:cut[0]])
+            start = cut[1]
+    chunks.append(text[start:])
+    return [chunk for chunk in (chunk.strip() for chunk in chunks) if chunk]
 
 
-def clean_text_for_speech(text):
+def _nearest_cut(cuts, target, after, window):
+    """The (end, next start) pair in sorted ``cuts`` closest to ``target``, past ``after`` and within ``window``"""
+    index = bisect.bisect_left(cuts, (target,))
+    candidates = [cut for cut in cuts[max(index - 1, 0):index + 1] if cut[0] > after and abs(cut[0] - target) <= window]
+    return min(candidates, key=lambda cut: abs(cut[0] - target), default=None)
+
+
+def _synthesize_chunks(chunks, voice, rate, pitch, fan_out, session=None):
     """
-    Clean text by removing code snippets, markdown formatting, and other elements
-    that don't work well in speech
+    Synthesize chunks on the background loop with at most ``fan_out`` in
+    flight; chunks already in the audio cache aren't synthesized again
     
-    Args:
-        text (str): The text to clean
+    Returns:
+        list: Audio paths in chunk order, or None if any chunk failed
+    """
+    cache = get_audio_cache()
+    paths = [cache.get(cache.make_key(chunk, voice, rate, pitch)) for chunk in chunks]
+    pending = {}  # Future -> chunk indexes; a chunk repeated in the text shares its future
+    for index, path in enumerate(paths):
+        if path:
+            continue
+        if len(pending) >= fan_out:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                for done_index in pending.pop(future):
+                    paths[done_index] = future.result()
+        pending.setdefault(_submit_synthesis(chunks[index], voice, rate, pitch, session), []).append(index)
+    for future in concurrent.futures.as_completed(pending):
+        for done_index in pending[future]:
+            paths[done_index] = future.result()
+    metrics.count("tts_chunks", len(chunks))
+    return paths if all(paths) else None
+
+
+def _submit_synthesis(cleaned_text, voice, rate=DEFAULT_RATE, pitch=DEFAULT_PITCH, session=None):
+    """
+    Synthesize on the background loop once the TTS scheduler admits it. The
+    same text in the same voice already being synthesized, e.g. the same
+    answer spoken in several sessions, is waited for instead of synthesized
+    again.
     
     Returns:
-        str: Cleaned text suitable for speech
+        concurrent.futures.Future: Resolves to the audio path, or None
     """
-    # Remove code blocks (```code```)
-    text = re.sub(r"```.*?```", " ", text, flags=re.DOTALL)
+    key = get_audio_cache().make_key(cleaned_text, voice, rate, pitch)
+    return get_singleflight().call(key, lambda: get_background_loop().submit(
+        _admitted_synthesis(cleaned_text, voice, rate, pitch, session), limited=False))
+
+
+async def _admitted_synthesis(cleaned_text, voice, rate, pitch, session):
+    async with get_tts_scheduler().slot(session):
+        return await _synthesize(cleaned_text, voice, rate, pitch)
+
+
+async def _synthesize(cleaned_text, voice, rate=DEFAULT_RATE, pitch=DEFAULT_PITCH):
+    """
+    Stream already cleaned text through edge-tts into the audio cache.
+    Callers are expected to have checked the cache first.
     
-    # Remove inline code (`code`)
-    text = re.sub(r"`[^`]+`", " ", text)
+    Returns:
+        str: Path to the audio file, or None if nothing was produced
+    """
+    import edge_tts  # Imported on first use; it pulls in aiohttp, which is slow to load
     
-    # Remove URLs and links
-    text = re.sub(r"\[([^\]]+)\]\([^)]+\)", r"\1", text)  # Replace [text](url) with just text
-    text = re.sub(r"https?://\S+", " ", text)  # Remove http/https URLs
+    cache = get_audio_cache()
+    key = cache.make_key(cleaned_text, voice, rate, pitch)
+    partial_path = cache.reserve(key)
+    try:
+        with metrics.span("tts_synthesis"):
+            communicate = edge_tts.Communicate(cleaned_text, voice, rate=rate, pitch=pitch)
+            with open(partial_path, "wb") as file:
+                async for chunk in communicate.stream():
+                    if chunk["type"] == "audio":
+                        file.write(chunk["data"])
+    except Exception as e:
+        print(f"TTS Error: {str(e)}")
+        cache.discard(partial_path)
+        return None
     
-    # Remove markdown formatting characters
-    text = re.sub(r"[*_~]", "", text)  # Remove *, _, and ~
+    # Returns None if the file ended up empty
+    return cache.commit(key, partial_path)
+
+
+class SentenceSplitter:
+    """
+    Split a stream of markdown deltas into sentences for speech.
     
-    # Remove HTML tags
-    text = re.sub(r"<[^>]+>", "", text)
+    Boundaries inside code fences and right after ``abbreviations`` (by
+    default the ones in SPEECH_REPLACEMENTS, e.g. "e.g.") are ignored, and
+    sentences shorter than ``min_chars`` are merged into the next one. Each
+    delta is scanned once.
+    """
+
+    def __init__(self, min_chars=20, abbreviations=_ABBREVIATIONS):
+        self.min_chars = min_chars
+        self.abbreviations = abbreviations
+        self.buffer = ""
+        self._start = 0     # Start of the sentence being accumulated
+        self._scanned = 0   # Everything before this offset has been scanned
+        self._in_fence = False
+
+    def feed(self, delta):
+        """
+        Add a delta and return the sentences it completed
+        
+        Args:
+            delta (str): Newly streamed text
+        
+        Returns:
+            list: Completed sentences (raw markdown, not yet cleaned)
+        """
+        self.buffer += delta
+        sentences = []
+        last_end = self._scanned
+        for match in _SENTENCE_BOUNDARY.finditer(self.buffer, self._scanned):
+            last_end = match.end()
+            if match.group() == "```":
+                self._in_fence = not self._in_fence
+            elif not self._in_fence and not self.buffer.endswith(self.abbreviations, 0, last_end):
+                if len(self.buffer[self._start:last_end].strip()) >= self.min_chars:
+                    sentences.append(self.buffer[self._start:last_end])
+                    self._start = last_end
+        
+        # Re-scan the last few characters next time: a fence or a sentence end
+        # may be split across deltas
+        self._scanned = max(last_end, len(self.buffer) - 3, self._start)
+        if self._start:
+            self.buffer = self.buffer[self._start:]
+            self._scanned -= self._start
+            self._start = 0
+        return sentences
+
+    def flush(self):
+        """Return whatever is left once the stream has ended"""
+        rest = self.buffer[self._start:]
+        self.buffer = ""
+        self._start = self._scanned = 0
+        self._in_fence = False
+        return rest
+
+
+class StreamingSpeech:
+    """
+    Pipelined text-to-speech for a response that is still streaming.
     
-    # Remove hashtags and formatting for headers
-    text = re.sub(r"^#+\s", "", text, flags=re.MULTILINE)
+    Feed it the same deltas the chat view renders. Every completed sentence
+    is cleaned (by a SpeechStream, so a link or tag split across sentences is
+    still removed whole) and synthesized right away on the shared background
+    loop, so synthesis overlaps with generation. Audio is available as an
+    ordered list of MP3 segments (see ready() and wait()) or as one growing
+    byte stream (see iter_audio()).
+    """
+
+    def __init__(self, voice=DEFAULT_VOICE, min_chars=20, rate=DEFAULT_RATE, pitch=DEFAULT_PITCH, normalizer=None,
+                 session=None):
+        self.voice = voice
+        self.rate = rate
+        self.pitch = pitch
+        self.session = session  # For fair admission between sessions (see scheduler.py)
+        normalizer = normalizer or DEFAULT_NORMALIZER
+        self.splitter = SentenceSplitter(min_chars=min_chars, abbreviations=normalizer.abbreviations)
+        self.speech_text = normalizer.stream()
+        self.segments = []    # Futures resolving to segment paths, in order
+        self.delivered = []   # Paths already handed out by ready()
+        self.finished = False
+        self._next = 0
+        self._changed = threading.Condition()
+
+    def feed(self, delta):
+        """Consume a streamed delta, synthesizing any sentence it completed"""
+        for sentence in self.splitter.feed(delta):
+            with metrics.span("tts_clean"):
+                cleaned_text = self.speech_text.feed(sentence, at_boundary=True)
+            self._submit(cleaned_text)
+
+    def finish(self):
+        """Synthesize the trailing partial sentence and mark the stream as ended"""
+        with metrics.span("tts_clean"):
+            cleaned_text = self.speech_text.feed(self.splitter.flush()) + self.speech_text.flush()
+        self._submit(cleaned_text)
+        with self._changed:
+            self.finished = True
+            self._changed.notify_all()
+
+    def ready(self):
+        """
+        Return segments that became playable since the last call, in order.
+        A segment still being synthesized holds back the ones after it.
+        
+        Returns:
+            list: Paths of the newly ready audio files
+        """
+        paths = []
+        while self._next < len(self.segments) and self.segments[self._next].done():
+            path = self.segments[self._next].result()
+            self._next += 1
+            if path:
+                paths.append(path)
+        self.delivered.extend(paths)
+        return paths
+
+    def wait(self, timeout=None):
+        """
+        Block until every segment is synthesized
+        
+        Returns:
+            list: Paths of all audio segments, in order
+        """
+        paths = []
+        for future in self.segments:
+            path = future.result(timeout)
+            if path:
+                paths.append(path)
+        return paths
+
+    def iter_audio(self, timeout=None):
+        """Yield the MP3 bytes of each segment in order while they are produced"""
+        index = 0
+        while True:
+            with self._changed:
+                while index >= len(self.segments) and not self.finished:
+                    self._changed.wait(timeout)
+                if index >= len(self.segments):
+                    return
+                future = self.segments[index]
+            index += 1
+            path = future.result(timeout)
+            if path:
+                with open(path, "rb") as file:
+                    yield file.read()
+
+    def _submit(self, cleaned_text):
+        cleaned_text = cleaned_text.strip()
+        if not cleaned_text:
+            return
+        cache = get_audio_cache()
+        cached = cache.get(cache.make_key(cleaned_text, self.voice, self.rate, self.pitch))
+        if cached:
+            future = concurrent.futures.Future()
+            future.set_result(cached)
+        else:
+            future = _submit_synthesis(cleaned_text, self.voice, self.rate, self.pitch, self.session)
+        with self._changed:
+            self.segments.append(future)
+            self._changed.notify_all()
+
+
+def join_segments(paths):
+    """
+    Concatenate MP3 segments into a single file. edge-tts emits plain MP3
+    frames in one format, so the segments can be joined without re-encoding.
     
-    # Remove excessive whitespace, newlines and multiple spaces
-    text = re.sub(r"\n+", " ", text)
-    text = re.sub(r"\s+", " ", text)
+    Returns:
+        str: Path to the joined file, or None if there were no segments
+    """
+    if not paths:
+        return None
+    if len(paths) == 1:
+        return paths[0]
     
-    # Replace common abbreviations and symbols for better speech
-    replacements = {
-        "&": " and ",
-        "@": " at ",
-        "%": " percent ",
-        "e.g.": "for example",
-        "i.e.": "that is",
-        "etc.": "etcetera",
-        "vs.": "versus",
-    }
+    # Segments are content-addressed, so their names identify the joined audio
+    cache = get_audio_cache()
+    key = AudioCache.make_key("join", *(os.path.basename(path) for path in paths))
+    cached = cache.get(key)
+    if cached:
+        return cached
+    partial_path = cache.reserve(key)
+    with open(partial_path, "wb") as out:
+        for path in paths:
+            with open(path, "rb") as file:
+                out.write(file.read())
+    return cache.commit(key, partial_path)
+
+
+def clean_text_for_speech(text):
+    """
+    Clean text by removing code snippets, markdown formatting, and other elements
+    that don't work well in speech
     
-    for old, new in replacements.items():
-        text = text.replace(old, new)
+    Args:
+        text (str): The text to clean
     
-    return text.strip()
+    Returns:
+        str: Cleaned text suitable for speech
+    """
+    return DEFAULT_NORMALIZER.clean(text)
 
 
-def get_available_voices():
+def get_available_voices(locale=None, gender=None):
     """
-    Get a list of available voices for Edge TTS
+    Get a list of available voices for Edge TTS. Served from the cached
+    voice catalogue, so this doesn't wait on the network.
+    
+    Args:
+        locale (str): Only return voices for this locale, e.g. "en-GB"
+        gender (str): Only return "Female" or "Male" voices
     
     Returns:
         list: List of available voice names
     """
-    async def list_voices():
-        voices = await edge_tts.list_voices()
-        return [voice["ShortName"] for voice in voices]
-    
-    return asyncio.run(list_voices())
+    voices = get_voice_catalogue().find(locale=locale, gender=gender)
+    return [voice["ShortName"] for voice in voices]
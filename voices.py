@@ -0,0 +1,178 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+from background_loop import get_background_loop
+
+SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "voices_snapshot.json")
+CACHE_PATH = os.environ.get("TTS_VOICES_CACHE", os.path.join(tempfile.gettempdir(), "chatapp-voices.json"))
+CACHE_TTL = 24 * 60 * 60
+
+# Only the fields the app uses are kept, in memory and on disk
+_VOICE_FIELDS = ("Name", "ShortName", "Gender", "Locale", "FriendlyName")
+
+
+class VoiceCatalogue:
+    """
+    In-memory catalogue of edge-tts voices, indexed by name, locale,
+    language and gender.
+
+    Loading never touches the network: voices come from the on-disk cache
+    when there is one, otherwise from the bundled snapshot. A stale or
+    missing cache is refreshed in the background (unless ``offline``), and
+    the indexes are swapped in once the new list arrives.
+    """
+
+    def __init__(self, cache_path=CACHE_PATH, snapshot_path=SNAPSHOT_PATH, ttl=CACHE_TTL, offline=False):
+        self.cache_path = cache_path
+        self.snapshot_path = snapshot_path
+        self.ttl = ttl
+        self.offline = offline
+        self.source = None
+        self.fetched_at = 0.0
+
+        self._lock = threading.Lock()
+        self._refresh = None
+        self._index([])
+        self.load()
+
+    def load(self):
+        """Load voices from the disk cache or the snapshot, refreshing if stale"""
+        voices, fetched_at = self._read(self.cache_path)
+        if voices:
+            self._set(voices, "cache", fetched_at)
+        else:
+            voices, _ = self._read(self.snapshot_path)
+            self._set(voices, "snapshot", 0.0)
+        if self.is_stale():
+            self.refresh()
+
+    def is_stale(self):
+        return time.time() - self.fetched_at > self.ttl
+
+    def refresh(self, wait=False):
+        """
+        Fetch the live voice list from edge-tts in the background
+
+        Args:
+            wait (bool): Block until the fetch has finished
+
+        Returns:
+            concurrent.futures.Future: The fetch, or None when offline
+        """
+        if self.offline:
+            return None
+        with self._lock:
+            if self._refresh is None or self._refresh.done():
+                self._refresh = get_background_loop().submit(self._fetch())
+            future = self._refresh
+        if wait:
+            try:
+                future.result()
+            except Exception:
+                pass
+        return future
+
+    def get(self, short_name):
+        """Return the voice with this ShortName, or None"""
+        return self._by_name.get(short_name)
+
+    def is_valid(self, short_name):
+        return short_name in self._by_name
+
+    def find(self, locale=None, language=None, gender=None):
+        """
+        Filter voices using the indexes
+
+        Args:
+            locale (str): Full locale, e.g. "en-GB"
+            language (str): Language prefix, e.g. "en"
+            gender (str): "Female" or "Male"
+
+        Returns:
+            list: Matching voices in catalogue order
+        """
+        matches = None
+        for index, key in ((self._by_locale, locale), (self._by_language, language), (self._by_gender, gender)):
+            if key is None:
+                continue
+            names = index.get(key, ())
+            matches = set(names) if matches is None else matches.intersection(names)
+        if matches is None:
+            return list(self._voices)
+        return [voice for voice in self._voices if voice["ShortName"] in matches]
+
+    def short_names(self):
+        return [voice["ShortName"] for voice in self._voices]
+
+    def locales(self):
+        return sorted(self._by_locale)
+
+    async def _fetch(self):
+        import edge_tts  # Only needed for a refresh; slow to import
+        
+        try:
+            voices = [{field: voice.get(field) for field in _VOICE_FIELDS} for voice in await edge_tts.list_voices()]
+        except Exception as e:
+            print(f"Voice list refresh error: {str(e)}")
+            return
+        if not voices:
+            return
+        fetched_at = time.time()
+        self._set(voices, "live", fetched_at)
+        self._write(voices, fetched_at)
+
+    def _set(self, voices, source, fetched_at):
+        with self._lock:
+            self._index(voices)
+            self.source = source
+            self.fetched_at = fetched_at
+
+    def _index(self, voices):
+        # Build new indexes first and swap them in, so readers never see a half-built catalogue
+        by_name, by_locale, by_language, by_gender = {}, {}, {}, {}
+        for voice in voices:
+            name = voice["ShortName"]
+            by_name[name] = voice
+            by_locale.setdefault(voice["Locale"], []).append(name)
+            by_language.setdefault(voice["Locale"].split("-")[0], []).append(name)
+            by_gender.setdefault(voice["Gender"], []).append(name)
+        self._voices = list(voices)
+        self._by_name, self._by_locale = by_name, by_locale
+        self._by_language, self._by_gender = by_language, by_gender
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, encoding="utf-8") as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return [], 0.0
+        if isinstance(data, list):  # The bundled snapshot is a bare list
+            return data, 0.0
+        return data.get("voices", []), data.get("fetched_at", 0.0)
+
+    def _write(self, voices, fetched_at):
+        partial_path = f"{self.cache_path}.{os.getpid()}.part"
+        try:
+            with open(partial_path, "w", encoding="utf-8") as file:
+                json.dump({"fetched_at": fetched_at, "voices": voices}, file)
+            os.replace(partial_path, self.cache_path)
+        except OSError as e:
+            print(f"Voice cache write error: {str(e)}")
+
+
+_catalogue = None
+_catalogue_lock = threading.Lock()
+
+
+def get_voice_catalogue():
+    """Return the process-wide :class:`VoiceCatalogue`, creating it on first use"""
+    global _catalogue
+    if _catalogue is None:
+        with _catalogue_lock:
+            if _catalogue is None:
+                _catalogue = VoiceCatalogue(offline=os.environ.get("TTS_VOICES_OFFLINE") == "1")
+    return _catalogue
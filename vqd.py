@@ -0,0 +1,155 @@
+import collections
+import concurrent.futures
+import os
+import threading
+import time
+
+import metrics
+from transport import get_transport
+
+# Point this at a stand-in (see bench/mock_servers.py) to run without the live service
+DDG_BASE_URL = os.environ.get("DDG_BASE_URL", "https://duckduckgo.com")
+STATUS_URL = f"{DDG_BASE_URL}/duckchat/v1/status"
+TOKEN_HEADER = "X-Vqd-4"
+
+
+class VqdTokenManager:
+    """
+    Keeps a small pool of warm ``X-Vqd-4`` tokens for the DuckDuckGo chat.
+
+    Tokens are fetched from the status endpoint on a background thread so a
+    new conversation can start without waiting on ``/duckchat/v1/status``.
+    Tokens older than ``max_age`` seconds are considered stale and dropped.
+    """
+
+    def __init__(self, transport=None, pool_size=3, max_age=600):
+        self.transport = transport or get_transport()
+        self.pool_size = pool_size
+        self.max_age = max_age
+
+        self._pool = collections.deque()
+        self._lock = threading.Lock()
+        self._refill = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="vqd")
+
+    def fetch(self):
+        """
+        Fetch a brand new token from the status endpoint
+
+        Returns:
+            str: The token, or None if the endpoint didn't return one
+        """
+        headers = {
+            'sec-gpc': '1',
+            'x-vqd-accept': '1'
+        }
+        with metrics.span("vqd_fetch"):
+            response = self.transport.get(STATUS_URL, headers=headers)
+        return response.headers.get(TOKEN_HEADER)
+
+    def acquire(self):
+        """
+        Take a warm token from the pool, falling back to a synchronous fetch
+        when the pool is empty. Either way a background refill is scheduled.
+
+        Returns:
+            tuple: (token, fetched_at) where fetched_at is a monotonic timestamp
+        """
+        now = time.monotonic()
+        with self._lock:
+            while self._pool:
+                token, fetched_at = self._pool.popleft()
+                if not self.is_expired(fetched_at, now):
+                    break
+            else:
+                token = None
+
+        if token is None:
+            token, fetched_at = self.fetch(), now
+        self.prefetch()
+        return token, fetched_at
+
+    def prefetch(self):
+        """Top the pool up in the background, if a refill isn't already running"""
+        with self._lock:
+            if self._refill is not None and not self._refill.done():
+                return self._refill
+            self._refill = self._executor.submit(self._fill_pool)
+            return self._refill
+
+    def is_expired(self, fetched_at, now=None):
+        return (now or time.monotonic()) - fetched_at > self.max_age
+
+    def warm_count(self):
+        with self._lock:
+            return len(self._pool)
+
+    def _fill_pool(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._pool and self.is_expired(self._pool[0][1], now):
+                    self._pool.popleft()
+                if len(self._pool) >= self.pool_size:
+                    return
+            try:
+                token = self.fetch()
+            except Exception as e:
+                print(f"VQD prefetch error: {str(e)}")
+                return
+            if not token:
+                return
+            with self._lock:
+                self._pool.append((token, time.monotonic()))
+
+
+def token_from_response(response):
+    """Return the rotated token sent back with a chat response, if any"""
+    return response.headers.get(TOKEN_HEADER)
+
+
+class ConversationToken:
+    """
+    The token of one conversation. It starts from a warm pooled token and is
+    replaced by the rotated token every chat response sends back. Safe to
+    use from the worker thread running the turn.
+    """
+
+    def __init__(self, manager=None):
+        self.manager = manager or get_token_manager()
+        self.value = None
+        self.fetched_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, refresh=False):
+        """Return the current token, taking a fresh one if asked, unset or expired"""
+        with self._lock:
+            if refresh or not self.value or self.manager.is_expired(self.fetched_at):
+                self.value, self.fetched_at = self.manager.acquire()
+            return self.value
+
+    def update(self, response):
+        """Keep the rotated token from a chat response"""
+        token = token_from_response(response)
+        if token:
+            with self._lock:
+                self.value, self.fetched_at = token, time.monotonic()
+
+    def reset(self):
+        """Start the next conversation on a fresh token"""
+        with self._lock:
+            self.value, self.fetched_at = None, 0.0
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_token_manager():
+    """Return the process-wide :class:`VqdTokenManager`, creating it on first use"""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = VqdTokenManager()
+    return _manager